@@ -0,0 +1,3 @@
+"""
+Micro benchmarks - run as e.g. python -m benchmarks.insert_rate.
+"""
@@ -0,0 +1,72 @@
+"""
+Measure combining per sensor frames into per column frames.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from web import data_proc
+
+
+def _legacy_combine(frames):
+    """
+    The previous approach - grow one frame per column with concat.
+    """
+    res = {}
+    for key, tmp in frames.items():
+        for column in sorted(tmp.columns.tolist()):
+            series = tmp[column]
+            if column not in res:
+                res[column] = pd.DataFrame(series.tolist(),
+                                           columns=[key],
+                                           index=series.index)
+            else:
+                res[column] = pd.concat((res[column], series.rename(key)),
+                                        axis=1,
+                                        join='outer')
+    for key, val in res.items():
+        res[key] = val.ffill().dropna(axis=0)
+    return res
+
+
+def _frames(sensors, points=288):
+    """
+    Create resampled looking frames - every sensor slightly shifted.
+    """
+    res = {}
+    rand = np.random.default_rng(42)
+    for i in range(sensors):
+        index = pd.date_range('2017-01-01', periods=points, freq='5min',
+                              tz='UTC') + pd.Timedelta(minutes=5 * (i % 3))
+        tmp = pd.DataFrame({'temperature': rand.normal(20, 2, points),
+                            'humidity': rand.normal(50, 5, points)},
+                           index=index)
+        res[f'sensor{i}'] = data_proc.add_metrics(tmp)
+    return res
+
+
+def _time(func, frames, repeat=3):
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func(frames)
+        duration = time.perf_counter() - begin
+        best = duration if best is None else min(best, duration)
+    return best * 1000
+
+
+def main():
+    """
+    Scale the number of sensors from 2 to 200.
+    """
+    print('sensors   concat loop    single pass')
+    for sensors in [2, 10, 50, 100, 200]:
+        frames = _frames(sensors)
+        print(f'{sensors:7d} {_time(_legacy_combine, frames):11.1f}ms '
+              f'{_time(data_proc.combine, frames):12.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Bytes on the wire for the dashboard - plain, compressed & revalidated.
+"""
+
+import datetime
+import io
+import os
+import sys
+import tempfile
+import time
+
+import bottle
+
+from iot import sense
+from web import compress
+from web import wsgi_app
+
+
+def _call(app, path, query='', **headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+               'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '443', 'wsgi.url_scheme': 'https',
+               'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr}
+    login = bottle.BaseResponse()
+    login.set_cookie('account', 'foo', secret=wsgi_app.PASSPHRASE)
+    environ['HTTP_COOKIE'] = login.headerlist[-1][1].split(';')[0]
+    environ.update({f'HTTP_{key.upper()}': val
+                    for key, val in headers.items()})
+    res = {}
+
+    def start_response(status, headers, exc_info=None):
+        res.update({key.lower(): val for key, val in headers})
+        res['status'] = status
+    body = b''.join(app(environ, start_response))
+    return res, len(body)
+
+
+def main(sensors=4, days=2):
+    """
+    Samples every minute of a few sensors.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    database = os.path.join(tmp_dir, 'bench.sqlite3')
+    end = time.mktime(datetime.datetime(2017, 1, 3).timetuple())
+    first = datetime.datetime.fromtimestamp(end - days * 86400)
+    for i in range(sensors):
+        db_wrap = sense.DbWrapper(f'sensor{i}', database)
+        db_wrap.insert_many([(first + datetime.timedelta(minutes=j),
+                              {'temperature': 20.0 + (j % 37) / 10.0,
+                               'humidity': 50.0 + (j % 23) / 10.0})
+                             for j in range(1, days * 1440 + 1)])
+        db_wrap.close()
+
+    app = compress.CompressMiddleware(
+        wsgi_app.MainApp(database, 86400, '5Min', 'foo', 'bar').app)
+    window = f'start={end - 86400}&end={end}'
+    for name, path, query in (
+            ('index', '/', ''),
+            ('series', '/api/series', window + '&points=1000'),
+            ('csv download', '/download/sensor0', window)):
+        headers, plain = _call(app, path, query)
+        line = f'{name:>12}: {plain:9d} bytes'
+        for encoding in compress.ENCODINGS:
+            headers, size = _call(app, path, query,
+                                  accept_encoding=encoding)
+            line += f', {encoding} {size:8d} ({size / plain:5.1%})'
+        if 'etag' in headers:
+            headers, size = _call(app, path, query,
+                                  accept_encoding=encoding,
+                                  if_none_match=headers['etag'])
+            line += f', {headers["status"][:3]} {size} bytes'
+        print(line)
+    print(app.stats())
+
+    os.remove(database)
+    os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
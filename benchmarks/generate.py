@@ -0,0 +1,89 @@
+"""
+Synthetic sensor databases of configurable size - e.g.:
+
+    python -m benchmarks.generate bench.sqlite3 --sensors 8 --days 30
+"""
+
+import argparse
+import datetime
+import math
+import random
+import time
+
+from iot import sense
+from iot import storage
+
+# column names - the first two make the derived metrics kick in.
+COLUMNS = ('temperature', 'humidity', 'pressure', 'co2', 'light', 'noise')
+# fixed end so runs produce the same data.
+END = datetime.datetime(2017, 1, 31)
+
+
+def _value(rnd, index, epoch):
+    """
+    Daily cycle plus noise - offset per column so they differ.
+    """
+    day = math.sin(2 * math.pi * (epoch % 86400) / 86400)
+    return round(10.0 * (index + 2) + (index + 1) * 5.0 * day +
+                 rnd.gauss(0, 0.5), 2)
+
+
+def generate(database, sensors=4, columns=2, interval=60, days=7.0,
+             end=END, seed=0, batch=10000, rollups=storage.ROLLUP_WIDTHS):
+    """
+    Add sensors tables (sensor0, sensor1, ...) with the first columns of
+    COLUMNS and one sample every interval seconds over the given number of
+    days up to end. The same arguments always give the same data.
+
+    Returns start & end (epoch seconds) and the rows inserted.
+    """
+    if not 0 < columns <= len(COLUMNS):
+        raise AttributeError(f'columns should be between 1 and '
+                             f'{len(COLUMNS)}.')
+    rnd = random.Random(seed)
+    last = time.mktime(end.timetuple())
+    count = int(days * 86400 // interval)
+    first = last - (count - 1) * interval
+    names = COLUMNS[:columns]
+    for i in range(sensors):
+        db_wrap = sense.DbWrapper(f'sensor{i}', database, rollups=rollups)
+        for j in range(0, count, batch):
+            rows = []
+            for k in range(j, min(j + batch, count)):
+                epoch = first + k * interval
+                rows.append((datetime.datetime.fromtimestamp(epoch),
+                             {name: _value(rnd, n, epoch)
+                              for n, name in enumerate(names)}))
+            db_wrap.insert_many(rows)
+        db_wrap.close()
+    return first, last, sensors * count
+
+
+def add_arguments(parser):
+    """
+    Add the size options of generate to an argument parser.
+    """
+    parser.add_argument('--sensors', type=int, default=4)
+    parser.add_argument('--columns', type=int, default=2)
+    parser.add_argument('--interval', type=float, default=60,
+                        help='seconds between samples')
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def main():
+    """
+    Create a database from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('database')
+    add_arguments(parser)
+    args = parser.parse_args()
+    begin = time.perf_counter()
+    _, _, rows = generate(args.database, args.sensors, args.columns,
+                          args.interval, args.days, seed=args.seed)
+    print(f'{rows} rows in {time.perf_counter() - begin:.1f}s.')
+
+
+if __name__ == '__main__':
+    main()
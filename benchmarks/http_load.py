@@ -0,0 +1,112 @@
+"""
+Load test the HTTPS server - single threaded wsgiref vs. the thread pool
+with keep-alive.
+"""
+
+import http.client
+import multiprocessing
+import os
+import socket
+import ssl
+import threading
+import time
+
+from wsgiref import simple_server
+
+import bottle
+import numpy as np
+
+from web import bottle_ssl
+
+FILES = os.path.join(os.path.dirname(__file__), os.pardir, 'tests', 'files')
+KEY = os.path.join(FILES, 'key.pem')
+CERT = os.path.join(FILES, 'cert.pem')
+
+
+def serve(port, options):
+    """
+    Serve a small app with a fast and a slow route.
+    """
+    # no access log.
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 2)
+    app = bottle.Bottle()
+    app.route('/', callback=lambda: 'x' * 2048)
+
+    def slow():
+        # a dashboard query.
+        time.sleep(0.05)
+        return 'done'
+    app.route('/slow', callback=slow)
+    bottle_ssl.SecureServerAdapter(KEY, CERT, '127.0.0.1', port,
+                                   **options).run(bottle_ssl.get_app(app))
+
+
+def _client(port, requests, latencies):
+    context = ssl.create_default_context(cafile=CERT)
+    conn = http.client.HTTPSConnection('127.0.0.1', port, context=context)
+    for i in range(requests):
+        begin = time.perf_counter()
+        conn.request('GET', '/slow' if i % 10 == 0 else '/')
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - begin)
+    conn.close()
+
+
+def start(options):
+    """
+    Start the server in its own process - returns process and port.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    proc = multiprocessing.Process(target=serve, args=(port, options),
+                                   daemon=True)
+    proc.start()
+    context = ssl.create_default_context(cafile=CERT)
+    while True:
+        try:
+            context.wrap_socket(socket.create_connection(('127.0.0.1', port)),
+                                server_hostname='127.0.0.1').close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    return proc, port
+
+
+def run(name, options, clients, requests):
+    """
+    Hit the server with concurrent clients.
+    """
+    proc, port = start(options)
+    latencies = []
+    threads = [threading.Thread(target=_client,
+                                args=(port, requests, latencies))
+               for _ in range(clients)]
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - begin
+    proc.terminate()
+    proc.join()
+
+    tmp = np.array(latencies) * 1000
+    print(f'{name:>12}: {len(tmp) / duration:8.1f} req/s, '
+          f'p50 {np.percentile(tmp, 50):7.1f}ms, '
+          f'p99 {np.percentile(tmp, 99):7.1f}ms')
+
+
+def main(clients=16, requests=50):
+    """
+    Every tenth request is slow (50ms).
+    """
+    print(f'{clients} clients x {requests} requests:')
+    run('wsgiref', {'server_class': simple_server.WSGIServer,
+                    'handler_class': bottle_ssl.FixedHandler},
+        clients, requests)
+    run('pool', {'pool_size': clients}, clients, requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Measure inserts/sec of the DbWrapper.
+"""
+
+import datetime
+import os
+import tempfile
+import time
+
+from iot import sense
+
+
+def _run(persistent, rows, batch=1):
+    """
+    Insert the given number of rows & return the rate in inserts/sec.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    database = os.path.join(tmp_dir, 'bench.sqlite3')
+    db_wrap = sense.DbWrapper('bench', database, persistent=persistent)
+    start = datetime.datetime(2017, 1, 1)
+    samples = [(start + datetime.timedelta(seconds=i),
+                {'temperature': 21.5, 'humidity': 45.0})
+               for i in range(rows)]
+
+    begin = time.perf_counter()
+    for i in range(0, rows, batch):
+        db_wrap.insert_many(samples[i:i + batch])
+    duration = time.perf_counter() - begin
+
+    db_wrap.close()
+    os.remove(database)
+    os.rmdir(tmp_dir)
+    return rows / duration
+
+
+def main(rows=2000):
+    """
+    Compare connection per insert, persistent connection and batching.
+    """
+    print(f'connection per insert: {_run(False, rows):10.0f} inserts/sec')
+    print(f'persistent connection: {_run(True, rows):10.0f} inserts/sec')
+    print(f'persistent, batch 100: {_run(True, rows, 100):10.0f} inserts/sec')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Compare reading the sensors of a dashboard request one after the other with
+reading them concurrently in a ReadPool.
+"""
+
+import os
+import sys
+import tempfile
+
+from benchmarks import generate
+from benchmarks import suite
+from web import data_proc
+
+
+def main(sensors=50, days=1):
+    """
+    Sensors with two columns sampled every minute.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    database = os.path.join(tmp_dir, 'bench.sqlite3')
+    _, end, rows = generate.generate(database, sensors, days=days)
+    start = end - days * 86400
+
+    print(f'{sensors} sensors, {rows} rows, {os.cpu_count()} cpus:')
+    for aggregate in (None, 'avg'):
+        serial = None
+        for workers in (1, 2, 4, 8):
+            pool = data_proc.ReadPool(workers) if workers > 1 else None
+            best, _ = suite.measure(
+                lambda: data_proc.get_data(database, start, end, '5Min',
+                                           aggregate=aggregate, pool=pool))
+            serial = serial or best
+            print(f'  {aggregate or "pandas":>6}, {workers} workers: '
+                  f'{best:8.1f}ms ({serial / best:4.2f}x)')
+            if pool is not None:
+                pool.close()
+
+    os.remove(database)
+    os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(sys.argv[1])] if len(sys.argv) > 1 else [])
@@ -0,0 +1,81 @@
+"""
+Compare pandas, SQL and rollup based resampling of SensorData.get_data.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from iot import storage
+from web import data_proc
+
+
+def _create(database, rows):
+    """
+    Create a sensor table with one sample per second.
+    """
+    conn = sqlite3.connect(database)
+    storage.create_table(conn, 'bench', {'temperature': 1.0,
+                                         'humidity': 1.0})
+    end = int(time.time()) * 1000
+    start = end - rows * 1000
+    conn.executemany('INSERT INTO bench VALUES (?, ?, ?)',
+                     ((start + i * 1000, 20 + (i % 100) / 10.0,
+                       40 + (i % 50) / 10.0) for i in range(rows)))
+    conn.commit()
+    conn.close()
+    return start // 1000, end // 1000
+
+
+def _time(func, repeat=3):
+    """
+    Return the best out of repeat runs in ms & the result.
+    """
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        res = func()
+        duration = time.perf_counter() - begin
+        best = duration if best is None else min(best, duration)
+    return best * 1000, res
+
+
+def main(rows=2000000, resample='5Min'):
+    """
+    Run the benchmark over a table with the given number of rows.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    database = os.path.join(tmp_dir, 'bench.sqlite3')
+    start, end = _create(database, rows)
+    sensor = data_proc.SensorData('bench', database, resample)
+
+    print(f'{rows} rows, resample {resample}:')
+    duration, res = _time(lambda: sensor.get_data(start - 1, end))
+    print(f'  pandas resample/bfill: {duration:8.1f}ms ({len(res)} rows)')
+    for item in data_proc.AGGREGATES:
+        duration, res = _time(lambda: sensor.get_data(start - 1, end,
+                                                      aggregate=item))
+        print(f'  sql {item:>5}:             {duration:8.1f}ms '
+              f'({len(res)} rows)')
+
+    conn = sqlite3.connect(database)
+    for width in storage.ROLLUP_WIDTHS:
+        storage.create_rollup(conn, 'bench', width, ['temperature',
+                                                     'humidity'])
+    conn.commit()
+    conn.close()
+    for item in ['avg', 'min', 'max', 'last']:
+        duration, res = _time(lambda: sensor.get_data(start - 1, end,
+                                                      aggregate=item))
+        print(f'  rollup {item:>5}:          {duration:8.1f}ms '
+              f'({len(res)} rows)')
+
+    sensor.close()
+    os.remove(database)
+    os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(sys.argv[1])] if len(sys.argv) > 1 else [])
@@ -0,0 +1,58 @@
+"""
+Compare recomputing a sliding window with refreshing it incrementally.
+"""
+
+import datetime
+import os
+import tempfile
+import time
+
+from iot import sense
+from web import data_proc
+
+
+def main(window=86400, step=10):
+    """
+    1 Hz data over the window - then step new seconds of data arrive.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    database = os.path.join(tmp_dir, 'bench.sqlite3')
+    db_wrap = sense.DbWrapper('bench', database, rollups=())
+    end = time.mktime(datetime.datetime(2017, 1, 2).timetuple())
+    first = datetime.datetime.fromtimestamp(end - window)
+    db_wrap.insert_many([(first + datetime.timedelta(seconds=i),
+                          {'temperature': 20.0 + i % 10})
+                         for i in range(1, window + 1)])
+
+    sensor = data_proc.SensorData('bench', database, '5Min')
+    cache = data_proc.QueryCache()
+    cache.get_data(sensor, end - window, end)
+
+    full = incremental = 0.0
+    for i in range(10):
+        db_wrap.insert_many([(first + datetime.timedelta(seconds=j),
+                              {'temperature': 20.0})
+                             for j in range(window + 1 + i * step,
+                                            window + 1 + (i + 1) * step)])
+        end += step
+
+        begin = time.perf_counter()
+        sensor.get_data(end - window, end)
+        full += time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        cache.get_data(sensor, end - window, end)
+        incremental += time.perf_counter() - begin
+
+    print(f'window {window}s, {step}s of new data per request:')
+    print(f'  full recompute: {full * 100:8.1f}ms')
+    print(f'  incremental:    {incremental * 100:8.1f}ms')
+
+    db_wrap.close()
+    sensor.close()
+    os.remove(database)
+    os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
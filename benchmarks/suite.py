@@ -0,0 +1,231 @@
+"""
+Benchmark suite over a synthetic database - results are written as JSON so
+runs can be compared, e.g.:
+
+    python -m benchmarks.suite --days 30 --output new.json --compare old.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import bottle
+import numpy as np
+import pandas as pd
+
+from benchmarks import generate
+from iot import sense
+from web import data_proc
+from web import wsgi_app
+
+# window lengths (in seconds) of the query benchmarks.
+WINDOWS = (3600, 86400, 7 * 86400, 30 * 86400)
+
+
+def measure(func, repeat=5):
+    """
+    Run func repeat times - returns best & median duration in ms.
+    """
+    durations = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - begin) * 1000)
+    return min(durations), statistics.median(durations)
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _ingest(tmp_dir, rows=2000, batch=1000):
+    """
+    Inserts/sec of single inserts & batches (incl. the rollups).
+    """
+    res = {}
+    for name, size in (('single', 1), ('batch', batch)):
+        database = os.path.join(tmp_dir, f'ingest_{name}.sqlite3')
+        db_wrap = sense.DbWrapper('bench', database)
+        first = generate.END - datetime.timedelta(seconds=rows)
+        samples = [(first + datetime.timedelta(seconds=i),
+                    {'temperature': 21.5, 'humidity': 45.0})
+                   for i in range(rows)]
+        begin = time.perf_counter()
+        for i in range(0, rows, size):
+            db_wrap.insert_many(samples[i:i + size])
+        res[f'ingest.{name}.rows_per_sec'] = \
+            rows / (time.perf_counter() - begin)
+        db_wrap.close()
+        os.remove(database)
+    return res
+
+
+def _queries(database, end, days, sample_rate, repeat):
+    """
+    Latency of SensorData.get_data (pandas & SQL bucketing) and of
+    data_proc.get_data per window length.
+    """
+    res = {}
+    sensor = data_proc.SensorData('sensor0', database, sample_rate)
+    for window in WINDOWS:
+        if window > days * 86400:
+            continue
+        start = end - window
+        for name, func in (
+                ('sensor.pandas',
+                 lambda: sensor.get_data(start, end)),
+                ('sensor.avg',
+                 lambda: sensor.get_data(start, end, aggregate='avg')),
+                ('get_data.avg',
+                 lambda: data_proc.get_data(database, start, end,
+                                            sample_rate, aggregate='avg'))):
+            best, median = measure(func, repeat)
+            res[f'query.{name}.{window}.best_ms'] = best
+            res[f'query.{name}.{window}.median_ms'] = median
+    sensor.close()
+    return res
+
+
+def _call(app, path, query=''):
+    """
+    Call the WSGI app as a logged in user - returns the body size.
+    """
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+               'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '443', 'wsgi.url_scheme': 'https',
+               'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr}
+    login = bottle.BaseResponse()
+    login.set_cookie('account', 'foo', secret=wsgi_app.PASSPHRASE)
+    environ['HTTP_COOKIE'] = login.headerlist[-1][1].split(';')[0]
+    res = []
+    body = b''.join(app(environ, lambda status, headers, exc_info=None:
+                        res.append(status)))
+    if not res[0].startswith('200'):
+        raise RuntimeError(f'{path} returned {res[0]}.')
+    return len(body)
+
+
+def _render(database, end, sample_rate, repeat):
+    """
+    End-to-end time of the dashboard & the series it loads.
+    """
+    app = wsgi_app.MainApp(database, 86400, sample_rate, 'foo', 'bar',
+                           aggregate='avg').app
+    window = f'start={end - 86400}&end={end}&points=1000'
+    res = {}
+    for name, path, query in (('index', '/', ''),
+                              ('series', '/api/series', window)):
+        best, median = measure(lambda: _call(app, path, query), repeat)
+        res[f'render.{name}.best_ms'] = best
+        res[f'render.{name}.median_ms'] = median
+    return res
+
+
+def _memory(database, end, days, sample_rate):
+    """
+    Peak Python heap of data_proc.get_data over the whole database (pandas
+    resampling) & the peak RSS of the process.
+    """
+    tracemalloc.start()
+    data_proc.get_data(database, end - days * 86400, end, sample_rate)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'memory.get_data.peak_mb': peak / 2 ** 20,
+            # KB on Linux.
+            'memory.process.max_rss_mb':
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10}
+
+
+def run(sensors=4, columns=2, interval=60, days=7, seed=0,
+        sample_rate='5Min', repeat=5):
+    """
+    Generate a database of the given size & run all benchmarks on it.
+    """
+    params = {'sensors': sensors, 'columns': columns, 'interval': interval,
+              'days': days, 'seed': seed, 'sample_rate': sample_rate,
+              'repeat': repeat}
+    tmp_dir = tempfile.mkdtemp()
+    database = os.path.join(tmp_dir, 'bench.sqlite3')
+    try:
+        begin = time.perf_counter()
+        _, end, rows = generate.generate(database, sensors, columns,
+                                         interval, days, seed=seed)
+        results = {'generate.rows': rows,
+                   'generate.seconds': time.perf_counter() - begin,
+                   'generate.db_mb': os.path.getsize(database) / 2 ** 20}
+        results.update(_ingest(tmp_dir))
+        results.update(_queries(database, end, days, sample_rate, repeat))
+        results.update(_render(database, end, sample_rate, repeat))
+        results.update(_memory(database, end, days, sample_rate))
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+    return {'meta': {'created': datetime.datetime.utcnow().isoformat(),
+                     'commit': _commit(),
+                     'python': platform.python_version(),
+                     'sqlite': sqlite3.sqlite_version,
+                     'pandas': pd.__version__,
+                     'numpy': np.__version__,
+                     'machine': platform.machine(),
+                     'params': params},
+            'results': results}
+
+
+def compare(old, new):
+    """
+    Print the results of two runs side by side - ratio is new / old.
+    """
+    if old['meta']['params'] != new['meta']['params']:
+        print('Warning: runs used different parameters.')
+    for key, val in new['results'].items():
+        before = old['results'].get(key)
+        ratio = f'{val / before:6.2f}x' if before else '     -'
+        before = f'{before:12.2f}' if before is not None else ' ' * 12
+        print(f'{key:<40} {before} {val:12.2f} {ratio}')
+
+
+def main():
+    """
+    Run from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    generate.add_arguments(parser)
+    parser.add_argument('--sample-rate', default='5Min')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='file to write the results to')
+    parser.add_argument('--compare', help='results of an earlier run')
+    args = parser.parse_args()
+
+    res = run(args.sensors, args.columns, args.interval, args.days,
+              args.seed, args.sample_rate, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(res, out, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as old:
+            compare(json.load(old), res)
+    else:
+        for key, val in res['results'].items():
+            print(f'{key:<40} {val:12.2f}')
+
+
+if __name__ == '__main__':
+    main()
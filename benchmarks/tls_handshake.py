@@ -0,0 +1,57 @@
+"""
+Handshake throughput of the HTTPS server with and without TLS session
+resumption.
+"""
+
+import socket
+import ssl
+import time
+
+from benchmarks import http_load
+
+
+def _connect(context, port, session=None):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock = context.wrap_socket(sock, server_hostname='127.0.0.1',
+                               session=session)
+    sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n'
+                 b'Connection: close\r\n\r\n')
+    while sock.recv(65536):
+        pass
+    # TLS 1.3 tickets arrive after the handshake - read above.
+    session = sock.session
+    sock.close()
+    return session
+
+
+def run(name, port, connections, version, resume):
+    """
+    Open connections one after the other (one request each).
+    """
+    context = ssl.create_default_context(cafile=http_load.CERT)
+    context.maximum_version = version
+    session = _connect(context, port)
+    begin = time.perf_counter()
+    for _ in range(connections):
+        tmp = _connect(context, port, session if resume else None)
+        session = tmp if resume else session
+    duration = time.perf_counter() - begin
+    print(f'{name:>18}: {connections / duration:8.1f} connections/s, '
+          f'{duration / connections * 1000:6.2f}ms each')
+
+
+def main(connections=500):
+    """
+    Full handshakes vs. resumed sessions for TLS 1.2 and 1.3.
+    """
+    proc, port = http_load.start({})
+    for version in (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3):
+        run(f'{version.name} full', port, connections, version, False)
+        run(f'{version.name} resumed', port, connections, version, True)
+    proc.terminate()
+    proc.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Counters & timing histograms for the hot paths - exported in the Prometheus
+text format.
+
+Collecting is off by default: while disabled updates return after checking
+one flag and timers do not even read the clock.
+"""
+
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+# upper bounds (in seconds) of the histogram buckets.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+ENABLED = False
+
+
+def enable(flag=True):
+    """
+    Switch collecting on (or off).
+    """
+    global ENABLED
+    ENABLED = flag
+
+
+class Counter:
+    """
+    Monotonically increasing count.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, value=1):
+        """
+        Increase the count - if enabled.
+        """
+        if not ENABLED:
+            return
+        with self._lock:
+            self.value += value
+
+    def render(self):
+        """
+        Return the sample lines.
+        """
+        return [f'{self.name} {self.value:g}']
+
+
+class _Timer:
+    """
+    Context manager observing the time spent in its block.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.begin = None
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.begin)
+
+
+_NULL = contextlib.nullcontext()
+
+
+class Histogram:
+    """
+    Distribution of observed values (durations in seconds) over fixed
+    buckets.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, doc, buckets=BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Add a value - if enabled.
+        """
+        if not ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        """
+        Return a context manager timing its block.
+        """
+        if not ENABLED:
+            return _NULL
+        return _Timer(self)
+
+    def render(self):
+        """
+        Return the sample lines - bucket counts are cumulative.
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        res = []
+        count = 0
+        for bound, item in zip(self.buckets + (float('inf'),), counts):
+            count += item
+            bound = '+Inf' if bound == float('inf') else f'{bound:g}'
+            res.append(f'{self.name}_bucket{{le="{bound}"}} {count}')
+        res.append(f'{self.name}_sum {total:g}')
+        res.append(f'{self.name}_count {count}')
+        return res
+
+
+class Registry:
+    """
+    Metrics by name.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, doc):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, doc)
+            elif not isinstance(self.metrics[name], cls):
+                raise AttributeError(f'{name} is already a '
+                                     f'{self.metrics[name].kind}.')
+            return self.metrics[name]
+
+    def counter(self, name, doc):
+        """
+        Return the counter with the given name - created if needed.
+        """
+        return self._get(Counter, name, doc)
+
+    def histogram(self, name, doc):
+        """
+        Return the histogram with the given name - created if needed.
+        """
+        return self._get(Histogram, name, doc)
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text format.
+        """
+        res = []
+        for name, item in sorted(self.metrics.items()):
+            res.append(f'# HELP {name} {item.doc}')
+            res.append(f'# TYPE {name} {item.kind}')
+            res.extend(item.render())
+        return '\n'.join(res) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, doc):
+    """
+    Return a counter of the default registry.
+    """
+    return REGISTRY.counter(name, doc)
+
+
+def histogram(name, doc):
+    """
+    Return a histogram of the default registry.
+    """
+    return REGISTRY.histogram(name, doc)
+
+
+def timed(hist):
+    """
+    Decorator observing the duration of every call in the histogram.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            begin = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - begin)
+        return wrapper
+    return decorator
+
+
+def render():
+    """
+    Return the metrics of the default registry in the Prometheus text
+    format.
+    """
+    return REGISTRY.render()
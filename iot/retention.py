@@ -0,0 +1,192 @@
+"""
+Tiered retention - old raw samples are replaced by per bucket aggregates.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from iot import storage
+
+
+def enable_incremental_vacuum(conn, force=False):
+    """
+    Switch the database to incremental auto vacuum - returns True if it is.
+
+    This needs a VACUUM of the whole file, so it is only done for databases
+    without sensor tables unless force is set.
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return True
+    if storage.sensor_tables(conn) and not force:
+        logging.info('Database does not use incremental auto vacuum - freed '
+                     'pages are reused but the file will not shrink.')
+        return False
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+class Retention(threading.Thread):
+    """
+    Keep raw samples for raw_days; older ones are rolled up into buckets of
+    width seconds (the rollup table of that width) and deleted - as are the
+    buckets of finer rollup tables. Runs every interval seconds.
+
+    Rows are removed in transactions of about batch_size rows with pause
+    seconds in between, so the sensor writers are never locked out for
+    long. Each bucket is recomputed from its raw rows right before they are
+    deleted. Tables with columns which cannot be rolled up (e.g. text) are
+    left alone. Afterwards the free pages are handed back to the file
+    system by an incremental vacuum (vacuum_pages at a time) if the
+    database uses incremental auto vacuum.
+    """
+
+    def __init__(self, database, raw_days=30, width=3600, batch_size=5000,
+                 pause=0.05, vacuum_pages=1000, interval=86400,
+                 profile=None):
+        super().__init__()
+        if raw_days * 86400 < width:
+            raise AttributeError('raw_days should cover at least one '
+                                 'bucket.')
+        self.daemon = True
+        self.database = database
+        self.raw_days = raw_days
+        self.width = int(width)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.interval = interval
+        self.profile = profile
+        self._stop_event = threading.Event()
+
+    def _boundary(self, conn, name, low, cutoff, div):
+        """
+        End of the next batch - a bucket boundary after about batch_size
+        rows (at least one bucket, at most cutoff).
+        """
+        tmp = conn.execute(f'SELECT timestamp FROM {name} WHERE '
+                           f'timestamp >= {low} AND timestamp < {cutoff} '
+                           f'ORDER BY timestamp LIMIT 1 '
+                           f'OFFSET {self.batch_size}').fetchone()
+        if tmp is None:
+            return cutoff
+        return max((tmp[0] // div) * div, (low // div + 1) * div)
+
+    def prune(self, conn, name, cutoff):
+        """
+        Roll up & delete the raw rows of a sensor table older than cutoff
+        (epoch seconds) - returns the number of rows deleted or None if the
+        table was skipped.
+        """
+        version, columns = storage.table_info(conn, name)
+        numeric = storage.rollup_columns(columns)
+        if not numeric or len(numeric) != len(columns):
+            return None
+        scale = storage.TS_SCALE[version]
+        div = self.width * scale
+        cutoff = (int(cutoff) // self.width) * div
+
+        widths = storage.rollup_widths(conn, name)
+        if self.width not in widths:
+            storage.create_rollup(conn, name, self.width, numeric, version)
+            conn.commit()
+        finer = [item for item in widths if item < self.width]
+
+        res = 0
+        tmp = conn.execute(f'SELECT MIN(timestamp) FROM {name}').fetchone()
+        low = tmp[0]
+        while low is not None and low < cutoff and \
+                not self._stop_event.is_set():
+            low = (low // div) * div
+            high = self._boundary(conn, name, low, cutoff, div)
+            try:
+                storage.fill_rollup(conn, name, self.width, numeric,
+                                    version, low, high)
+                res += conn.execute(f'DELETE FROM {name} WHERE timestamp '
+                                    f'< {high}').rowcount
+                for item in finer:
+                    conn.execute(f'DELETE FROM '
+                                 f'{storage.rollup_name(name, item)} '
+                                 f'WHERE bucket < {high // scale}')
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            low = high if high < cutoff else None
+            # let the writers in.
+            self._stop_event.wait(self.pause)
+        return res
+
+    def vacuum(self, conn):
+        """
+        Release the free pages in steps - returns the pages released.
+        """
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        res = 0
+        while not self._stop_event.is_set():
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            # frees one page per step - so fetch all.
+            conn.execute(f'PRAGMA incremental_vacuum({self.vacuum_pages})'
+                         ).fetchall()
+            conn.commit()
+            res += free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+            self._stop_event.wait(self.pause)
+        return res
+
+    def apply(self, conn, now=None):
+        """
+        Apply the policy to all sensor tables - returns a report.
+        """
+        begin = time.monotonic()
+        now = time.time() if now is None else now
+        cutoff = now - self.raw_days * 86400
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+
+        report = {'deleted': {}, 'skipped': []}
+        for name in storage.sensor_tables(conn):
+            tmp = self.prune(conn, name, cutoff)
+            if tmp is None:
+                report['skipped'].append(name)
+            else:
+                report['deleted'][name] = tmp
+        report['free_pages'] = \
+            conn.execute('PRAGMA freelist_count').fetchone()[0]
+        report['vacuumed_pages'] = self.vacuum(conn)
+        report['reclaimed_bytes'] = \
+            (pages - conn.execute('PRAGMA page_count').fetchone()[0]) * \
+            page_size
+        report['duration'] = time.monotonic() - begin
+        logging.info('Retention: deleted %d rows, reclaimed %d bytes (%d '
+                     'free pages left) in %.1fs.',
+                     sum(report['deleted'].values()),
+                     report['reclaimed_bytes'],
+                     report['free_pages'] - report['vacuumed_pages'],
+                     report['duration'])
+        return report
+
+    def run(self):
+        conn = storage.connect(self.database, self.profile)
+        try:
+            while True:
+                try:
+                    self.apply(conn)
+                except sqlite3.Error as err:
+                    logging.warning('Retention failed: %s.', err)
+                if self._stop_event.wait(self.interval):
+                    break
+        finally:
+            conn.close()
+
+    def close(self):
+        """
+        Stop - a run in progress ends after the current batch.
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,159 @@
+"""
+Run many sensors on one event loop instead of one thread per sensor.
+"""
+
+import asyncio
+import datetime
+import logging
+import random
+
+from concurrent import futures
+
+from iot import sense
+
+
+class Scheduler:
+    """
+    Read sensors as coroutines at a fixed rate.
+
+    Tick n of a sensor is due at start + n * interval (plus a random jitter)
+    no matter how long the reads take; ticks missed while a read was still
+    running are skipped and counted. At most max_concurrent reads run at the
+    same time - blocking ones in a pool of workers threads. Samples are
+    stored through sense.get_store (i.e. the writer if given).
+    """
+
+    def __init__(self, database, writer=None, max_concurrent=8, workers=4):
+        self.database = database
+        self.writer = writer
+        self.max_concurrent = max_concurrent
+        self.workers = workers
+        self.sensors = []
+        self._stats = {}
+        self.closing = False
+        self._loop = None
+        self._stop = None
+
+    def add(self, sensor):
+        """
+        Add a sensor (see sense.Sensor) - before the scheduler runs.
+        """
+        self.sensors.append(sensor)
+        self._stats[sensor.name] = {'reads': 0, 'failures': 0,
+                                    'timeouts': 0, 'skipped': 0,
+                                    'last_latency': 0.0, 'max_latency': 0.0}
+
+    def stats(self):
+        """
+        Return per sensor dicts with read, failure, timeout & skipped tick
+        counts and read latencies (in ms) - plus the sensor's own stats (if
+        it keeps any).
+        """
+        res = {key: dict(val) for key, val in self._stats.items()}
+        for sensor in self.sensors:
+            if hasattr(sensor, 'stats'):
+                res[sensor.name]['sensor'] = sensor.stats()
+        return res
+
+    async def _sample(self, sensor, store, executor, store_executor):
+        """
+        Read one sample & hand it to the store.
+        """
+        loop = asyncio.get_running_loop()
+        stats = self._stats[sensor.name]
+        timestamp = datetime.datetime.utcnow()
+        begin = loop.time()
+        try:
+            res = await asyncio.wait_for(sensor.read_async(executor),
+                                         sensor.timeout)
+        except asyncio.TimeoutError:
+            stats['timeouts'] += 1
+            logging.warning('%s - read timed out after %ss.', sensor.name,
+                            sensor.timeout)
+            return
+        except Exception as err:
+            # one broken sensor should not stop the others.
+            stats['failures'] += 1
+            logging.warning('%s - read failed: %s.', sensor.name, err)
+            return
+        finally:
+            latency = (loop.time() - begin) * 1000
+            stats['last_latency'] = latency
+            stats['max_latency'] = max(stats['max_latency'], latency)
+
+        stats['reads'] += 1
+        if res is None:
+            stats['failures'] += 1
+            return
+        if isinstance(res, tuple):
+            timestamp, res = res
+        try:
+            await loop.run_in_executor(store_executor, store.insert,
+                                       timestamp, res)
+        except Exception as err:
+            logging.warning('%s - could not store sample: %s.', sensor.name,
+                            err)
+
+    async def _run_sensor(self, sensor, slots, executor, store_executor):
+        loop = asyncio.get_running_loop()
+        store = sense.get_store(sensor.name, self.database, self.writer)
+        start = loop.time()
+        tick = 0
+        try:
+            while not self._stop.is_set():
+                due = start + tick * sensor.interval + \
+                    random.uniform(0, sensor.jitter)
+                try:
+                    await asyncio.wait_for(self._stop.wait(),
+                                           max(due - loop.time(), 0))
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                async with slots:
+                    await self._sample(sensor, store, executor,
+                                       store_executor)
+
+                # next tick in the future - skip the ones missed.
+                missed = int((loop.time() - start) // sensor.interval) + 1
+                self._stats[sensor.name]['skipped'] += max(
+                    missed - tick - 1, 0)
+                tick = missed
+        finally:
+            await loop.run_in_executor(store_executor, store.close)
+            sensor.close()
+
+    async def _main(self):
+        self._stop = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        if self.closing:
+            self._stop.set()
+        slots = asyncio.Semaphore(self.max_concurrent)
+        executor = futures.ThreadPoolExecutor(self.workers,
+                                              thread_name_prefix='sensor')
+        # inserts in order & off the read workers.
+        store_executor = futures.ThreadPoolExecutor(1)
+        try:
+            await asyncio.gather(*[
+                self._run_sensor(item, slots, executor, store_executor)
+                for item in self.sensors])
+        finally:
+            # reads stuck in a driver must not block the shutdown.
+            executor.shutdown(wait=False)
+            store_executor.shutdown(wait=True)
+
+    def run(self):
+        """
+        Run the sensors until stop() is called.
+        """
+        asyncio.run(self._main())
+
+    def stop(self):
+        """
+        Stop the scheduler - can be called from any thread.
+        """
+        self.closing = True
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop.set)
+            except RuntimeError:
+                pass  # loop already closed.
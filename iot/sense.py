@@ -2,168 +2,383 @@
 Module containing all sensors.
 """
 
+import asyncio
 import datetime
-import json
-import http.client
-import time
 import threading
-import traceback
-import sqlite3
+import time
 
 import logging
 
+from concurrent import futures
+
+from iot import instrument
+from iot import storage
+from iot import weather
+
 PI = True
 try:
     import Adafruit_DHT
 except ImportError:
+    Adafruit_DHT = None
     PI = False
     logging.error('GPIO not available...')
 
+INSERT_TIME = instrument.histogram(
+    'sensor_insert_seconds',
+    'Time to insert a batch of samples (incl. the rollups).')
+SAMPLES = instrument.counter('sensor_samples_total', 'Samples inserted.')
+
 
 class DbWrapper:
     """
     Base sensor class - provides DB abstraction.
+
+    By default one connection is kept open for the lifetime of the wrapper
+    and the table layout is looked up only once; set persistent to False to
+    open (and close) a new connection for every insert instead. Several
+    wrappers can share one connection (and transaction) by passing conn.
+    The optional storage profile is applied to connections opened here;
+    schema is the version used when the table needs to be created.
+
+    For every width in rollups (in seconds) a rollup table with per bucket
+    aggregates of the numeric columns is maintained alongside the raw data.
     """
 
-    def __init__(self, name, database):
+    def __init__(self, name, database, persistent=True, conn=None,
+                 profile=None, schema=storage.SCHEMA_VERSION,
+                 rollups=storage.ROLLUP_WIDTHS):
         self.name = name
         self.database = database
+        self.profile = profile
+        self.schema = schema
+        self.rollups = rollups
+        self.version = None
+        self.persistent = persistent or conn is not None
+
+        self.conn = conn
+        self._owns_conn = conn is None
+        self.columns = None
+        self._stmt = None
+        self._rollup_columns = []
+        self._rollup_stmts = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """
+        Return a connection - the long-lived one if in persistent mode.
+        """
+        if self.conn is not None:
+            return self.conn
+        conn = storage.connect(self.database, self.profile,
+                               check_same_thread=False)
+        if self.persistent:
+            self.conn = conn
+        return conn
+
+    def _prepare(self, cur, data):
+        """
+        Create the table if needed and cache layout & insert statement.
+        """
+        version, columns = storage.table_info(cur, self.name)
+
+        # create table if needed.
+        if version is None:
+            storage.create_table(cur, self.name, data, self.schema)
+            version, columns = storage.table_info(cur, self.name)
+
+        self.version = version
+        self.columns = [item[0] for item in columns]
+        self._stmt = f'INSERT INTO {self.name} ' \
+                     f'(timestamp, {", ".join(self.columns)}) ' \
+                     f'VALUES ({", ".join("?" * (len(columns) + 1))})'
+
+        # rollup tables.
+        self._rollup_columns = storage.rollup_columns(columns)
+        self._rollup_stmts = []
+        if not self._rollup_columns:
+            return
+        existing = storage.rollup_widths(cur, self.name)
+        for width in self.rollups:
+            if width not in existing:
+                storage.create_rollup(cur, self.name, width,
+                                      self._rollup_columns, version)
+            else:
+                storage.upgrade_rollup(cur, self.name, width,
+                                       self._rollup_columns)
+            self._rollup_stmts.append(
+                storage.rollup_statement(self.name, width,
+                                         self._rollup_columns, version))
 
     def insert(self, timestamp, data):
         """
         Insert data into the database.
 
-        Database assumes unique timestamp - and as we are working with int as
-        timestamps this limits us to 1s sampling rate.
+        Database assumes unique timestamps - these are stored as integer
+        milliseconds (or seconds for tables of schema version 1).
         """
-        if not isinstance(timestamp, datetime.datetime):
-            raise AttributeError('timestamp should be datetime tuple.')
-        conn = sqlite3.connect(self.database)
-        cur = conn.cursor()
+        self.insert_many([(timestamp, data)])
 
-        tmp = cur.execute(f'SELECT name from sqlite_master '
-                          f'WHERE type="table" AND name="{self.name}"')
+    @instrument.timed(INSERT_TIME)
+    def insert_many(self, rows, commit=True):
+        """
+        Insert a list of (timestamp, data) tuples using one transaction.
 
-        # create table if needed.
-        if len(tmp.fetchmany()) == 0:
-            tmp = f'CREATE TABLE {self.name} (timestamp INTEGER'
-            for item in data.keys():
-                typo = 'TEXT'
-                if isinstance(data[item], float):
-                    typo = 'REAL'
-                elif isinstance(data[item], int):
-                    typo = 'INTEGER'
-                tmp += f', {item} {typo}'
-            tmp += ', CONSTRAINT ts_unique UNIQUE (timestamp) )'
-            logging.debug('Creating table: %s.', repr(tmp))
-            cur.execute(tmp)
-
-        # insert data
-        timestamp = time.mktime(timestamp.timetuple())
-
-        tmp = f'INSERT INTO {self.name} VALUES ({timestamp}'
-        for item in data.values():
-            if isinstance(item, str):
-                item = '"' + item + '"'
-            tmp += f', {item}'
-        tmp += ')'
-        logging.debug('Adding data: %s.', repr(tmp))
-        cur.execute(tmp)
-        cur.close()
-
-        conn.commit()
-
-
-class DHT22Sensor(threading.Thread):
+        With commit set to False the transaction is left open so the caller
+        can group inserts into several tables into one commit.
+        """
+        if not rows:
+            return
+        for timestamp, _ in rows:
+            if not isinstance(timestamp, datetime.datetime):
+                raise AttributeError('timestamp should be datetime tuple.')
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                cur = conn.cursor()
+                if self._stmt is None:
+                    self._prepare(cur, rows[0][1])
+
+                # insert data
+                values = [[storage.to_timestamp(timestamp, self.version)] +
+                          [data.get(item) for item in self.columns]
+                          for timestamp, data in rows]
+                logging.debug('Adding data: %s.', values)
+                cur.executemany(self._stmt, values)
+                SAMPLES.inc(len(values))
+
+                if self._rollup_stmts:
+                    values = [[item[0]] +
+                              [data.get(col) for col in self._rollup_columns]
+                              for item, (_, data) in zip(values, rows)]
+                    for stmt in self._rollup_stmts:
+                        cur.executemany(stmt, values)
+                cur.close()
+
+                if commit:
+                    conn.commit()
+            finally:
+                if not self.persistent:
+                    conn.close()
+
+    def close(self):
+        """
+        Close the long-lived connection (if any and owned by this wrapper).
+        """
+        with self._lock:
+            if self.conn is not None and self._owns_conn:
+                self.conn.close()
+                self.conn = None
+
+
+class _WriterStore:
     """
-    Grab sensor information from DHT.
+    Adapter so sensors can hand their samples to a shared writer.
     """
 
-    def __init__(self, name, database, sleep=300, dht=22, gpio=14):
-        super().__init__()
+    def __init__(self, name, writer):
         self.name = name
-        self.database = database
-        self.stop = False
+        self.writer = writer
+
+    def insert(self, timestamp, data):
+        """
+        Queue the sample for the writer.
+        """
+        self.writer.put(self.name, timestamp, data)
+
+    def close(self):
+        """
+        Nothing to do - the writer is owned by whoever created it.
+        """
+
+
+def get_store(name, database, writer=None):
+    """
+    Return the object samples of a sensor are stored with.
+    """
+    if writer is not None:
+        return _WriterStore(name, writer)
+    return DbWrapper(name, database)
+
+
+class Sensor:
+    """
+    Base class of the sensors - read every interval seconds by the
+    scheduler.
+
+    Subclasses implement read() returning a dict with the values (or None if
+    there is nothing to store) - optionally as (timestamp, values) tuple. It
+    may block as the scheduler runs it in a worker thread; sensors with a
+    non-blocking API override read_async() instead. timeout (in seconds)
+    bounds a single read and jitter (in seconds) spreads the reads of
+    sensors sharing an interval.
+    """
+
+    def __init__(self, name, interval=60, timeout=None, jitter=0.0):
+        self.name = name
+        self.interval = interval
+        self.timeout = timeout
+        self.jitter = jitter
+
+    def read(self):
+        """
+        Return the current values.
+        """
+        raise NotImplementedError()
+
+    async def read_async(self, executor):
+        """
+        Return the current values - runs read() in the executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.read)
+
+    def close(self):
+        """
+        Release resources - called when the scheduler stops.
+        """
+
+
+class DHT22Sensor(Sensor):
+    """
+    Grab sensor information from DHT.
+
+    A read makes up to retries attempts retry_delay seconds apart - as long
+    as the next one would start within timeout seconds. Reads run in a
+    thread of their own: one wedged in the driver is abandoned by the
+    scheduler and further reads are skipped (and counted as busy) until it
+    returns, so the shared workers are never tied up. The timestamp is
+    taken when the sample was actually read. The driver defaults to
+    Adafruit_DHT; any object with a read(sensor, pin) method returning
+    (humidity, temperature) will do.
+    """
+
+    def __init__(self, name, sleep=300, dht=22, gpio=14, timeout=None,
+                 retries=15, retry_delay=2.0, driver=None):
+        super().__init__(name, sleep, timeout)
 
         # configs
-        self.sleep = sleep
         self.dht = dht
         self.gpio = gpio
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.driver = driver if driver is not None else Adafruit_DHT
+        if self.driver is None:
+            raise AttributeError('No DHT driver available.')
 
-    def _get_values(self):
-        # arg0 = dht version (22), arg1 = gpio pin
-        humidity, temperature = Adafruit_DHT.read_retry(self.dht, self.gpio)
-        if humidity is not None and temperature is not None:
-            return temperature, humidity
-        logging.warning('%s - values are -1.', self.name)
-        return -1, -1
-
-    def run(self):
-        if PI:
-            db_wrap = DbWrapper(self.name, self.database)
-            while not self.stop:
-                temp, humidity = self._get_values()
-                if temp != -1 and humidity != -1:
-                    timestamp = datetime.datetime.utcnow()
-                    db_wrap.insert(timestamp,
-                                   {'temperature': temp,
-                                    'humidity': humidity})
-                logging.debug(self.name + ' - values: ' +
-                              repr([temp, humidity]))
-                time.sleep(self.sleep)
+        self._executor = futures.ThreadPoolExecutor(
+            1, thread_name_prefix=name)
+        self._pending = None
+        self._stats = {'reads': 0, 'attempts': 0, 'failures': 0, 'busy': 0,
+                       'last_latency': 0.0, 'max_latency': 0.0}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """
+        Return read, attempt, failure & busy counts, the failure rate and
+        read latencies (in ms).
+        """
+        with self._lock:
+            res = dict(self._stats)
+        res['failure_rate'] = res['failures'] / res['reads'] \
+            if res['reads'] else 0.0
+        return res
+
+    def _attempt(self):
+        """
+        One try - returns timestamp, humidity & temperature.
+        """
+        timestamp = datetime.datetime.utcnow()
+        try:
+            humidity, temperature = self.driver.read(self.dht, self.gpio)
+        except Exception as err:
+            logging.debug('%s - driver failed: %s.', self.name, err)
+            return timestamp, None, None
+        return timestamp, humidity, temperature
+
+    def read(self):
+        begin = time.monotonic()
+        res = None
+        attempts = 0
+        while attempts < self.retries:
+            if attempts:
+                if self.timeout is not None and time.monotonic() + \
+                        self.retry_delay >= begin + self.timeout:
+                    break
+                time.sleep(self.retry_delay)
+            attempts += 1
+            timestamp, humidity, temperature = self._attempt()
+            if humidity is not None and temperature is not None:
+                res = timestamp, {'temperature': temperature,
+                                  'humidity': humidity}
+                break
+
+        latency = (time.monotonic() - begin) * 1000
+        with self._lock:
+            self._stats['reads'] += 1
+            self._stats['attempts'] += attempts
+            self._stats['failures'] += res is None
+            self._stats['last_latency'] = latency
+            self._stats['max_latency'] = max(self._stats['max_latency'],
+                                             latency)
+        if res is None:
+            logging.warning('%s - no values after %d attempts.', self.name,
+                            attempts)
         else:
-            logging.warning('Adafruit N/A; or not running on pi...')
+            logging.debug('%s - values: %s.', self.name, res[1])
+        return res
+
+    async def read_async(self, executor):
+        if self._pending is not None and not self._pending.done():
+            with self._lock:
+                self._stats['busy'] += 1
+            logging.warning('%s - previous read still running.', self.name)
+            return None
+        loop = asyncio.get_running_loop()
+        self._pending = loop.run_in_executor(self._executor, self.read)
+        # a timeout abandons the read but must not mark it as done.
+        return await asyncio.shield(self._pending)
 
+    def close(self):
+        self._executor.shutdown(wait=False)
 
-class OutdoorWeather(threading.Thread):
+
+class OutdoorWeather(Sensor):
     """
     Grab information from online weather service.
+
+    Sensors sharing a client (see weather.WeatherClient) are fetched
+    together in one request.
     """
 
-    def __init__(self, name, database, city_id, app_id, sleep=600):
-        super().__init__()
-        self.name = name
-        self.database = database
-        self.stop = False
+    def __init__(self, name, city_id, app_id, sleep=600, timeout=None,
+                 client=None):
+        super().__init__(name, sleep, timeout)
 
         # configs
-        self.sleep = sleep
         self.city_id = city_id
         self.app_id = app_id
+        self._owns_client = client is None
+        self.client = client or weather.WeatherClient(app_id)
+        self.client.register(city_id)
 
     def _get_values(self):
         """
         return temp and humidity
         """
-        temp = -1
-        hum = -1
-        try:
-            conn = http.client.HTTPConnection('api.openweathermap.org')
-            conn.request('GET',
-                         f'/data/2.5/weather?id='
-                         f'{self.city_id}&APPID={self.app_id}')
-            result = conn.getresponse()
-
-            if result.status == 200:
-                data = result.read()
-                data = json.loads(data)
-                temp = float(data['main']['temp']) - 273.15
-                hum = float(data['main']['humidity'])
-        except:
+        res = self.client.get(self.city_id)
+        if res is None:
             logging.warning('%s - values are -1.', self.name)
-            traceback.print_exc()
-        finally:
-            conn.close()
-        return temp, hum
-
-    def run(self):
-        db_wrap = DbWrapper(self.name, self.database)
-        while not self.stop:
-            temp, humidity = self._get_values()
-            if temp != -1 and humidity != -1:
-                timestamp = datetime.datetime.utcnow()
-                db_wrap.insert(timestamp,
-                               {'temperature': temp,
-                                'humidity': humidity})
-            logging.debug(self.name + ' - values: ' + repr([temp, humidity]))
-            time.sleep(self.sleep)
+            return -1, -1
+        return res
+
+    def read(self):
+        temp, humidity = self._get_values()
+        logging.debug('%s - values: %s.', self.name, [temp, humidity])
+        if temp != -1 and humidity != -1:
+            return {'temperature': temp, 'humidity': humidity}
+        return None
+
+    def close(self):
+        if self._owns_client:
+            self.client.close()
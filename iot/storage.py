@@ -0,0 +1,498 @@
+"""
+SQLite storage settings and schema shared by the sensing and the web side.
+"""
+
+import contextlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# Version 1 tables store the timestamp in seconds with a UNIQUE constraint;
+# version 2 tables store milliseconds as INTEGER PRIMARY KEY (the rowid), so
+# rows are clustered in time order.
+SCHEMA_VERSION = 2
+TS_SCALE = {1: 1, 2: 1000}
+
+# bucket widths (in seconds) of the rollup tables kept per sensor table.
+ROLLUP_WIDTHS = (60, 300, 3600)
+ROLLUP_FIELDS = ('count', 'sum', 'm2', 'min', 'max', 'last')
+
+
+class Profile:
+    """
+    Connection tuning applied to every connection to the database.
+
+    The defaults enable WAL so dashboard readers and sensor writers (in
+    different processes) no longer block each other.
+    """
+
+    def __init__(self, journal_mode='WAL', synchronous='NORMAL',
+                 mmap_size=64 * 1024 * 1024, cache_size=-8000,
+                 busy_timeout=5000, wal_autocheckpoint=1000,
+                 checkpoint_interval=300):
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.busy_timeout = busy_timeout
+        self.wal_autocheckpoint = wal_autocheckpoint
+        self.checkpoint_interval = checkpoint_interval
+
+    @classmethod
+    def from_config(cls, cfg, section='data'):
+        """
+        Create a profile from a config parser - missing keys use defaults.
+        """
+        tmp = cls()
+        return cls(
+            cfg.get(section, 'journal_mode', fallback=tmp.journal_mode),
+            cfg.get(section, 'synchronous', fallback=tmp.synchronous),
+            cfg.getint(section, 'mmap_size', fallback=tmp.mmap_size),
+            cfg.getint(section, 'cache_size', fallback=tmp.cache_size),
+            cfg.getint(section, 'busy_timeout', fallback=tmp.busy_timeout),
+            cfg.getint(section, 'wal_autocheckpoint',
+                       fallback=tmp.wal_autocheckpoint),
+            cfg.getint(section, 'checkpoint_interval',
+                       fallback=tmp.checkpoint_interval))
+
+    @property
+    def wal(self):
+        """
+        True if the profile uses write-ahead logging.
+        """
+        return self.journal_mode.upper() == 'WAL'
+
+    def apply(self, conn):
+        """
+        Set the pragmas on the given connection.
+        """
+        # busy timeout first so switching the journal mode can wait as well.
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        mode = conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        mode = mode.fetchone()[0]
+        if mode.upper() != self.journal_mode.upper():
+            logging.warning('Could not set journal mode %s - using %s.',
+                            self.journal_mode, mode)
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        if self.wal:
+            conn.execute(f'PRAGMA wal_autocheckpoint = '
+                         f'{int(self.wal_autocheckpoint)}')
+
+
+def connect(database, profile=None, **kwargs):
+    """
+    Open a connection to the database and apply the profile (if any).
+    """
+    if profile is not None:
+        kwargs.setdefault('timeout', profile.busy_timeout / 1000.0)
+    conn = sqlite3.connect(database, **kwargs)
+    if profile is not None:
+        profile.apply(conn)
+    return conn
+
+
+def to_timestamp(value, version=SCHEMA_VERSION):
+    """
+    Convert a datetime to the integer timestamp used by the schema version.
+    """
+    tmp = time.mktime(value.timetuple())
+    if version == 1:
+        return int(tmp)
+    return int(tmp) * TS_SCALE[version] + value.microsecond // 1000
+
+
+def table_info(conn, name):
+    """
+    Return schema version and list of (column, type) of a sensor table.
+
+    Returns (None, []) if the table does not exist.
+    """
+    res = conn.execute(f'pragma table_info({name})').fetchall()
+    if not res:
+        return None, []
+    # pk flag is set for the timestamp in version 2 tables.
+    version = 2 if res[0][5] else 1
+    return version, [(item[1], item[2]) for item in res[1:]]
+
+
+def create_table(conn, name, data, version=SCHEMA_VERSION):
+    """
+    Create a sensor table with columns & types derived from the data dict.
+    """
+    tmp = f'CREATE TABLE {name} ('
+    if version == 1:
+        tmp += 'timestamp INTEGER'
+    else:
+        tmp += 'timestamp INTEGER PRIMARY KEY'
+    for item in data.keys():
+        typo = 'TEXT'
+        if isinstance(data[item], float):
+            typo = 'REAL'
+        elif isinstance(data[item], int):
+            typo = 'INTEGER'
+        tmp += f', {item} {typo}'
+    if version == 1:
+        tmp += ', CONSTRAINT ts_unique UNIQUE (timestamp)'
+    tmp += ')'
+    logging.debug('Creating table: %r.', tmp)
+    conn.execute(tmp)
+
+
+def is_internal(name):
+    """
+    True for tables which do not hold sensor data (e.g. rollups).
+    """
+    return name.startswith('_') or name.startswith('sqlite_')
+
+
+def sensor_tables(conn):
+    """
+    Return the names of all sensor tables.
+    """
+    tmp = conn.execute('SELECT name from sqlite_master WHERE type="table"')
+    return [item[0] for item in tmp.fetchall() if not is_internal(item[0])]
+
+
+def rollup_name(name, width):
+    """
+    Name of the rollup table with the given bucket width of a sensor table.
+    """
+    return f'_rollup_{name}_{int(width)}'
+
+
+def _widths(tables, name):
+    prefix = rollup_name(name, 0)[:-1]
+    return sorted(int(item[len(prefix):]) for item in tables
+                  if item.startswith(prefix) and item[len(prefix):].isdigit())
+
+
+def rollup_widths(conn, name):
+    """
+    Return the bucket widths of the existing rollup tables of a sensor table.
+    """
+    tmp = conn.execute('SELECT name from sqlite_master WHERE type="table"')
+    return _widths([item[0] for item in tmp.fetchall()], name)
+
+
+def rollup_columns(columns):
+    """
+    Filter (column, type) tuples down to those which can be rolled up.
+    """
+    return [item[0] for item in columns if item[1] in ('REAL', 'INTEGER')]
+
+
+def create_rollup(conn, name, width, columns, version=SCHEMA_VERSION):
+    """
+    Create a rollup table for the numeric columns and fill it with what is
+    already stored in the sensor table.
+
+    Each row holds count, sum, sum of squared deviations from the mean
+    (m2), min, max and last value per column of a bucket; last_ts is the raw
+    timestamp of the last sample. The count per column skips NULL values
+    (count is that of all samples).
+    """
+    table = rollup_name(name, width)
+    fields = ''.join(
+        f', {item}_{field} {"INTEGER" if field == "count" else "REAL"}'
+        for item in columns for field in ROLLUP_FIELDS)
+    conn.execute(f'CREATE TABLE {table} (bucket INTEGER PRIMARY KEY, '
+                 f'count INTEGER, last_ts INTEGER{fields})')
+
+    # backfill from existing raw data.
+    fill_rollup(conn, name, width, columns, version)
+    logging.debug('Created rollup table: %s.', table)
+
+
+def fill_rollup(conn, name, width, columns, version=SCHEMA_VERSION,
+                low=None, high=None):
+    """
+    (Re)compute the rollup buckets from the raw rows with low <= timestamp
+    < high (raw timestamps, both optional) - existing buckets are replaced.
+    """
+    table = rollup_name(name, width)
+    div = TS_SCALE[version] * int(width)
+    aggs = ''.join(f', COUNT({item}), SUM({item}), SUM(_d_{item} * '
+                   f'_d_{item}), MIN({item}), MAX({item})'
+                   for item in columns)
+    # deviations from the bucket mean - summing squares would cancel out.
+    devs = ''.join(f', {item}, {item} - AVG({item}) OVER '
+                   f'(PARTITION BY timestamp / {div}) AS _d_{item}'
+                   for item in columns)
+    names = ''.join(f', {item}_{field}' for item in columns
+                    for field in ROLLUP_FIELDS[:-1])
+    where = []
+    if low is not None:
+        where.append(f'timestamp >= {int(low)}')
+    if high is not None:
+        where.append(f'timestamp < {int(high)}')
+    where = ' WHERE ' + ' AND '.join(where) if where else ''
+    conn.execute(f'INSERT OR REPLACE INTO {table} '
+                 f'(bucket, count, last_ts{names}) '
+                 f'SELECT bucket, COUNT(*), MAX(timestamp){aggs} FROM '
+                 f'(SELECT (timestamp / {div}) * {int(width)} AS bucket, '
+                 f'timestamp{devs} FROM {name}{where}) '
+                 f'GROUP BY bucket')
+    where = where.replace('timestamp', 'last_ts')
+    for item in columns:
+        conn.execute(f'UPDATE {table} SET {item}_last = '
+                     f'(SELECT {item} FROM {name} '
+                     f'WHERE timestamp = {table}.last_ts){where}')
+
+
+def upgrade_rollup(conn, name, width, columns):
+    """
+    Replace the sums of squares of a rollup table of an older version by m2
+    (as well as they can be - the rounding errors stay).
+    """
+    table = rollup_name(name, width)
+    tmp = {item[1] for item in conn.execute(f'PRAGMA table_info({table})')}
+    for item in columns:
+        if f'{item}_m2' in tmp or f'{item}_sq' not in tmp:
+            continue
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {item}_m2 REAL')
+        conn.execute(f'UPDATE {table} SET {item}_m2 = max({item}_sq - '
+                     f'{item}_sum * {item}_sum / {item}_count, 0.0) '
+                     f'WHERE {item}_count > 0')
+        conn.execute(f'ALTER TABLE {table} DROP COLUMN {item}_sq')
+        logging.info('Upgraded column %s of rollup table %s.', item, table)
+
+
+def rollup_statement(name, width, columns, version=SCHEMA_VERSION):
+    """
+    Return the upsert statement adding one sample to a rollup table.
+
+    Parameters are the raw timestamp followed by the column values - NULL
+    values (e.g. NaN) leave the aggregates of their column untouched.
+    """
+    table = rollup_name(name, width)
+    div = TS_SCALE[version] * int(width)
+    names = ''.join(f', {item}_{field}' for item in columns
+                    for field in ROLLUP_FIELDS)
+    values = ''.join(f', ?{i} IS NOT NULL, ?{i}, ?{i} * 0.0, ?{i}, ?{i}, '
+                     f'?{i}' for i in range(2, len(columns) + 2))
+    # scalar +, min() & max() are NULL if either side is; m2 is merged as
+    # by Chan et al. (all expressions see the values before the update).
+    updates = ''.join(
+        f', {item}_count = {item}_count + excluded.{item}_count'
+        f', {item}_sum = coalesce({item}_sum + excluded.{item}_sum, '
+        f'{item}_sum, excluded.{item}_sum)'
+        f', {item}_m2 = CASE WHEN excluded.{item}_count = 0 '
+        f'THEN {item}_m2 WHEN {item}_count = 0 THEN excluded.{item}_m2 '
+        f'ELSE {item}_m2 + excluded.{item}_m2 + '
+        f'({item}_sum / {item}_count - excluded.{item}_sum) * '
+        f'({item}_sum / {item}_count - excluded.{item}_sum) * '
+        f'{item}_count / ({item}_count + 1) END'
+        f', {item}_min = coalesce(min({item}_min, excluded.{item}_min), '
+        f'{item}_min, excluded.{item}_min)'
+        f', {item}_max = coalesce(max({item}_max, excluded.{item}_max), '
+        f'{item}_max, excluded.{item}_max)'
+        f', {item}_last = CASE WHEN excluded.last_ts >= last_ts '
+        f'THEN excluded.{item}_last ELSE {item}_last END'
+        for item in columns)
+    return f'INSERT INTO {table} (bucket, count, last_ts{names}) ' \
+           f'VALUES ((?1 / {div}) * {int(width)}, 1, ?1{values}) ' \
+           f'ON CONFLICT(bucket) DO UPDATE SET count = count + 1, ' \
+           f'last_ts = max(last_ts, excluded.last_ts){updates}'
+
+
+def migrate(conn):
+    """
+    Rewrite all version 1 sensor tables into the current schema version.
+
+    Returns the names of the migrated tables.
+    """
+    res = []
+    for name in sensor_tables(conn):
+        version, columns = table_info(conn, name)
+        if version != 1:
+            continue
+        logging.info('Migrating table %s to schema version %d.', name,
+                     SCHEMA_VERSION)
+        names = ''.join(f', {item[0]}' for item in columns)
+        types = ''.join(f', {item[0]} {item[1]}' for item in columns)
+        scale = TS_SCALE[SCHEMA_VERSION]
+        try:
+            conn.executescript(
+                f'BEGIN;'
+                f'CREATE TABLE _migrate_{name} '
+                f'(timestamp INTEGER PRIMARY KEY{types});'
+                f'INSERT INTO _migrate_{name} (timestamp{names}) '
+                f'SELECT timestamp * {scale}{names} FROM {name} '
+                f'ORDER BY timestamp;'
+                f'DROP TABLE {name};'
+                f'ALTER TABLE _migrate_{name} RENAME TO {name};' +
+                ''.join(f'UPDATE {rollup_name(name, item)} '
+                        f'SET last_ts = last_ts * {scale};'
+                        for item in rollup_widths(conn, name)) +
+                'COMMIT;')
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        res.append(name)
+    return res
+
+
+class Checkpointer(threading.Thread):
+    """
+    Periodically checkpoint the WAL so it does not grow without bound while
+    readers keep the automatic checkpoints from completing.
+    """
+
+    def __init__(self, database, profile):
+        super().__init__()
+        self.daemon = True
+        self.database = database
+        self.profile = profile
+        self._stop_event = threading.Event()
+
+    def checkpoint(self, conn):
+        """
+        Run a passive checkpoint - returns (busy, log pages, checkpointed).
+        """
+        res = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        logging.debug('WAL checkpoint: %s.', res)
+        return res
+
+    def run(self):
+        conn = connect(self.database, self.profile)
+        try:
+            while not self._stop_event.wait(self.profile.checkpoint_interval):
+                try:
+                    self.checkpoint(conn)
+                except sqlite3.Error as err:
+                    logging.warning('WAL checkpoint failed: %s.', err)
+        finally:
+            conn.close()
+
+    def close(self):
+        """
+        Stop checkpointing.
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+class Schema:
+    """
+    Layout of the sensor tables of a database - as of one schema_version.
+    """
+
+    def __init__(self, conn):
+        # read first: a change in between just causes another reload.
+        self.version = conn.execute('PRAGMA schema_version').fetchone()[0]
+        tmp = conn.execute('SELECT name from sqlite_master WHERE type="table"')
+        tables = [item[0] for item in tmp.fetchall()]
+        self.tables = [item for item in tables if not is_internal(item)]
+        self.info = {item: table_info(conn, item) for item in self.tables}
+        self.rollups = {item: _widths(tables, item) for item in self.tables}
+
+    def table_info(self, name):
+        """
+        Same as table_info(conn, name).
+        """
+        return self.info.get(name, (None, []))
+
+    def rollup_widths(self, name):
+        """
+        Same as rollup_widths(conn, name).
+        """
+        return self.rollups.get(name, [])
+
+
+class Registry:
+    """
+    Process-wide pool of read connections & cache of the table layouts.
+
+    Up to size idle connections are kept per database (and profile). The
+    layout is only read again when PRAGMA schema_version changed - i.e. a
+    table was created, altered or dropped. Replacing the database file (e.g.
+    restoring a backup - detected by its inode) drops both.
+    """
+
+    def __init__(self, size=8):
+        self.size = size
+        self._pools = {}
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+        # stats.
+        self.created = 0
+        self.loads = 0
+
+    def _pool(self, database, profile):
+        try:
+            tmp = os.stat(database)
+            ident = tmp.st_dev, tmp.st_ino
+        except OSError:
+            ident = None
+        with self._lock:
+            old, pool = self._pools.get((database, profile), (None, None))
+            if pool is None or old != ident:
+                if pool is not None:
+                    self._drain(pool)
+                self._schemas.pop(database, None)
+                pool = queue.LifoQueue(maxsize=self.size)
+                self._pools[(database, profile)] = ident, pool
+            return pool
+
+    @staticmethod
+    def _drain(pool):
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @contextlib.contextmanager
+    def connection(self, database, profile=None):
+        """
+        Borrow a connection - returned to the pool when the block ends.
+        """
+        pool = self._pool(database, profile)
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            self.created += 1
+            conn = connect(database, profile, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def schema(self, conn, database):
+        """
+        Return the (cached) Schema of the database conn is connected to.
+        """
+        version = conn.execute('PRAGMA schema_version').fetchone()[0]
+        with self._lock:
+            res = self._schemas.get(database)
+        if res is None or res.version != version:
+            res = Schema(conn)
+            with self._lock:
+                self.loads += 1
+                self._schemas[database] = res
+        return res
+
+    def close(self):
+        """
+        Close the idle connections & forget the layouts.
+        """
+        with self._lock:
+            for _, pool in self._pools.values():
+                self._drain(pool)
+            self._pools.clear()
+            self._schemas.clear()
+
+
+REGISTRY = Registry()
@@ -0,0 +1,225 @@
+"""
+Client for the online weather service - pooled, cached and batched.
+"""
+
+import http.client
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+
+# the group endpoint accepts up to 20 city ids per request.
+GROUP_SIZE = 20
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to one host - reused LIFO, at most size
+    idle ones are kept.
+    """
+
+    def __init__(self, host, port=None, size=4, timeout=10, https=False):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.https = https
+        self.idle = queue.LifoQueue(maxsize=size)
+
+        # stats.
+        self.created = 0
+        self.requests = 0
+
+    def _get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            self.created += 1
+            cls = http.client.HTTPSConnection if self.https else \
+                http.client.HTTPConnection
+            return cls(self.host, self.port, timeout=self.timeout)
+
+    def _put(self, conn):
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, headers=None):
+        """
+        Send a request - returns status, headers (lower case names) & body.
+
+        A request on a connection the server closed meanwhile is retried
+        once on a new connection.
+        """
+        for attempt in (0, 1):
+            conn = self._get()
+            try:
+                conn.request(method, path, headers=headers or {})
+                res = conn.getresponse()
+                body = res.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                conn.close()
+                raise
+            self.requests += 1
+            if res.will_close:
+                conn.close()
+            else:
+                self._put(conn)
+            return res.status, {key.lower(): val
+                                for key, val in res.getheaders()}, body
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class _Entry:
+    """
+    Cached response of one group request.
+    """
+
+    def __init__(self, values, etag, modified, expires):
+        self.values = values
+        self.etag = etag
+        self.modified = modified
+        self.expires = expires
+
+
+class WeatherClient:
+    """
+    Fetch temperature & humidity of all registered cities with as few
+    requests as possible.
+
+    Cities are fetched in groups of up to GROUP_SIZE per request through the
+    group endpoint. Responses are cached for the max-age the service sends
+    (or max_age seconds) and revalidated with ETag / Last-Modified. After a
+    failure requests are suspended for an exponentially growing (and
+    jittered) backoff - starting at backoff seconds, up to max_backoff.
+    Expired values are never returned, so an outage yields no readings
+    rather than old ones.
+    """
+
+    def __init__(self, app_id, host='api.openweathermap.org', port=None,
+                 https=False, pool_size=4, max_age=600, backoff=5,
+                 max_backoff=3600, timeout=10):
+        self.app_id = app_id
+        self.pool = ConnectionPool(host, port, pool_size, timeout, https)
+        self.max_age = max_age
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cities = []
+        self.failures = 0
+        self.retry_at = 0.0
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def register(self, city_id):
+        """
+        Add a city to the ones fetched with every request.
+        """
+        with self._lock:
+            if str(city_id) not in self.cities:
+                self.cities.append(str(city_id))
+
+    def _max_age(self, headers):
+        tmp = re.search(r'max-age=(\d+)', headers.get('cache-control', ''))
+        return int(tmp.group(1)) if tmp else self.max_age
+
+    def _fail(self, headers=None):
+        """
+        Suspend requests - for Retry-After seconds if the server said so.
+        """
+        self.failures += 1
+        delay = min(self.backoff * 2 ** (self.failures - 1),
+                    self.max_backoff) * random.uniform(0.5, 1.0)
+        tmp = (headers or {}).get('retry-after', '')
+        if tmp.isdigit():
+            delay = max(delay, int(tmp))
+        self.retry_at = time.monotonic() + delay
+        logging.warning('Weather service unavailable - backing off for '
+                        '%.0fs.', delay)
+
+    def _fetch(self, group):
+        """
+        Return the values of a group of cities - from the cache if fresh,
+        empty if they cannot be fetched.
+        """
+        now = time.monotonic()
+        entry = self._cache.get(group)
+        if entry is not None and now < entry.expires:
+            return entry.values
+        # an expired entry is only kept for revalidation.
+        if now < self.retry_at:
+            return {}
+
+        headers = {}
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry is not None and entry.modified:
+            headers['If-Modified-Since'] = entry.modified
+        try:
+            status, res, body = self.pool.request(
+                'GET', f'/data/2.5/group?id={group}&APPID={self.app_id}',
+                headers)
+        except (OSError, http.client.HTTPException) as err:
+            logging.warning('Weather request failed: %s.', err)
+            self._fail()
+            return {}
+
+        if status == 304 and entry is not None:
+            entry.expires = now + self._max_age(res)
+        elif status == 200:
+            values = {}
+            try:
+                for item in json.loads(body)['list']:
+                    values[str(item['id'])] = (
+                        float(item['main']['temp']) - 273.15,
+                        float(item['main']['humidity']))
+            except (ValueError, KeyError, TypeError) as err:
+                logging.warning('Weather response malformed: %r.', err)
+                self._fail(res)
+                return {}
+            entry = _Entry(values, res.get('etag'),
+                           res.get('last-modified'),
+                           now + self._max_age(res))
+            self._cache[group] = entry
+        else:
+            logging.warning('Weather request returned status %d.', status)
+            self._fail(res)
+            return {}
+        self.failures = 0
+        return entry.values
+
+    def get(self, city_id):
+        """
+        Return (temperature in Celsius, humidity) of a city - None if not
+        available.
+        """
+        self.register(city_id)
+        with self._lock:
+            for i in range(0, len(self.cities), GROUP_SIZE):
+                group = ','.join(self.cities[i:i + GROUP_SIZE])
+                if str(city_id) in self.cities[i:i + GROUP_SIZE]:
+                    return self._fetch(group).get(str(city_id))
+        return None
+
+    def close(self):
+        """
+        Close the pooled connections.
+        """
+        self.pool.close()
@@ -0,0 +1,195 @@
+"""
+Background writer grouping samples of many sensors into few transactions.
+"""
+
+import collections
+import datetime
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from iot import sense
+from iot import storage
+
+POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+class GroupCommitWriter(threading.Thread):
+    """
+    Queue-fed writer - samples of all sensors are flushed in one transaction
+    every batch_size rows or flush_interval milliseconds, whichever comes
+    first.
+
+    When the queue (bounded by queue_size) is full the policy decides what
+    happens: 'block' makes the sensor wait (up to put_timeout seconds),
+    'drop_newest' discards the new sample and 'drop_oldest' discards the
+    oldest queued sample to make room.
+    """
+
+    def __init__(self, database, batch_size=100, flush_interval=1000,
+                 queue_size=10000, policy='block', put_timeout=None,
+                 profile=None, rollups=storage.ROLLUP_WIDTHS):
+        super().__init__()
+        if policy not in POLICIES:
+            raise AttributeError(f'policy should be one of {POLICIES}.')
+        self.daemon = True
+        self.database = database
+        self.profile = profile
+        self.rollups = rollups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval / 1000.0
+        self.policy = policy
+        self.put_timeout = put_timeout
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closing = False
+        self._wrappers = {}
+
+        # stats.
+        self.dropped = 0
+        self.flushes = 0
+        self.rows = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self._total_latency = 0.0
+
+    @property
+    def queue_depth(self):
+        """
+        Number of samples waiting to be written.
+        """
+        return self.queue.qsize()
+
+    def stats(self):
+        """
+        Return a dict with queue depth, drop count & flush latencies (in ms).
+        """
+        avg = self._total_latency / self.flushes if self.flushes else 0.0
+        return {'queue_depth': self.queue_depth,
+                'dropped': self.dropped,
+                'flushes': self.flushes,
+                'rows': self.rows,
+                'last_latency': self.last_latency * 1000,
+                'max_latency': self.max_latency * 1000,
+                'avg_latency': avg * 1000}
+
+    def put(self, name, timestamp, data):
+        """
+        Queue a sample for the given sensor table.
+
+        Returns False if the sample was dropped.
+        """
+        if not isinstance(timestamp, datetime.datetime):
+            raise AttributeError('timestamp should be datetime tuple.')
+        item = (name, timestamp, data)
+        if self.policy == 'block':
+            try:
+                self.queue.put(item, timeout=self.put_timeout)
+                return True
+            except queue.Full:
+                self.dropped += 1
+                logging.warning('Writer queue full - dropped sample of %s.',
+                                name)
+                return False
+
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except queue.Full:
+                self.dropped += 1
+                if self.policy == 'drop_newest':
+                    return False
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _collect(self):
+        """
+        Wait for the first sample, then gather up to batch_size samples until
+        the flush interval has passed.
+        """
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0 or self.closing:
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _get_wrapper(self, conn, name):
+        if name not in self._wrappers:
+            self._wrappers[name] = sense.DbWrapper(name, self.database,
+                                                   conn=conn,
+                                                   rollups=self.rollups)
+        return self._wrappers[name]
+
+    def flush(self, conn, batch):
+        """
+        Write a batch of samples in a single transaction.
+        """
+        begin = time.monotonic()
+        tables = collections.OrderedDict()
+        for name, timestamp, data in batch:
+            tables.setdefault(name, []).append((timestamp, data))
+
+        try:
+            for name, rows in tables.items():
+                self._get_wrapper(conn, name).insert_many(rows, commit=False)
+            conn.commit()
+        except sqlite3.Error as err:
+            # one bad sample should not take down the whole batch.
+            logging.warning('Batch insert failed (%s) - retrying row by row.',
+                            err)
+            conn.rollback()
+            # tables created in the rolled back transaction are gone too.
+            self._wrappers.clear()
+            for name, rows in tables.items():
+                for row in rows:
+                    try:
+                        self._get_wrapper(conn, name).insert_many(
+                            [row], commit=False)
+                    except sqlite3.Error as row_err:
+                        logging.warning('Dropping sample of %s: %s.', name,
+                                        row_err)
+            conn.commit()
+
+        latency = time.monotonic() - begin
+        self.flushes += 1
+        self.rows += len(batch)
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._total_latency += latency
+        logging.debug('Flushed %d samples in %.1fms - queue depth: %d.',
+                      len(batch), latency * 1000, self.queue_depth)
+
+    def run(self):
+        conn = storage.connect(self.database, self.profile)
+        try:
+            while not self.closing or not self.queue.empty():
+                batch = self._collect()
+                if batch:
+                    self.flush(conn, batch)
+        finally:
+            conn.close()
+        logging.info('Writer stopped: %s.', self.stats())
+
+    def close(self, timeout=None):
+        """
+        Stop the writer - whatever is still queued is flushed first.
+        """
+        self.closing = True
+        if self.is_alive():
+            self.join(timeout)
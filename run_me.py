@@ -9,7 +9,12 @@ try:
 except ImportError:
     import configparser
 
+from iot import instrument
+from iot import storage
 from web import bottle_ssl
+from web import compress
+from web import data_proc
+from web import live
 from web import wsgi_app
 
 
@@ -26,15 +31,51 @@ def main():
     """
     Fire up web server.
     """
+    aggregate = CFG.get('data', 'aggregate', fallback='') or None
+    cache = None
+    # cache_size is the SQLite page cache of the storage profile.
+    size = CFG.getint('data', 'query_cache_size', fallback=128)
+    if size > 0:
+        cache = data_proc.QueryCache(size,
+                                     CFG.getint('data', 'query_cache_ttl',
+                                                fallback=300))
+    profile = storage.Profile.from_config(CFG)
+    storage.REGISTRY.size = CFG.getint('data', 'connections', fallback=8)
+    instrument.enable(CFG.getboolean('server', 'metrics', fallback=False))
+    notifier = None
+    interval = CFG.getfloat('server', 'stream_interval', fallback=2.0)
+    if interval > 0:
+        notifier = live.ChangeNotifier(CFG.get('data', 'database'),
+                                       interval, profile)
+        notifier.start()
+    pool = None
+    workers = CFG.getint('data', 'read_workers', fallback=4)
+    if workers > 1:
+        pool = data_proc.ReadPool(workers, profile)
     app = wsgi_app.MainApp(CFG.get('data', 'database'),
                            CFG.getint('data', 'timeslice'),
                            CFG.get('data', 'resample'),
                            CFG.get('server', 'username'),
-                           CFG.get('server', 'password')).app
+                           CFG.get('server', 'password'),
+                           profile,
+                           aggregate,
+                           cache,
+                           notifier,
+                           pool,
+                           CFG.getint('server', 'max_streams',
+                                      fallback=wsgi_app.MAX_STREAMS)).app
 
     sec_app = bottle_ssl.get_app(app)
-    serve = bottle_ssl.SecureServerAdapter(CFG.get('server', 'ssl_key'),
-                                           CFG.get('server', 'ssl_cert'))
+    level = CFG.getint('server', 'compress_level', fallback=6)
+    if level > 0:
+        sec_app = compress.CompressMiddleware(sec_app, level)
+    serve = bottle_ssl.SecureServerAdapter(
+        CFG.get('server', 'ssl_key'),
+        CFG.get('server', 'ssl_cert'),
+        CFG.get('server', 'bind_host', fallback='0.0.0.0'),
+        CFG.getint('server', 'bind_port', fallback=443),
+        pool_size=CFG.getint('server', 'pool_size',
+                             fallback=bottle_ssl.POOL_SIZE))
     serve.run(sec_app)
 
 
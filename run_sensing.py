@@ -10,7 +10,13 @@ except ImportError:
     import configparser
 
 
+from iot import instrument
+from iot import retention
+from iot import scheduler
 from iot import sense
+from iot import storage
+from iot import weather
+from iot import writer
 
 CFG = configparser.ConfigParser()
 CFG.readfp(open('defaults.cfg'))
@@ -23,22 +29,94 @@ logging.basicConfig(format=FORMAT,
 
 def main():
     """
-    Start sensors as threads.
+    Run the sensors on one scheduler - all sharing one background writer.
     """
-    sensor1 = sense.OutdoorWeather('outdoor',
-                                   CFG.get('data', 'database'),
-                                   CFG.get('outdoor_sensor', 'city_id'),
-                                   CFG.get('outdoor_sensor', 'app_id'),
-                                   CFG.getint('outdoor_sensor', 'sleep'))
-    sensor2 = sense.DHT22Sensor('indoor',
-                                CFG.get('data', 'database'),
-                                CFG.getint('indoor_sensor', 'sleep'),
-                                CFG.getint('indoor_sensor', 'dht'),
-                                CFG.getint('indoor_sensor', 'gpio'))
-    threads = [sensor1, sensor2]
-
-    for thread in threads:
-        thread.start()
+    profile = storage.Profile.from_config(CFG)
+    instrument.enable(CFG.getboolean('server', 'metrics', fallback=False))
+    conn = storage.connect(CFG.get('data', 'database'), profile)
+    storage.migrate(conn)
+    retention.enable_incremental_vacuum(
+        conn, CFG.getboolean('retention', 'convert', fallback=False))
+    conn.close()
+
+    checkpointer = None
+    if profile.wal and profile.checkpoint_interval > 0:
+        checkpointer = storage.Checkpointer(CFG.get('data', 'database'),
+                                            profile)
+        checkpointer.start()
+
+    cleaner = None
+    if CFG.getfloat('retention', 'raw_days', fallback=0) > 0:
+        cleaner = retention.Retention(
+            CFG.get('data', 'database'),
+            CFG.getfloat('retention', 'raw_days'),
+            CFG.getint('retention', 'width', fallback=3600),
+            CFG.getint('retention', 'batch_size', fallback=5000),
+            CFG.getfloat('retention', 'pause', fallback=0.05),
+            CFG.getint('retention', 'vacuum_pages', fallback=1000),
+            CFG.getint('retention', 'interval', fallback=86400),
+            profile)
+        cleaner.start()
+
+    db_writer = writer.GroupCommitWriter(
+        CFG.get('data', 'database'),
+        batch_size=CFG.getint('writer', 'batch_size', fallback=100),
+        flush_interval=CFG.getint('writer', 'flush_interval', fallback=1000),
+        queue_size=CFG.getint('writer', 'queue_size', fallback=10000),
+        policy=CFG.get('writer', 'policy', fallback='block'),
+        profile=profile,
+        rollups=[int(item) for item in
+                 CFG.get('data', 'rollups', fallback='60,300,3600').split(',')
+                 if item.strip()])
+    db_writer.start()
+
+    sched = scheduler.Scheduler(
+        CFG.get('data', 'database'),
+        writer=db_writer,
+        max_concurrent=CFG.getint('scheduler', 'max_concurrent', fallback=8),
+        workers=CFG.getint('scheduler', 'workers', fallback=4))
+    client = weather.WeatherClient(
+        CFG.get('outdoor_sensor', 'app_id'),
+        pool_size=CFG.getint('outdoor_sensor', 'pool_size', fallback=4),
+        max_age=CFG.getint('outdoor_sensor', 'sleep'))
+    cities = [item.strip() for item in
+              CFG.get('outdoor_sensor', 'city_id').split(',')
+              if item.strip()]
+    for city_id in cities:
+        name = 'outdoor' if len(cities) == 1 else f'outdoor_{city_id}'
+        sched.add(sense.OutdoorWeather(name, city_id,
+                                       CFG.get('outdoor_sensor', 'app_id'),
+                                       CFG.getint('outdoor_sensor', 'sleep'),
+                                       CFG.getfloat('outdoor_sensor',
+                                                    'timeout', fallback=30),
+                                       client=client))
+    if sense.PI:
+        sched.add(sense.DHT22Sensor(
+            'indoor',
+            CFG.getint('indoor_sensor', 'sleep'),
+            CFG.getint('indoor_sensor', 'dht'),
+            CFG.getint('indoor_sensor', 'gpio'),
+            CFG.getfloat('indoor_sensor', 'timeout', fallback=60),
+            retries=CFG.getint('indoor_sensor', 'retries', fallback=15),
+            retry_delay=CFG.getfloat('indoor_sensor', 'retry_delay',
+                                     fallback=2.0)))
+    else:
+        logging.warning('Adafruit N/A; or not running on pi...')
+
+    try:
+        sched.run()
+    except KeyboardInterrupt:
+        logging.info('Shutting down...')
+    finally:
+        logging.info('Sensor stats: %s.', sched.stats())
+        if instrument.ENABLED:
+            logging.info('Metrics:\n%s', instrument.render())
+        client.close()
+        db_writer.close()
+        if cleaner is not None:
+            cleaner.close()
+        if checkpointer is not None:
+            checkpointer.close()
 
 
 if __name__ == '__main__':
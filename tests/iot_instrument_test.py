@@ -0,0 +1,70 @@
+"""
+Unittest for the instrument module.
+"""
+
+import time
+import unittest
+
+from iot import instrument
+
+
+class RegistryTest(unittest.TestCase):
+    """
+    Test for class Registry & the metrics.
+    """
+
+    def setUp(self):
+        self.cut = instrument.Registry()
+        instrument.enable()
+
+    def tearDown(self):
+        instrument.enable(False)
+
+    def test_render_for_success(self):
+        """
+        Test for success.
+        """
+        self.cut.counter('foo_total', 'Foos.').inc(2)
+        self.assertEqual(self.cut.render(),
+                         '# HELP foo_total Foos.\n'
+                         '# TYPE foo_total counter\n'
+                         'foo_total 2\n')
+
+    def test_render_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.cut.counter('foo', 'Foos.')
+        self.assertRaises(AttributeError, self.cut.histogram, 'foo', 'Foos.')
+
+    def test_render_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        hist = self.cut.histogram('bar_seconds', 'Bars.')
+        self.assertIs(self.cut.histogram('bar_seconds', 'Bars.'), hist)
+        hist.observe(0.003)
+        hist.observe(20)
+
+        @instrument.timed(hist)
+        def func():
+            time.sleep(0.01)
+        func()
+        with hist.time():
+            pass
+
+        lines = self.cut.render().splitlines()
+        self.assertIn('# TYPE bar_seconds histogram', lines)
+        self.assertIn('bar_seconds_bucket{le="0.0025"} 1', lines)
+        self.assertIn('bar_seconds_bucket{le="0.005"} 2', lines)
+        self.assertIn('bar_seconds_bucket{le="10"} 3', lines)
+        self.assertIn('bar_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('bar_seconds_count 4', lines)
+        self.assertGreater(hist.sum, 20.013)
+
+        # nothing is collected while disabled.
+        instrument.enable(False)
+        self.assertIs(hist.time(), instrument._NULL)
+        func()
+        hist.observe(1)
+        self.assertEqual(sum(hist.counts), 4)
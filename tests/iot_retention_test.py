@@ -0,0 +1,110 @@
+"""
+Unittest for the retention module.
+"""
+
+import datetime
+import os
+import sqlite3
+import time
+import unittest
+
+from iot import retention
+from iot import sense
+from iot import storage
+
+END = datetime.datetime(2017, 1, 4)
+
+
+def _remove(database):
+    for suffix in ['', '-wal', '-shm']:
+        try:
+            os.remove(database + suffix)
+        except OSError:
+            pass
+
+
+def _rounded(rows):
+    # m2 merged sample by sample differs from the batch one in the last bits.
+    return [tuple(round(item, 9) if isinstance(item, float) else item
+                  for item in row) for row in rows]
+
+
+class RetentionTest(unittest.TestCase):
+    """
+    Test for class Retention.
+    """
+
+    def setUp(self):
+        self.conn = sqlite3.connect('temp.sqlite3')
+        self.assertTrue(retention.enable_incremental_vacuum(self.conn))
+        # a sample every minute over 3 days.
+        db_wrap = sense.DbWrapper('testus', 'temp.sqlite3')
+        db_wrap.insert_many([(END - datetime.timedelta(minutes=i),
+                              {'temperature': float(i % 7)})
+                             for i in range(3 * 1440)])
+        db_wrap.close()
+        db_wrap = sense.DbWrapper('switch', 'temp.sqlite3')
+        db_wrap.insert(END - datetime.timedelta(days=3), {'state': 'on'})
+        db_wrap.close()
+        self.now = time.mktime(END.timetuple())
+
+    def tearDown(self):
+        self.conn.close()
+        _remove('temp.sqlite3')
+
+    def test_apply_for_success(self):
+        """
+        Test for success.
+        """
+        cut = retention.Retention('temp.sqlite3', raw_days=1, pause=0)
+        res = cut.apply(self.conn, self.now)
+        self.assertEqual(res['skipped'], ['switch'])
+        self.assertEqual(res['deleted']['testus'], 2 * 1440 - 1)
+        self.assertGreater(res['reclaimed_bytes'], 0)
+        # nothing left to do.
+        res = cut.apply(self.conn, self.now)
+        self.assertEqual(res['deleted']['testus'], 0)
+
+    def test_apply_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.assertRaises(AttributeError, retention.Retention,
+                          'temp.sqlite3', raw_days=0.01, width=3600)
+        self.conn.close()
+        cut = retention.Retention('temp.sqlite3', raw_days=1, pause=0)
+        self.assertRaises(sqlite3.ProgrammingError, cut.apply, self.conn)
+
+    def test_prune_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        hourly = storage.rollup_name('testus', 3600)
+        before = self.conn.execute(f'SELECT * FROM {hourly}').fetchall()
+        cutoff = self.now - 86400 - 1800
+        # one bucket (an hour) per batch.
+        cut = retention.Retention('temp.sqlite3', raw_days=1, pause=0,
+                                  batch_size=30)
+        self.assertEqual(cut.prune(self.conn, 'testus', cutoff),
+                         2 * 1440 - 61)
+
+        # raw rows from the first full hour before the cutoff on.
+        first = self.conn.execute('SELECT MIN(timestamp) FROM testus')
+        self.assertEqual(first.fetchone()[0], (self.now - 90000) * 1000)
+        # the aggregates are unchanged.
+        tmp = self.conn.execute(f'SELECT * FROM {hourly}').fetchall()
+        self.assertEqual(_rounded(tmp), _rounded(before))
+        # finer rollups are gone as well.
+        for width in (60, 300):
+            tmp = self.conn.execute(
+                f'SELECT MIN(bucket) FROM '
+                f'{storage.rollup_name("testus", width)}').fetchone()
+            self.assertEqual(tmp[0], self.now - 90000)
+
+        # missing aggregates are created.
+        self.conn.execute(f'DROP TABLE {hourly}')
+        self.conn.commit()
+        cut = retention.Retention('temp.sqlite3', raw_days=1, pause=0)
+        cut.prune(self.conn, 'testus', self.now - 3600)
+        self.assertEqual(self.conn.execute(
+            f'SELECT SUM(count) FROM {hourly}').fetchone()[0], 1501)
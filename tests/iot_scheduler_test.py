@@ -0,0 +1,134 @@
+"""
+Unittest for the scheduler module.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import unittest
+
+from iot import scheduler
+from iot import sense
+
+
+class FakeSensor(sense.Sensor):
+    """
+    Sensor returning a counter - reads take duration seconds.
+    """
+
+    def __init__(self, name, interval, duration=0.0, timeout=None,
+                 fail=False):
+        super().__init__(name, interval, timeout)
+        self.duration = duration
+        self.fail = fail
+        self.times = []
+        # reads in progress - can be shared by several sensors.
+        self.active = {'now': 0, 'max': 0}
+        self.lock = threading.Lock()
+
+    def read(self):
+        with self.lock:
+            self.times.append(time.monotonic())
+            self.active['now'] += 1
+            self.active['max'] = max(self.active['max'],
+                                     self.active['now'])
+        time.sleep(self.duration)
+        with self.lock:
+            self.active['now'] -= 1
+        if self.fail:
+            raise IOError('Broken.')
+        return {'value': float(len(self.times))}
+
+
+class AsyncSensor(sense.Sensor):
+    """
+    Sensor with a non-blocking read.
+    """
+
+    async def read_async(self, executor):
+        await asyncio.sleep(0)
+        return {'value': 1.0}
+
+
+class SchedulerTest(unittest.TestCase):
+    """
+    Test for class Scheduler.
+    """
+
+    def setUp(self):
+        self.cut = scheduler.Scheduler('temp.sqlite3', max_concurrent=2,
+                                       workers=4)
+
+    def tearDown(self):
+        try:
+            os.remove('temp.sqlite3')
+        except OSError:
+            pass
+
+    def _run(self, duration):
+        timer = threading.Timer(duration, self.cut.stop)
+        timer.start()
+        self.cut.run()
+        timer.join()
+
+    def test_run_for_success(self):
+        """
+        Test for success.
+        """
+        self.cut.add(FakeSensor('fake', 0.05))
+        self.cut.add(AsyncSensor('other', 0.05))
+        self._run(0.2)
+        conn = sqlite3.connect('temp.sqlite3')
+        for name in ('fake', 'other'):
+            tmp = conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()
+            self.assertGreater(tmp[0], 1)
+        conn.close()
+
+    def test_run_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.cut.add(FakeSensor('broken', 0.05, fail=True))
+        self.cut.add(FakeSensor('slow', 0.05, duration=0.2, timeout=0.02))
+        self._run(0.15)
+        res = self.cut.stats()
+        self.assertGreater(res['broken']['failures'], 1)
+        self.assertEqual(res['broken']['reads'], 0)
+        self.assertGreater(res['slow']['timeouts'], 1)
+        self.assertEqual(sense.Sensor('foo').interval, 60)
+        self.assertRaises(NotImplementedError, sense.Sensor('foo').read)
+
+    def test_run_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        # fixed rate - reads taking 60% of the interval do not add up.
+        fixed = FakeSensor('fixed', 0.05, duration=0.03)
+        self.cut.add(fixed)
+        # reads taking longer than the interval skip ticks.
+        slow = FakeSensor('slow', 0.02, duration=0.05)
+        self.cut.add(slow)
+        self._run(0.52)
+
+        # a sleep based loop would be 10 * 0.03s late by now - reads stay
+        # on the 0.05s grid (even if a tick gets skipped on a busy box).
+        offsets = [item - fixed.times[0] for item in fixed.times]
+        self.assertGreaterEqual(len(offsets), 8)
+        self.assertAlmostEqual(offsets[-1],
+                               round(offsets[-1] / 0.05) * 0.05, delta=0.02)
+        self.assertGreater(self.cut.stats()['slow']['skipped'], 5)
+
+        # concurrency limit.
+        self.cut = scheduler.Scheduler('temp.sqlite3', max_concurrent=2)
+        sensors = [FakeSensor(f'fake{i}', 0.05, duration=0.04)
+                   for i in range(4)]
+        for item in sensors:
+            self.cut.add(item)
+        lock = threading.Lock()
+        for item in sensors:
+            item.lock = lock
+            item.active = sensors[0].active
+        self._run(0.2)
+        self.assertEqual(sensors[0].active['max'], 2)
@@ -2,9 +2,11 @@
 Unittest for sense module.
 """
 
+import asyncio
 import os
 import sqlite3
 import datetime
+import time
 import unittest
 
 from iot import sense
@@ -19,6 +21,7 @@ class DbWrapperTest(unittest.TestCase):
         self.cut = sense.DbWrapper('testus', 'temp.sqlite3')
 
     def tearDown(self):
+        self.cut.close()
         try:
             os.remove('temp.sqlite3')
         except OSError:
@@ -54,3 +57,149 @@ class DbWrapperTest(unittest.TestCase):
         self.assertEqual(tmp[1][2], 'REAL')  # metric3
         self.assertEqual(tmp[2][2], 'TEXT')  # metric2
         self.assertEqual(tmp[3][2], 'INTEGER')  # metric1
+
+    def test_insert_many_for_success(self):
+        """
+        Test for success.
+        """
+        now = datetime.datetime.now()
+        self.cut.insert_many([(now, {'point1': 10.0}),
+                              (now + datetime.timedelta(seconds=1),
+                               {'point1': 11.0})])
+
+    def test_insert_many_for_failure(self):
+        """
+        Test for failure.
+        """
+        # expects datetime obj
+        self.assertRaises(AttributeError, self.cut.insert_many,
+                          [(datetime.datetime.now(), {'point1': 1.0}),
+                           (123, {'point1': 2.0})])
+
+    def test_insert_many_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        now = datetime.datetime.now()
+        self.cut.insert(now, {'metric1': 10.0, 'metric2': 'test'})
+        conn = self.cut.conn
+        # key order should not matter once the layout is known.
+        self.cut.insert_many([(now + datetime.timedelta(seconds=1),
+                               {'metric2': 'foo', 'metric1': 11.0})])
+        self.assertIs(self.cut.conn, conn)  # connection is reused.
+
+        tmp = sqlite3.connect('temp.sqlite3')
+        res = tmp.execute('SELECT metric1, metric2 FROM testus').fetchall()
+        self.assertEqual(res, [(10.0, 'test'), (11.0, 'foo')])
+        tmp.close()
+
+        # non persistent mode does not hold on to a connection.
+        cut = sense.DbWrapper('testus', 'temp.sqlite3', persistent=False)
+        cut.insert(now + datetime.timedelta(seconds=2), {'metric1': 12.0,
+                                                         'metric2': 'bar'})
+        self.assertIsNone(cut.conn)
+
+    def test_insert_sub_second_for_sanity(self):
+        """
+        Test for sanity - samples less than a second apart are kept.
+        """
+        now = datetime.datetime(2017, 1, 1, 12, 0, 0)
+        self.cut.insert_many([(now + datetime.timedelta(milliseconds=10 * i),
+                               {'point1': float(i)}) for i in range(100)])
+        cur = sqlite3.connect('temp.sqlite3')
+        tmp = cur.execute('SELECT timestamp FROM testus').fetchall()
+        self.assertEqual(len(tmp), 100)
+        self.assertEqual(tmp[1][0] - tmp[0][0], 10)
+        cur.close()
+
+        # existing version 1 tables keep on storing seconds.
+        cut = sense.DbWrapper('legacy', 'temp.sqlite3', schema=1)
+        cut.insert(now, {'point1': 1.0})
+        self.assertEqual(cut.version, 1)
+        cut.close()
+        cut = sense.DbWrapper('legacy', 'temp.sqlite3')
+        cut.insert(now + datetime.timedelta(seconds=1), {'point1': 1.0})
+        self.assertEqual(cut.version, 1)
+        cut.close()
+
+
+class FakeDHT:
+    """
+    Driver returning the given (humidity, temperature) values in turn -
+    each read takes delay seconds.
+    """
+
+    def __init__(self, values, delay=0.0):
+        self.values = list(values)
+        self.delay = delay
+        self.calls = 0
+
+    def read(self, sensor, pin):
+        self.calls += 1
+        time.sleep(self.delay)
+        res = self.values.pop(0) if self.values else (None, None)
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+
+class DHT22SensorTest(unittest.TestCase):
+    """
+    Test for class DHT22Sensor.
+    """
+
+    def test_read_for_success(self):
+        """
+        Test for success.
+        """
+        driver = FakeDHT([(None, None), IOError('GPIO'), (45.0, 21.5)])
+        cut = sense.DHT22Sensor('indoor', driver=driver, retry_delay=0)
+        before = datetime.datetime.utcnow()
+        timestamp, values = cut.read()
+        self.assertEqual(values, {'temperature': 21.5, 'humidity': 45.0})
+        self.assertGreaterEqual(timestamp, before)
+        self.assertEqual(cut.stats()['attempts'], 3)
+        self.assertEqual(cut.stats()['failure_rate'], 0.0)
+        cut.close()
+
+    def test_read_for_failure(self):
+        """
+        Test for failure.
+        """
+        cut = sense.DHT22Sensor('indoor', driver=FakeDHT([]), retries=3,
+                                retry_delay=0)
+        self.assertIsNone(cut.read())
+        self.assertEqual(cut.stats()['attempts'], 3)
+        self.assertEqual(cut.stats()['failure_rate'], 1.0)
+
+        # no retry is started after the timeout.
+        driver = FakeDHT([])
+        cut = sense.DHT22Sensor('indoor', timeout=0.15, retry_delay=0.1,
+                                driver=driver)
+        self.assertIsNone(cut.read())
+        self.assertEqual(driver.calls, 2)
+        self.assertLess(cut.stats()['last_latency'], 150)
+
+    def test_read_async_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        driver = FakeDHT([(45.0, 21.5), (46.0, 22.0)], delay=0.2)
+        cut = sense.DHT22Sensor('indoor', timeout=0.05, driver=driver)
+
+        async def sample():
+            try:
+                await asyncio.wait_for(cut.read_async(None), cut.timeout)
+            except asyncio.TimeoutError:
+                pass
+            # the wedged read is still running - skipped.
+            busy = await cut.read_async(None)
+            await asyncio.sleep(0.25)
+            return busy, await cut.read_async(None)
+
+        busy, (_, values) = asyncio.run(sample())
+        self.assertIsNone(busy)
+        self.assertEqual(values, {'temperature': 22.0, 'humidity': 46.0})
+        self.assertEqual(cut.stats()['busy'], 1)
+        self.assertEqual(cut.stats()['reads'], 2)
+        cut.close()
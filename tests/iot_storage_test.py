@@ -0,0 +1,351 @@
+"""
+Unittest for storage module.
+"""
+
+import configparser
+import datetime
+import os
+import sqlite3
+import unittest
+
+from iot import sense
+from iot import storage
+
+
+def _remove(database):
+    for suffix in ['', '-wal', '-shm']:
+        try:
+            os.remove(database + suffix)
+        except OSError:
+            pass
+
+
+def _rounded(rows):
+    # m2 merged sample by sample differs from the batch one in the last bits.
+    return [tuple(round(item, 9) if isinstance(item, float) else item
+                  for item in row) for row in rows]
+
+
+class ProfileTest(unittest.TestCase):
+    """
+    Test for class Profile.
+    """
+
+    def setUp(self):
+        self.cut = storage.Profile()
+
+    def tearDown(self):
+        _remove('temp.sqlite3')
+
+    def test_apply_for_success(self):
+        """
+        Test for success.
+        """
+        conn = storage.connect('temp.sqlite3', self.cut)
+        conn.close()
+
+    def test_from_config_for_failure(self):
+        """
+        Test for failure.
+        """
+        cfg = configparser.ConfigParser()
+        cfg.read_string('[data]\nbusy_timeout=foo\n')
+        self.assertRaises(ValueError, storage.Profile.from_config, cfg)
+
+    def test_apply_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        conn = storage.connect('temp.sqlite3', self.cut)
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0],
+                         'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0],
+                         5000)
+        self.assertEqual(conn.execute('PRAGMA cache_size').fetchone()[0],
+                         -8000)
+
+        # readers are not blocked by an open write transaction.
+        conn.execute('CREATE TABLE testus (timestamp INTEGER)')
+        conn.commit()
+        conn.execute('INSERT INTO testus VALUES (1)')
+        reader = storage.connect('temp.sqlite3', self.cut)
+        tmp = reader.execute('SELECT count(*) FROM testus').fetchone()
+        self.assertEqual(tmp[0], 0)
+        conn.commit()
+        tmp = reader.execute('SELECT count(*) FROM testus').fetchone()
+        self.assertEqual(tmp[0], 1)
+        reader.close()
+        conn.close()
+
+    def test_from_config_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        cfg = configparser.ConfigParser()
+        cfg.read_string('[data]\njournal_mode=DELETE\nbusy_timeout=10\n')
+        tmp = storage.Profile.from_config(cfg)
+        self.assertEqual(tmp.journal_mode, 'DELETE')
+        self.assertEqual(tmp.busy_timeout, 10)
+        self.assertEqual(tmp.synchronous, 'NORMAL')  # default
+        self.assertFalse(tmp.wal)
+
+
+class CheckpointerTest(unittest.TestCase):
+    """
+    Test for class Checkpointer.
+    """
+
+    def tearDown(self):
+        _remove('temp.sqlite3')
+
+    def test_checkpoint_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        profile = storage.Profile(checkpoint_interval=0.01)
+        conn = storage.connect('temp.sqlite3', profile)
+        conn.execute('CREATE TABLE testus (timestamp INTEGER)')
+        conn.commit()
+
+        cut = storage.Checkpointer('temp.sqlite3', profile)
+        busy, _, _ = cut.checkpoint(conn)
+        self.assertEqual(busy, 0)
+
+        cut.start()
+        cut.close()
+        self.assertFalse(cut.is_alive())
+        conn.close()
+
+
+class SchemaTest(unittest.TestCase):
+    """
+    Test for the schema helpers.
+    """
+
+    def setUp(self):
+        self.conn = sqlite3.connect('temp.sqlite3')
+
+    def tearDown(self):
+        self.conn.close()
+        _remove('temp.sqlite3')
+
+    def test_create_table_for_success(self):
+        """
+        Test for success.
+        """
+        storage.create_table(self.conn, 'testus', {'val': 1.0})
+
+    def test_create_table_for_failure(self):
+        """
+        Test for failure.
+        """
+        storage.create_table(self.conn, 'testus', {'val': 1.0})
+        self.assertRaises(sqlite3.Error, storage.create_table, self.conn,
+                          'testus', {'val': 1.0})
+
+    def test_create_table_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        storage.create_table(self.conn, 'test1', {'val': 1.0, 'foo': 'a'})
+        storage.create_table(self.conn, 'test2', {'val': 1}, version=1)
+        self.assertEqual(storage.table_info(self.conn, 'test1'),
+                         (2, [('val', 'REAL'), ('foo', 'TEXT')]))
+        self.assertEqual(storage.table_info(self.conn, 'test2'),
+                         (1, [('val', 'INTEGER')]))
+        self.assertEqual(storage.table_info(self.conn, 'test3'), (None, []))
+
+        # no secondary index for version 2 - timestamp is the rowid.
+        tmp = self.conn.execute('pragma index_list(test1)').fetchall()
+        self.assertEqual(tmp, [])
+
+    def test_to_timestamp_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        now = datetime.datetime(2017, 1, 1, 12, 0, 0, 123456)
+        secs = storage.to_timestamp(now, 1)
+        self.assertEqual(storage.to_timestamp(now), int(secs) * 1000 + 123)
+
+    def test_migrate_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        now = datetime.datetime(2017, 1, 1, 12, 0, 0)
+        storage.create_table(self.conn, 'testus', {'val': 1.0}, version=1)
+        self.conn.executemany('INSERT INTO testus VALUES (?, ?)',
+                              [(storage.to_timestamp(now, 1) + i, float(i))
+                               for i in range(3)])
+        self.conn.commit()
+
+        self.assertEqual(storage.migrate(self.conn), ['testus'])
+        self.assertEqual(storage.migrate(self.conn), [])  # only once.
+
+        self.assertEqual(storage.table_info(self.conn, 'testus'),
+                         (2, [('val', 'REAL')]))
+        tmp = self.conn.execute('SELECT * FROM testus').fetchall()
+        self.assertEqual(tmp[0], (storage.to_timestamp(now), 0.0))
+        self.assertEqual(tmp[2][0] - tmp[0][0], 2000)
+
+
+class RollupTest(unittest.TestCase):
+    """
+    Test for the rollup helpers.
+    """
+
+    def setUp(self):
+        self.conn = sqlite3.connect('temp.sqlite3')
+        self.now = datetime.datetime(2017, 1, 1, 12, 0, 0)
+        self.rows = [(self.now + datetime.timedelta(seconds=i * 7),
+                      {'val': float(i % 11), 'num': i, 'txt': 'a'})
+                     for i in range(100)]
+
+    def tearDown(self):
+        self.conn.close()
+        _remove('temp.sqlite3')
+
+    def test_create_rollup_for_success(self):
+        """
+        Test for success.
+        """
+        storage.create_table(self.conn, 'testus', {'val': 1.0})
+        storage.create_rollup(self.conn, 'testus', 60, ['val'])
+
+    def test_create_rollup_for_failure(self):
+        """
+        Test for failure.
+        """
+        # no sensor table.
+        self.assertRaises(sqlite3.Error, storage.create_rollup, self.conn,
+                          'testus', 60, ['val'])
+
+    def test_create_rollup_for_sanity(self):
+        """
+        Test for sanity - incremental & backfilled rollups are the same.
+        """
+        cut = sense.DbWrapper('test1', 'temp.sqlite3')
+        cut.insert_many(self.rows)
+        cut.close()
+        cut = sense.DbWrapper('test2', 'temp.sqlite3', rollups=())
+        cut.insert_many(self.rows)
+        cut.close()
+        self.assertEqual(storage.rollup_widths(self.conn, 'test1'),
+                         [60, 300, 3600])
+        self.assertEqual(storage.rollup_widths(self.conn, 'test2'), [])
+        self.assertEqual(storage.sensor_tables(self.conn), ['test1', 'test2'])
+
+        storage.create_rollup(self.conn, 'test2', 60, ['val', 'num'])
+        res1 = self.conn.execute('SELECT * FROM _rollup_test1_60')
+        res2 = self.conn.execute('SELECT * FROM _rollup_test2_60')
+        res1 = res1.fetchall()
+        self.assertEqual(_rounded(res1), _rounded(res2.fetchall()))
+        self.assertEqual(len(res1), 12)
+
+        # bucket, count, last_ts, val_count, val_sum, val_m2, val_min, ...
+        first = self.rows[:9]
+        self.assertEqual(res1[0][0], storage.to_timestamp(self.now, 1))
+        self.assertEqual(res1[0][1], 9)
+        self.assertEqual(res1[0][2], storage.to_timestamp(first[-1][0]))
+        self.assertEqual(res1[0][3:9], (9, 36.0, 60.0, 0.0, 8.0, 8.0))
+
+        # NULL values (NaN or missing) are skipped by the aggregates.
+        rows = [(self.now + datetime.timedelta(seconds=i * 7),
+                 {'val': float('nan') if i % 3 else float(i)})
+                for i in range(9)]
+        self.conn.commit()
+        cut = sense.DbWrapper('test3', 'temp.sqlite3', rollups=(60,))
+        cut.insert_many(rows[:1] + [(rows[1][0], {})] + rows[2:])
+        cut.close()
+        res1 = self.conn.execute('SELECT * FROM _rollup_test3_60').fetchall()
+        self.assertEqual(res1[0][1], 9)
+        self.assertEqual(res1[0][3:8], (3, 9.0, 18.0, 0.0, 6.0))
+        self.conn.execute('DROP TABLE _rollup_test3_60')
+        storage.create_rollup(self.conn, 'test3', 60, ['val'])
+        res2 = self.conn.execute('SELECT * FROM _rollup_test3_60')
+        self.assertEqual(_rounded(res1), _rounded(res2.fetchall()))
+
+        # sums of squares of older tables are turned into m2.
+        self.conn.execute('ALTER TABLE _rollup_test3_60 ADD COLUMN val_sq '
+                          'REAL')
+        self.conn.execute('UPDATE _rollup_test3_60 SET val_sq = 45.0')
+        self.conn.execute('ALTER TABLE _rollup_test3_60 DROP COLUMN val_m2')
+        self.conn.commit()
+        storage.upgrade_rollup(self.conn, 'test3', 60, ['val'])
+        res2 = self.conn.execute('SELECT val_count, val_m2 FROM '
+                                 '_rollup_test3_60').fetchall()
+        self.assertEqual(res2[0], (3, 18.0))
+        self.assertNotIn('val_sq', [item[1] for item in self.conn.execute(
+            'PRAGMA table_info(_rollup_test3_60)')])
+
+
+class RegistryTest(unittest.TestCase):
+    """
+    Test for class Registry.
+    """
+
+    def setUp(self):
+        self.cut = storage.Registry(size=2)
+        conn = sqlite3.connect('temp.sqlite3')
+        storage.create_table(conn, 'test1', {'value': 1.0})
+        conn.close()
+
+    def tearDown(self):
+        self.cut.close()
+        _remove('temp.sqlite3')
+
+    def test_connection_for_success(self):
+        """
+        Test for success.
+        """
+        with self.cut.connection('temp.sqlite3') as conn:
+            first = conn
+        with self.cut.connection('temp.sqlite3') as conn:
+            self.assertIs(conn, first)
+            with self.cut.connection('temp.sqlite3') as other:
+                self.assertIsNot(other, conn)
+        self.assertEqual(self.cut.created, 2)
+
+    def test_schema_for_failure(self):
+        """
+        Test for failure.
+        """
+        with self.cut.connection('temp.sqlite3') as conn:
+            pass
+        self.cut.close()
+        self.assertRaises(sqlite3.ProgrammingError, self.cut.schema, conn,
+                          'temp.sqlite3')
+
+    def test_schema_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        with self.cut.connection('temp.sqlite3') as conn:
+            res = self.cut.schema(conn, 'temp.sqlite3')
+            self.assertIs(self.cut.schema(conn, 'temp.sqlite3'), res)
+        self.assertEqual(res.tables, ['test1'])
+        self.assertEqual(res.table_info('test1'), (2, [('value', 'REAL')]))
+        self.assertEqual(res.table_info('test2'), (None, []))
+        self.assertEqual(self.cut.loads, 1)
+
+        # new tables are picked up.
+        writer = sqlite3.connect('temp.sqlite3')
+        storage.create_rollup(writer, 'test1', 60, ['value'])
+        storage.create_table(writer, 'test2', {'value': 'on'})
+        writer.commit()
+        with self.cut.connection('temp.sqlite3') as conn:
+            res = self.cut.schema(conn, 'temp.sqlite3')
+        self.assertEqual(res.tables, ['test1', 'test2'])
+        self.assertEqual(res.rollup_widths('test1'), [60])
+        self.assertEqual(self.cut.loads, 2)
+
+        # a replaced file drops the pooled connections.
+        writer.close()
+        os.rename('temp.sqlite3', 'temp.sqlite3.org')
+        conn = sqlite3.connect('temp.sqlite3')
+        storage.create_table(conn, 'test3', {'value': 1.0})
+        conn.close()
+        with self.cut.connection('temp.sqlite3') as conn:
+            res = self.cut.schema(conn, 'temp.sqlite3')
+        self.assertEqual(res.tables, ['test3'])
+        _remove('temp.sqlite3.org')
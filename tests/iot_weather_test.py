@@ -0,0 +1,158 @@
+"""
+Unittest for the weather module.
+"""
+
+import http.server
+import json
+import threading
+import unittest
+import urllib.parse
+
+from iot import sense
+from iot import weather
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Group endpoint of the weather service.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        server.requests.append(query['id'][0])
+        server.connections.add(self.client_address)
+        if server.status != 200:
+            self.send_response(server.status)
+            self.send_header('Retry-After', str(server.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if server.body is None and \
+                self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Cache-Control', f'max-age={server.max_age}')
+            self.end_headers()
+            return
+        body = server.body or json.dumps({'list': [
+            {'id': int(item), 'main': {'temp': 273.15 + int(item),
+                                       'humidity': 50}}
+            for item in query['id'][0].split(',')]}).encode()
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Cache-Control', f'max-age={server.max_age}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class WeatherClientTest(unittest.TestCase):
+    """
+    Test for class WeatherClient.
+    """
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('localhost', 0),
+                                                      StubHandler)
+        self.server.requests = []
+        self.server.connections = set()
+        self.server.status = 200
+        self.server.retry_after = 0
+        self.server.max_age = 60
+        self.server.body = None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.cut = weather.WeatherClient('foo', 'localhost',
+                                         self.server.server_address[1],
+                                         backoff=60)
+
+    def tearDown(self):
+        self.cut.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_get_for_success(self):
+        """
+        Test for success.
+        """
+        self.cut.register(1)
+        self.cut.register(2)
+        self.assertEqual(self.cut.get(2), (2.0, 50.0))
+        # from the cache.
+        self.assertEqual(self.cut.get(1), (1.0, 50.0))
+        self.assertEqual(self.server.requests, ['1,2'])
+
+    def test_get_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.server.status = 500
+        self.assertIsNone(self.cut.get(1))
+        self.assertEqual(self.cut.failures, 1)
+        # backing off.
+        self.assertIsNone(self.cut.get(1))
+        self.assertEqual(len(self.server.requests), 1)
+
+        # expired values are not served while the service is down.
+        self.cut.retry_at = 0
+        self.server.status = 200
+        self.server.max_age = 0
+        self.assertEqual(self.cut.get(1), (1.0, 50.0))
+        self.assertEqual(self.cut.failures, 0)
+        self.server.status = 429
+        self.server.retry_after = 3600
+        self.assertIsNone(self.cut.get(1))
+        self.assertGreater(self.cut.retry_at - weather.time.monotonic(),
+                           3000)
+        self.assertIsNone(self.cut.get(1))
+        self.assertEqual(len(self.server.requests), 3)
+
+        # malformed responses count as failures - expired values included.
+        for body in (b'{"list": [', b'{"foo": []}', b'{"list": [{"id": 1}]}',
+                     b'{"list": [{"id": 1, "main": {"temp": null, '
+                     b'"humidity": 50}}]}', b'\xff'):
+            self.cut.retry_at = 0
+            self.cut.failures = 0
+            self.server.status = 200
+            self.server.body = body
+            self.assertIsNone(self.cut.get(1), body)
+            self.assertEqual(self.cut.failures, 1)
+            self.assertGreater(self.cut.retry_at, weather.time.monotonic())
+
+    def test_get_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        self.server.max_age = 0
+        for _ in range(3):
+            self.assertEqual(self.cut.get(1), (1.0, 50.0))
+        # revalidated on one kept-alive connection.
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(self.cut.pool.created, 1)
+
+        # more cities than fit in one request.
+        for i in range(weather.GROUP_SIZE + 1):
+            self.cut.register(i)
+        self.server.requests.clear()
+        self.assertEqual(self.cut.get(weather.GROUP_SIZE), (20.0, 50.0))
+        self.assertEqual(self.server.requests, [str(weather.GROUP_SIZE)])
+
+    def test_read_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        sensor = sense.OutdoorWeather('outdoor', 3, 'foo', client=self.cut)
+        self.assertEqual(sensor.read(), {'temperature': 3.0,
+                                         'humidity': 50.0})
+        self.server.status = 500
+        sensor.client = weather.WeatherClient(
+            'foo', 'localhost', self.server.server_address[1])
+        self.assertIsNone(sensor.read())
+        sensor.client.close()
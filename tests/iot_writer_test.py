@@ -0,0 +1,114 @@
+"""
+Unittest for writer module.
+"""
+
+import datetime
+import os
+import sqlite3
+import unittest
+
+from iot import sense
+from iot import writer
+
+
+class GroupCommitWriterTest(unittest.TestCase):
+    """
+    Test for class GroupCommitWriter.
+    """
+
+    def setUp(self):
+        self.cut = writer.GroupCommitWriter('temp.sqlite3', batch_size=10,
+                                            flush_interval=50)
+
+    def tearDown(self):
+        self.cut.close()
+        try:
+            os.remove('temp.sqlite3')
+        except OSError:
+            pass
+
+    def test_put_for_success(self):
+        """
+        Test for success.
+        """
+        self.cut.start()
+        self.assertTrue(self.cut.put('testus', datetime.datetime.now(),
+                                     {'point1': 10.0}))
+
+    def test_put_for_failure(self):
+        """
+        Test for failure.
+        """
+        # expects datetime obj
+        self.assertRaises(AttributeError, self.cut.put, 'testus', 123, {})
+        # unknown policy
+        self.assertRaises(AttributeError, writer.GroupCommitWriter,
+                          'temp.sqlite3', policy='foo')
+
+    def test_put_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        now = datetime.datetime.now()
+        self.cut.start()
+        for i in range(25):
+            timestamp = now + datetime.timedelta(seconds=i)
+            self.cut.put('sensor1', timestamp, {'temperature': float(i)})
+            self.cut.put('sensor2', timestamp, {'pressure': i})
+        # duplicate timestamp is dropped without losing the rest.
+        self.cut.put('sensor2', now, {'pressure': 1})
+        self.cut.close()
+
+        conn = sqlite3.connect('temp.sqlite3')
+        for name in ['sensor1', 'sensor2']:
+            tmp = conn.execute(f'SELECT count(*) FROM {name}').fetchone()
+            self.assertEqual(tmp[0], 25)
+        conn.close()
+
+        stats = self.cut.stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['rows'], 51)
+        self.assertGreaterEqual(stats['flushes'], 6)  # batches of max 10.
+        self.assertGreater(stats['max_latency'], 0)
+
+    def test_backpressure_for_sanity(self):
+        """
+        Test for sanity of the queue full policies (writer not started).
+        """
+        now = datetime.datetime.now()
+        cut = writer.GroupCommitWriter('temp.sqlite3', queue_size=2,
+                                       policy='drop_newest')
+        self.assertTrue(cut.put('testus', now, {'val': 1}))
+        self.assertTrue(cut.put('testus', now, {'val': 2}))
+        self.assertFalse(cut.put('testus', now, {'val': 3}))
+        self.assertEqual(cut.queue.queue[-1][2], {'val': 2})
+
+        cut = writer.GroupCommitWriter('temp.sqlite3', queue_size=2,
+                                       policy='drop_oldest')
+        for i in range(3):
+            self.assertTrue(cut.put('testus', now, {'val': i}))
+        self.assertEqual([item[2]['val'] for item in cut.queue.queue], [1, 2])
+        self.assertEqual(cut.dropped, 1)
+
+        cut = writer.GroupCommitWriter('temp.sqlite3', queue_size=1,
+                                       put_timeout=0.01)
+        self.assertTrue(cut.put('testus', now, {'val': 1}))
+        self.assertFalse(cut.put('testus', now, {'val': 2}))
+        self.assertEqual(cut.queue_depth, 1)
+
+
+class WriterStoreTest(unittest.TestCase):
+    """
+    Sensors hand their data to the writer if one is given.
+    """
+
+    def test_get_store_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        cut = writer.GroupCommitWriter('temp.sqlite3')
+        store = sense.get_store('testus', 'temp.sqlite3', cut)
+        store.insert(datetime.datetime.now(), {'val': 1})
+        self.assertEqual(cut.queue_depth, 1)
+        self.assertIsInstance(sense.get_store('testus', 'temp.sqlite3'),
+                              sense.DbWrapper)
@@ -2,7 +2,10 @@
 Unittest for bottle SSL wrapper.
 """
 
+import http.client
+import ssl
 import threading
+import time
 import unittest
 
 import bottle
@@ -32,10 +35,95 @@ class SecureServerAdapterTest(unittest.TestCase):
         """
         Test for failure.
         """
-        pass  # N/A
+        cut = bottle_ssl.SecureServerAdapter('tests/files/cert.pem',
+                                             'tests/files/key.pem')
+        self.assertRaises(ssl.SSLError, cut.get_context)
 
     def test_run_for_sanity(self):
         """
         Test for sanity.
         """
-        pass  # TODO: implement
+        app = bottle.Bottle()
+        app.route('/', callback=lambda: 'hello')
+        app.route('/stream', callback=lambda: iter(['a', 'b']))
+        cut = bottle_ssl.SecureServerAdapter('tests/files/key.pem',
+                                             'tests/files/cert.pem',
+                                             host='127.0.0.1', port=0,
+                                             pool_size=2)
+        thread = threading.Thread(target=cut.run,
+                                  args=(bottle_ssl.get_app(app),))
+        thread.daemon = True
+        thread.start()
+        while cut.srv is None:
+            time.sleep(0.01)
+        port = cut.srv.server_address[1]
+        context = ssl.create_default_context(cafile='tests/files/cert.pem')
+        context.set_alpn_protocols(['h2', 'http/1.1'])
+
+        # keep-alive - unless the length of the response is unknown.
+        conn = http.client.HTTPSConnection('127.0.0.1', port,
+                                           context=context)
+        for path, body, alive in (('/', b'hello', True),
+                                  ('/', b'hello', True),
+                                  ('/stream', b'ab', False)):
+            conn.request('GET', path)
+            res = conn.getresponse()
+            self.assertEqual(res.version, 11)
+            self.assertEqual(res.read(), body)
+            self.assertEqual(conn.sock is not None, alive)
+
+        # TLS session resumption.
+        sock = context.wrap_socket(
+            ssl.create_connection(('127.0.0.1', port)),
+            server_hostname='127.0.0.1')
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        sock.recv(1024)
+        session = sock.session
+        sock.close()
+        sock = context.wrap_socket(
+            ssl.create_connection(('127.0.0.1', port)),
+            server_hostname='127.0.0.1', session=session)
+        self.assertTrue(sock.session_reused)
+        self.assertEqual(sock.selected_alpn_protocol(), 'http/1.1')
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        sock.recv(1024)
+        sock.close()
+        res = cut.handshakes.stats()
+        self.assertEqual(res['resumed'], 1)
+        self.assertEqual(res['full'], 2)
+
+        cut.srv.shutdown()
+        cut.srv.server_close()
+
+    def test_get_context_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        cut = bottle_ssl.SecureServerAdapter('tests/files/key.pem',
+                                             'tests/files/cert.pem',
+                                             session_tickets=False)
+        context = cut.get_context()
+        self.assertIs(cut.get_context(), context)
+        self.assertEqual(context.num_tickets, 0)
+        self.assertEqual(context.minimum_version, ssl.TLSVersion.TLSv1_2)
+
+
+class HandshakeStatsTest(unittest.TestCase):
+    """
+    Testcase for the HandshakeStats class.
+    """
+
+    def test_stats_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        cut = bottle_ssl.HandshakeStats()
+        self.assertEqual(cut.stats()['avg_time'], 0.0)
+        cut.add(0.004)
+        cut.add(0.001, resumed=True)
+        cut.add(0.001, failed=True)
+        res = cut.stats()
+        self.assertEqual((res['full'], res['resumed'], res['failed']),
+                         (1, 1, 1))
+        self.assertAlmostEqual(res['avg_time'], 2.0)
+        self.assertAlmostEqual(res['max_time'], 4.0)
@@ -0,0 +1,100 @@
+"""
+Unittests for the compression middleware.
+"""
+
+import gzip
+import json
+import unittest
+
+import bottle
+
+from web import compress
+
+
+def _call(app, path, headers=None):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+               'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '443', 'wsgi.url_scheme': 'https'}
+    environ.update(headers or {})
+    res = []
+
+    def start_response(status, headers, exc_info=None):
+        res.extend([status, {key.lower(): val for key, val in headers}])
+    body = b''.join(app(environ, start_response))
+    return res[0], res[1], body
+
+
+class CompressMiddlewareTest(unittest.TestCase):
+    """
+    Test the compression middleware.
+    """
+
+    def setUp(self):
+        self.data = {'values': list(range(1000))}
+        app = bottle.Bottle()
+        app.route('/json', callback=lambda: self.data)
+        app.route('/small', callback=lambda: 'small')
+        app.route('/stream', callback=lambda: (f'{i},foo\n'
+                                               for i in range(1000)))
+
+        def etag():
+            bottle.response.set_header('ETag', '"abc"')
+            if bottle.request.get_header('If-None-Match') == '"abc"':
+                bottle.response.status = 304
+                return ''
+            return 'x' * 1000
+        app.route('/etag', callback=etag)
+        self.cut = compress.CompressMiddleware(app)
+
+    def test_call_for_success(self):
+        """
+        Test for success.
+        """
+        status, headers, body = _call(self.cut, '/json')
+        self.assertEqual(status, '200 OK')
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(json.loads(body), self.data)
+
+    def test_call_for_failure(self):
+        """
+        Test for failure.
+        """
+        # too small, not accepted & unknown encodings stay as they are.
+        for path, accept in (('/small', 'gzip'),
+                             ('/json', 'gzip;q=0, deflate'),
+                             ('/json', 'compress')):
+            _, headers, _ = _call(self.cut, path,
+                                  {'HTTP_ACCEPT_ENCODING': accept})
+            self.assertNotIn('content-encoding', headers)
+
+    def test_call_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        status, headers, body = _call(self.cut, '/json',
+                                      {'HTTP_ACCEPT_ENCODING': 'gzip'})
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+        self.assertEqual(int(headers['content-length']), len(body))
+        self.assertEqual(json.loads(gzip.decompress(body)), self.data)
+
+        # streamed.
+        _, headers, body = _call(self.cut, '/stream',
+                                 {'HTTP_ACCEPT_ENCODING': 'gzip, br'})
+        self.assertNotIn('content-length', headers)
+        self.assertEqual(gzip.decompress(body).count(b'\n'), 1000)
+
+        # conditional requests with the tag of the compressed response.
+        _, headers, _ = _call(self.cut, '/etag',
+                              {'HTTP_ACCEPT_ENCODING': 'gzip'})
+        self.assertEqual(headers['etag'], '"abc-gzip"')
+        status, headers, _ = _call(self.cut, '/etag',
+                                   {'HTTP_ACCEPT_ENCODING': 'gzip',
+                                    'HTTP_IF_NONE_MATCH': '"abc-gzip"'})
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(headers['etag'], '"abc-gzip"')
+
+        res = self.cut.stats()
+        self.assertEqual(res['responses'], 4)
+        self.assertEqual(res['compressed'], 3)
+        self.assertLess(res['ratio'], 0.5)
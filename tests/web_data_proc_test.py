@@ -11,7 +11,9 @@ import unittest
 
 import pandas as pd
 
+from iot import retention
 from iot import sense
+from iot import storage
 from web import data_proc
 
 logging.basicConfig(level=logging.DEBUG)
@@ -31,6 +33,7 @@ class SensorFactoryTest(unittest.TestCase):
 
     def tearDown(self):
         os.remove('temp.db')
+        storage.REGISTRY.close()
 
     def test_get_sensors_for_success(self):
         """
@@ -53,6 +56,14 @@ class SensorFactoryTest(unittest.TestCase):
         self.assertEqual(tmp['testus'].name, 'testus')
         for _, item in tmp.items():
             self.assertIsInstance(item, data_proc.SensorData)
+            item.close()
+
+        # a borrowed connection is shared & not closed.
+        with storage.REGISTRY.connection('temp.db') as conn:
+            tmp = self.cut.get_sensors(conn)
+            self.assertIs(tmp['testus'].conn, conn)
+            tmp['testus'].close()
+            conn.execute('SELECT 1')
 
 
 class SensorDataTest(unittest.TestCase):
@@ -69,7 +80,9 @@ class SensorDataTest(unittest.TestCase):
                                            '1Min').get_sensors()['testus']
 
     def tearDown(self):
+        self.cut.close()
         os.remove('temp.db')
+        storage.REGISTRY.close()
 
     def test_get_data_for_success(self):
         """
@@ -105,6 +118,351 @@ class SensorDataTest(unittest.TestCase):
         self.assertTrue(len(data) == 0)  # ask for range in the past
 
 
+class SensorDataAggregateTest(unittest.TestCase):
+    """
+    Testcase for the SQL side resampling of the SensorData class.
+    """
+
+    def setUp(self):
+        self.end = time.mktime(datetime.datetime(2017, 1, 1).timetuple())
+        self.start = self.end - 3600
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        first = datetime.datetime.fromtimestamp(self.start)
+        db_wrap.insert_many([(first + datetime.timedelta(seconds=i * 7),
+                              {'temperature': float(i % 13),
+                               'humidity': i % 17,
+                               'state': 'foo'})
+                             for i in range(1, 3600 // 7)])
+        db_wrap.close()
+
+        self.cut = data_proc.SensorFactory('temp.db',
+                                           '5Min').get_sensors()['testus']
+
+    def tearDown(self):
+        self.cut.close()
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_get_data_for_success(self):
+        """
+        test for success.
+        """
+        for item in data_proc.AGGREGATES:
+            self.cut.get_data(self.start, self.end, aggregate=item)
+
+    def test_get_data_for_failure(self):
+        """
+        test for failure.
+        """
+        self.assertRaises(AttributeError, self.cut.get_data, self.start,
+                          self.end, aggregate='median')
+
+    def test_get_data_for_sanity(self):
+        """
+        test for sanity - results match the pandas based resampling.
+        """
+        raw = self.cut.get_data(self.start, self.end, resample=False)
+        expected = raw.resample('5Min')
+
+        data = self.cut.get_data(self.start, self.end, aggregate='first')
+        pd.testing.assert_frame_equal(data, self.cut.get_data(self.start,
+                                                              self.end),
+                                      check_dtype=False, check_freq=False)
+        self.assertEqual(len(data), 12)
+
+        for item in ['avg', 'min', 'max', 'last']:
+            data = self.cut.get_data(self.start, self.end, aggregate=item)
+            tmp = expected[['temperature', 'humidity']]
+            tmp = getattr(tmp, 'mean' if item == 'avg' else item)()
+            pd.testing.assert_frame_equal(data[['temperature', 'humidity']],
+                                          tmp.round(2), check_dtype=False,
+                                          check_freq=False)
+        self.assertIn('state', data)  # last keeps text columns.
+        self.assertNotIn('state', self.cut.get_data(self.start, self.end,
+                                                    aggregate='avg'))
+
+
+class SensorDataRollupTest(unittest.TestCase):
+    """
+    Testcase for reading from the rollup tables of the SensorData class.
+    """
+
+    def setUp(self):
+        self.end = time.mktime(datetime.datetime(2017, 1, 2).timetuple())
+        self.start = self.end - 86400
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        first = datetime.datetime.fromtimestamp(self.start)
+        # some missing values (stored as NULL).
+        db_wrap.insert_many([(first + datetime.timedelta(seconds=i * 13),
+                              {'temperature': float(i % 19) if i % 101
+                               else float('nan'),
+                               'humidity': i % 23})
+                             for i in range(86400 // 13)])
+        db_wrap.close()
+
+        self.cut = data_proc.SensorFactory('temp.db',
+                                           '1h').get_sensors()['testus']
+
+    def tearDown(self):
+        self.cut.close()
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_pick_rollup_for_sanity(self):
+        """
+        test for sanity.
+        """
+        self.assertEqual(self.cut._pick_rollup(3600 * 24), 3600)
+        self.assertEqual(self.cut._pick_rollup(600), 300)
+        self.assertEqual(self.cut._pick_rollup(120), 60)
+        self.assertIsNone(self.cut._pick_rollup(90))
+
+    def test_get_data_for_sanity(self):
+        """
+        test for sanity - rollups give the same results as the raw data.
+        """
+        # window not aligned to buckets.
+        start = self.start + 1234
+        end = self.end - 4321
+        res = {}
+        for item in ['avg', 'min', 'max', 'last']:
+            res[item] = self.cut.get_data(start, end, round_digits=6,
+                                          aggregate=item)
+            self.assertEqual(len(res[item]), 23)
+
+        for width in storage.ROLLUP_WIDTHS:
+            self.cut.conn.execute('DROP TABLE '
+                                  f'{storage.rollup_name("testus", width)}')
+        for item in ['avg', 'min', 'max', 'last']:
+            pd.testing.assert_frame_equal(
+                res[item], self.cut.get_data(start, end, round_digits=6,
+                                             aggregate=item),
+                check_dtype=False)
+
+    def test_get_data_pruned_for_sanity(self):
+        """
+        test for sanity - pruned samples are served from the kept rollup.
+        """
+        cut = data_proc.SensorData('testus', 'temp.db', '5Min',
+                                   conn=self.cut.conn)
+        hourly = self.cut.get_data(self.start, self.end, aggregate='avg')
+        fine = cut.get_data(self.start, self.end, aggregate='avg')
+        self.assertIsNone(cut._pruned(self.start, 1000, 300))
+
+        middle = self.start + 43200
+        retention.Retention('temp.db', raw_days=1, pause=0).prune(
+            self.cut.conn, 'testus', middle)
+        self.assertEqual(cut._pruned(self.start, 1000, 300),
+                         (3600, middle))
+        res = cut.get_data(self.start, self.end, aggregate='avg')
+        self.assertEqual(len(res), 12 + 144)
+        # the first bucket also holds the sample at start.
+        pd.testing.assert_frame_equal(res.iloc[1:12], hourly.iloc[1:12])
+        pd.testing.assert_frame_equal(res.iloc[12:], fine.iloc[144:])
+        # recent windows are not affected.
+        pd.testing.assert_frame_equal(
+            cut.get_data(middle, self.end, aggregate='avg'),
+            fine.iloc[144:])
+
+
+class QueryCacheTest(unittest.TestCase):
+    """
+    Testcase for the QueryCache class.
+    """
+
+    def setUp(self):
+        self.end = time.mktime(datetime.datetime(2017, 1, 2).timetuple())
+        self.start = self.end - 3600
+        self.db_wrap = sense.DbWrapper('testus', 'temp.db')
+        self.first = datetime.datetime.fromtimestamp(self.start)
+        self._insert(0, 300)
+
+        self.sensor = data_proc.SensorFactory('temp.db',
+                                              '5Min').get_sensors()['testus']
+        self.cut = data_proc.QueryCache(maxsize=2)
+
+    def tearDown(self):
+        self.sensor.close()
+        self.db_wrap.close()
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def _insert(self, begin, end):
+        self.db_wrap.insert_many([(self.first +
+                                   datetime.timedelta(seconds=i * 10),
+                                   {'temperature': float(i % 7)})
+                                  for i in range(begin, end)])
+
+    def test_get_data_for_success(self):
+        """
+        test for success.
+        """
+        self.cut.get_data(self.sensor, self.start, self.end)
+        self.cut.get_data(self.sensor, self.start, self.end, aggregate='avg')
+
+    def test_get_data_for_failure(self):
+        """
+        test for failure.
+        """
+        self.assertRaises(AttributeError, self.cut.get_data, self.sensor,
+                          self.start, self.end, aggregate='foo')
+
+    def test_get_data_for_sanity(self):
+        """
+        test for sanity.
+        """
+        for aggregate in [None, 'avg']:
+            res = self.cut.get_data(self.sensor, self.start, self.end,
+                                    aggregate=aggregate)
+            tmp = self.cut.get_data(self.sensor, self.start, self.end,
+                                    aggregate=aggregate)
+            pd.testing.assert_frame_equal(res, tmp)
+        self.assertEqual((self.cut.misses, self.cut.hits), (2, 2))
+
+        # new data - only the tail is fetched.
+        self._insert(300, 330)
+        start = self.start + 300
+        end = self.end + 300
+        for aggregate in [None, 'avg']:
+            res = self.cut.get_data(self.sensor, start, end,
+                                    aggregate=aggregate)
+            tmp = self.sensor.get_data(start, end, aggregate=aggregate)
+            # head bucket might still include samples just before start.
+            pd.testing.assert_frame_equal(res[1:], tmp[1:], check_freq=False)
+        self.assertEqual((self.cut.misses, self.cut.tails), (2, 2))
+
+        # LRU eviction & TTL.
+        self.cut.get_data(self.sensor, start, end, aggregate='max')
+        self.assertEqual(len(self.cut._entries), 2)
+        self.cut.ttl = 0
+        self.cut.get_data(self.sensor, start, end, aggregate='max')
+        self.assertEqual(self.cut.misses, 4)
+
+        # an older window of the same length is not served from the cache.
+        self.cut.ttl = 300
+        res = self.cut.get_data(self.sensor, start - 1800, end - 1800,
+                                aggregate='max')
+        pd.testing.assert_frame_equal(
+            res, self.sensor.get_data(start - 1800, end - 1800,
+                                      aggregate='max'))
+        tmp = self.cut.get_data(self.sensor, start, end, aggregate='max')
+        pd.testing.assert_frame_equal(
+            tmp, self.sensor.get_data(start, end, aggregate='max'))
+        self.assertFalse(tmp.equals(res))
+        self.assertEqual(self.cut.hits, 3)
+
+    def test_get_tail_for_sanity(self):
+        """
+        test for sanity - incremental resampling matches a full recompute.
+        """
+        res = self.sensor.get_data(self.start, self.end)
+        latest = self.sensor.latest()
+        # nothing new.
+        self.assertIs(self.sensor.get_tail(res, latest, self.end), res)
+
+        # samples in the last bucket, after a gap of empty buckets & more.
+        self._insert(300, 305)
+        self._insert(450, 500)
+        end = self.end + 3600
+        res = self.sensor.get_tail(res, latest, end)
+        pd.testing.assert_frame_equal(
+            res, self.sensor.get_data(self.start, end), check_freq=False)
+
+
+class MetricsTest(unittest.TestCase):
+    """
+    Test the derived metrics.
+    """
+
+    def setUp(self):
+        self.data = pd.DataFrame({'temperature': [20.0, 32.22, 10.0],
+                                  'humidity': [50.0, 70.0, 100.0],
+                                  'pressure': [1.0, 2.0, 3.0]})
+
+    def test_add_metrics_for_success(self):
+        """
+        Test for success.
+        """
+        data_proc.add_metrics(self.data, list(data_proc.METRICS))
+
+    def test_add_metrics_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.assertRaises(KeyError, data_proc.add_metrics, self.data,
+                          ['foo'])
+
+    def test_add_metrics_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        data_proc.add_metrics(self.data, list(data_proc.METRICS))
+        # same as the per row calculation.
+        for _, row in self.data.iterrows():
+            hum = row['humidity']
+            temp = row['temperature']
+            self.assertAlmostEqual(row['tau'], (hum / 100) ** (1 / 8.02) *
+                                   (109.8 + temp) - 109.8)
+        self.assertAlmostEqual(self.data['tau'][2], 10.0)
+        self.assertAlmostEqual(self.data['abs_humidity'][0], 8.64, places=2)
+        self.assertAlmostEqual(self.data['heat_index'][1], 41.1, places=1)
+        self.assertAlmostEqual(self.data['heat_index'][2], 9.7, places=1)
+
+        # only for frames with the needed columns.
+        tmp = data_proc.add_metrics(self.data[['pressure']].copy())
+        self.assertEqual(list(tmp.columns), ['pressure'])
+
+        # new metrics can be registered.
+        data_proc.register_metric('double', ['pressure'], lambda x: x * 2)
+        tmp = data_proc.add_metrics(tmp, ['double'])
+        self.assertEqual(tmp['double'].tolist(), [2.0, 4.0, 6.0])
+        del data_proc.METRICS['double']
+
+
+class CombineTest(unittest.TestCase):
+    """
+    Test the combine routine.
+    """
+
+    def setUp(self):
+        index = pd.date_range('2017-01-01', periods=4, freq='5min',
+                              tz='UTC')
+        self.frames = {
+            'test2': pd.DataFrame({'temperature': [1.0, 2.0, 3.0, 4.0],
+                                   'humidity': [5.0, 6.0, 7.0, 8.0]},
+                                  index=index),
+            'test1': pd.DataFrame({'temperature': [9.0, 10.0]},
+                                  index=index[1:4:2]),
+            'test3': pd.DataFrame({'pressure': [11.0]}, index=index[:1])}
+
+    def test_combine_for_success(self):
+        """
+        Test for success.
+        """
+        data_proc.combine(self.frames)
+
+    def test_combine_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.assertEqual(data_proc.combine({}), {})
+
+    def test_combine_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        tmp = data_proc.combine(self.frames)
+        self.assertEqual(list(tmp), ['humidity', 'temperature', 'pressure'])
+        self.assertEqual(list(tmp['temperature']), ['test2', 'test1'])
+        # first row dropped as test1 had no data yet, gaps forward filled.
+        self.assertEqual(tmp['temperature']['test1'].tolist(),
+                         [9.0, 9.0, 10.0])
+        self.assertEqual(tmp['temperature']['test2'].tolist(),
+                         [2.0, 3.0, 4.0])
+        self.assertEqual(tmp['pressure']['test3'].tolist(), [11.0])
+        self.assertEqual(len(tmp['humidity']), 4)
+
+
 class GetDataTest(unittest.TestCase):
     """
     Test the get_data routine.
@@ -127,6 +485,7 @@ class GetDataTest(unittest.TestCase):
 
     def tearDown(self):
         os.remove('temp.db')
+        storage.REGISTRY.close()
 
     def test_get_data_for_success(self):
         """
@@ -169,6 +528,76 @@ class GetDataTest(unittest.TestCase):
         for _, item in tmp.items():
             self.assertIsInstance(item, pd.DataFrame)
 
+        # columns can be looked up without reading the data.
+        self.assertEqual(data_proc.get_columns('temp.db'), list(tmp))
+
+    def test_get_latest_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        tmp = data_proc.get_latest('temp.db')
+        self.assertEqual(sorted(tmp), ['test1', 'test2', 'test3'])
+        now = time.mktime(datetime.datetime.utcnow().timetuple())
+        for item in tmp.values():
+            self.assertLess(abs(item - now), 5)
+
+
+class ReadPoolTest(unittest.TestCase):
+    """
+    Test the concurrent reads of get_data.
+    """
+
+    def setUp(self):
+        first = datetime.datetime(2017, 1, 1)
+        for i in range(6):
+            db_wrap = sense.DbWrapper(f'sensor{i}', 'temp.db')
+            data = {'temperature': 20.0 + i, 'humidity': 50.0}
+            if i % 2:
+                data['pressure'] = 1000.0
+            db_wrap.insert_many([(first + datetime.timedelta(minutes=j),
+                                  data) for j in range(60)])
+            db_wrap.close()
+        self.start = time.mktime(first.timetuple()) - 1
+        self.end = self.start + 3600
+        self.cut = data_proc.ReadPool(3)
+
+    def tearDown(self):
+        self.cut.close()
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_map_for_success(self):
+        """
+        Test for success.
+        """
+        res = self.cut.map(lambda conn, item: (conn, item), 'temp.db',
+                           range(20))
+        self.assertEqual([item[1] for item in res], list(range(20)))
+        # one connection per worker.
+        self.assertLessEqual(len({id(item[0]) for item in res}), 3)
+
+    def test_map_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.assertRaises(ValueError, self.cut.map,
+                          lambda conn, item: int(item), 'temp.db', ['a'])
+
+    def test_get_data_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        for aggregate in (None, 'avg'):
+            serial = data_proc.get_data('temp.db', self.start, self.end,
+                                        '5Min', aggregate=aggregate)
+            res = data_proc.get_data('temp.db', self.start, self.end,
+                                     '5Min', aggregate=aggregate,
+                                     pool=self.cut)
+            self.assertEqual(list(res), list(serial))
+            for key, val in serial.items():
+                pd.testing.assert_frame_equal(res[key], val)
+                self.assertEqual(list(res[key].columns), list(val.columns))
+
 
 class DummySensor(threading.Thread):
     """
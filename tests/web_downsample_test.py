@@ -0,0 +1,106 @@
+"""
+Unittests for the downsample module.
+"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from web import downsample
+
+
+class LttbTest(unittest.TestCase):
+    """
+    Test the lttb routine.
+    """
+
+    def setUp(self):
+        self.x_values = np.arange(1000)
+        self.y_values = np.sin(self.x_values / 50.0)
+        self.y_values[500] = 10  # spike.
+
+    def test_lttb_for_success(self):
+        """
+        Test for success.
+        """
+        downsample.lttb(self.x_values, self.y_values, 100)
+
+    def test_lttb_for_failure(self):
+        """
+        Test for failure.
+        """
+        # nothing to do.
+        self.assertEqual(len(downsample.lttb(self.x_values, self.y_values,
+                                             2000)), 1000)
+        self.assertEqual(len(downsample.lttb([], [], 10)), 0)
+
+    def test_lttb_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        res = downsample.lttb(self.x_values, self.y_values, 100)
+        self.assertEqual(len(res), 100)
+        self.assertEqual(res[0], 0)
+        self.assertEqual(res[-1], 999)
+        self.assertTrue(np.all(np.diff(res) > 0))
+        self.assertIn(500, res)  # peaks are kept.
+
+
+class MinmaxTest(unittest.TestCase):
+    """
+    Test the minmax routine.
+    """
+
+    def test_minmax_for_success(self):
+        """
+        Test for success.
+        """
+        downsample.minmax(np.arange(100), 10)
+
+    def test_minmax_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.assertEqual(len(downsample.minmax(np.arange(5), 10)), 5)
+
+    def test_minmax_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        values = np.zeros(1000)
+        values[123] = -5
+        values[876] = 5
+        res = downsample.minmax(values, 20)
+        self.assertLessEqual(len(res), 20)
+        self.assertIn(123, res)
+        self.assertIn(876, res)
+        self.assertTrue(np.all(np.diff(res) > 0))
+
+
+class ToColumnsTest(unittest.TestCase):
+    """
+    Test the to_columns routine.
+    """
+
+    def test_to_columns_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        index = pd.date_range('2017-01-01', periods=1000, freq='5min',
+                              tz='UTC')
+        data = pd.DataFrame({'test1': np.arange(1000.0),
+                             'test2': np.ones(1000)}, index=index)
+        res = downsample.to_columns(data, 50, 'minmax')
+        self.assertEqual(res['start'], 1483228800)
+        self.assertEqual([item['label'] for item in res['series']],
+                         ['test1', 'test2'])
+        # first & last point of each bucket for a monotonic series.
+        self.assertEqual(res['series'][0]['t'][:3], [0, 11700, 12000])
+        self.assertEqual(res['series'][0]['v'][:3], [0.0, 39.0, 40.0])
+        self.assertLessEqual(len(res['series'][0]['v']), 50)
+
+        res = downsample.to_columns(data, 2000)
+        self.assertEqual(len(res['series'][1]['t']), 1000)
+        self.assertEqual(downsample.to_columns(data[:0], 10),
+                         {'start': None, 'series': []})
@@ -0,0 +1,182 @@
+"""
+Unittests for the export module.
+"""
+
+import datetime
+import io
+import os
+import sys
+import time
+import unittest
+
+import bottle
+
+from iot import sense
+from iot import storage
+from web import export
+from web import wsgi_app
+
+
+def _call(app, path, query='', login=True):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+               'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '443', 'wsgi.url_scheme': 'https',
+               'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr}
+    if login:
+        tmp = bottle.BaseResponse()
+        tmp.set_cookie('account', 'foo', secret=wsgi_app.PASSPHRASE)
+        environ['HTTP_COOKIE'] = tmp.headerlist[-1][1].split(';')[0]
+    res = []
+    body = b''.join(app(environ, lambda status, headers, exc_info=None:
+                        res.append((status, dict(headers)))))
+    return res[0][0], res[0][1], body
+
+
+class IterCsvTest(unittest.TestCase):
+    """
+    Test the CSV export.
+    """
+
+    def setUp(self):
+        self.start = time.mktime(datetime.datetime(2017, 1, 1).timetuple())
+        first = datetime.datetime.fromtimestamp(self.start)
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        db_wrap.insert_many([(first + datetime.timedelta(seconds=i),
+                              {'temperature': i / 10.0, 'state': 'ok'})
+                             for i in range(2500)])
+        db_wrap.close()
+
+    def tearDown(self):
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_iter_csv_for_success(self):
+        """
+        Test for success.
+        """
+        list(export.iter_csv('temp.db', 'testus'))
+
+    def test_iter_csv_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.assertRaises(KeyError, list,
+                          export.iter_csv('temp.db', '_rollup_testus_60'))
+
+    def test_iter_csv_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        res = list(export.iter_csv('temp.db', 'testus', chunk_size=1000))
+        self.assertEqual(len(res), 4)  # header + 3 chunks.
+        lines = b''.join(res).decode().splitlines()
+        self.assertEqual(lines[0], 'timestamp,temperature,state')
+        self.assertEqual(lines[2], datetime.datetime.fromtimestamp(
+            self.start + 1, tz=datetime.timezone.utc).isoformat(
+                timespec='milliseconds') + ',0.1,ok')
+        self.assertEqual(len(lines), 2501)
+
+        # time range.
+        res = list(export.iter_csv('temp.db', 'testus', self.start + 9,
+                                   self.start + 19))
+        lines = b''.join(res).decode().splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertTrue(lines[1].endswith(',1.0,ok'))
+
+
+@unittest.skipIf(export.pyarrow is None, 'pyarrow not available.')
+class IterParquetTest(unittest.TestCase):
+    """
+    Test the parquet export.
+    """
+
+    def setUp(self):
+        first = datetime.datetime(2017, 1, 1)
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        db_wrap.insert_many([(first + datetime.timedelta(seconds=i),
+                              {'temperature': i / 10.0, 'count': i})
+                             for i in range(2500)])
+        db_wrap.close()
+
+    def tearDown(self):
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_iter_parquet_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        res = list(export.iter_parquet('temp.db', 'testus', chunk_size=1000))
+        table = export.pyarrow.parquet.read_table(io.BytesIO(b''.join(res)))
+        self.assertEqual(table.num_rows, 2500)
+        self.assertEqual(table.column_names,
+                         ['timestamp', 'temperature', 'count'])
+        self.assertEqual(table.column('count').to_pylist()[-1], 2499)
+        self.assertEqual(str(table.schema.field(0).type),
+                         'timestamp[ms, tz=UTC]')
+
+        # empty range still yields a valid file.
+        res = list(export.iter_parquet('temp.db', 'testus', 0, 1))
+        table = export.pyarrow.parquet.read_table(io.BytesIO(b''.join(res)))
+        self.assertEqual(table.num_rows, 0)
+
+
+class DownloadTest(unittest.TestCase):
+    """
+    Test the /download route of the app.
+    """
+
+    def setUp(self):
+        self.start = time.mktime(datetime.datetime(2017, 1, 1).timetuple())
+        first = datetime.datetime.fromtimestamp(self.start)
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        db_wrap.insert_many([(first + datetime.timedelta(seconds=i),
+                              {'temperature': i / 10.0})
+                             for i in range(100)])
+        db_wrap.close()
+        self.cut = wsgi_app.MainApp('temp.db', 86400, '5Min', 'foo',
+                                    'bar').app
+
+    def tearDown(self):
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_download_for_failure(self):
+        """
+        Test for failure.
+        """
+        status, headers, _ = _call(self.cut, '/download/testus',
+                                   login=False)
+        self.assertTrue(status.startswith('30'))
+        self.assertTrue(headers['Location'].endswith('/login'))
+        for name in ('foo', '_rollup_testus_60'):
+            status, _, _ = _call(self.cut, f'/download/{name}')
+            self.assertTrue(status.startswith('404'), name)
+        for query in ('format=xls', 'start=foo', 'end=bar'):
+            status, _, _ = _call(self.cut, '/download/testus', query)
+            self.assertTrue(status.startswith('400'), query)
+
+    def test_download_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        status, headers, body = _call(self.cut, '/download/testus',
+                                      f'start={self.start + 9}&'
+                                      f'end={self.start + 19}')
+        self.assertTrue(status.startswith('200'))
+        self.assertTrue(headers['Content-Type'].startswith('text/csv'))
+        self.assertEqual(headers['Content-Disposition'],
+                         'attachment; filename="testus.csv"')
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0], 'timestamp,temperature')
+        self.assertEqual(len(lines), 11)
+
+        if export.pyarrow is not None:
+            status, headers, body = _call(self.cut, '/download/testus',
+                                          'format=parquet')
+            self.assertEqual(headers['Content-Type'],
+                             export.CONTENT_TYPES['parquet'])
+            self.assertEqual(headers['Content-Disposition'],
+                             'attachment; filename="testus.parquet"')
+            table = export.pyarrow.parquet.read_table(io.BytesIO(body))
+            self.assertEqual(table.num_rows, 100)
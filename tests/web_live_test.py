@@ -0,0 +1,169 @@
+"""
+Unittests for the live feed.
+"""
+
+import datetime
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import unittest
+
+import bottle
+
+from iot import sense
+from iot import storage
+from web import live
+from web import wsgi_app
+
+
+class ChangeNotifierTest(unittest.TestCase):
+    """
+    Test the change notifier.
+    """
+
+    def setUp(self):
+        self.db_wrap = sense.DbWrapper('testus', 'temp.db')
+        self.db_wrap.insert(datetime.datetime(2017, 1, 1),
+                            {'temperature': 20.0})
+        self.cut = live.ChangeNotifier('temp.db', interval=0.01)
+        self.conn = storage.connect('temp.db')
+
+    def tearDown(self):
+        self.cut.close()
+        self.conn.close()
+        self.db_wrap.close()
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_poll_for_success(self):
+        """
+        Test for success.
+        """
+        # existing samples are not published.
+        self.assertEqual(self.cut.poll(self.conn), 0)
+        self.assertEqual(self.cut.seq, 0)
+
+    def test_poll_for_failure(self):
+        """
+        Test for failure.
+        """
+        self.conn.close()
+        self.assertRaises(sqlite3.Error, self.cut.poll, self.conn)
+
+    def test_poll_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        self.cut.poll(self.conn)
+        self.db_wrap.insert_many([(datetime.datetime(2017, 1, 1, 0, 0, i),
+                                   {'temperature': 20.0 + i})
+                                  for i in range(1, 4)])
+        other = sense.DbWrapper('other', 'temp.db')
+        other.insert(datetime.datetime(2017, 1, 1), {'state': 'on'})
+        other.close()
+        self.assertEqual(self.cut.poll(self.conn), 4)
+        # nothing changed.
+        self.assertEqual(self.cut.poll(self.conn), 0)
+
+        events = self.cut.wait(0)
+        self.assertEqual(len(events), 1)
+        samples = json.loads(events[0][1])['samples']
+        first = storage.to_timestamp(datetime.datetime(2017, 1, 1))
+        self.assertIn({'sensor': 'other', 't': first,
+                       'values': {'state': 'on'}}, samples)
+        self.assertIn({'sensor': 'testus', 't': first + 3000,
+                       'values': {'temperature': 23.0}}, samples)
+        self.assertEqual(self.cut.wait(1, timeout=0.01), [])
+
+    def test_run_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        self.cut.start()
+        res = []
+        thread = threading.Thread(
+            target=lambda: res.extend(live.iter_events(self.cut)))
+        thread.start()
+        while self.cut._version is None:
+            self.cut.wait(0, timeout=0.01)
+        self.db_wrap.insert(datetime.datetime(2017, 1, 2),
+                            {'temperature': 21.0})
+        self.cut.wait(0, timeout=5)
+        self.cut.close()
+        thread.join()
+
+        self.assertEqual(res[0], 'retry: 10\n\n')
+        self.assertTrue(res[1].startswith('id: 1\nevent: samples\ndata: '))
+        self.assertEqual(json.loads(res[1].split('data: ')[1])['samples'][0]
+                         ['values'], {'temperature': 21.0})
+
+
+class IterEventsTest(unittest.TestCase):
+    """
+    Test the server-sent events.
+    """
+
+    def test_iter_events_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        notifier = live.ChangeNotifier('temp.db', interval=1, backlog=2)
+        for item in ('a', 'b', 'c'):
+            notifier.publish(item)
+        # only the backlog is kept; unknown ids start from now.
+        res = list(live.iter_events(notifier, 0, keepalive=0.01,
+                                    duration=0.05))
+        self.assertEqual(res[1:3], ['id: 2\nevent: samples\ndata: b\n\n',
+                                    'id: 3\nevent: samples\ndata: c\n\n'])
+        self.assertEqual(res[3], ': keep-alive\n\n')
+        res = list(live.iter_events(notifier, 42, keepalive=0.01,
+                                    duration=0.02))
+        self.assertNotIn('id: 3\nevent: samples\ndata: c\n\n', res)
+
+
+class StreamTest(unittest.TestCase):
+    """
+    Test the /stream route of the app.
+    """
+
+    def setUp(self):
+        self.notifier = live.ChangeNotifier('temp.db', interval=1)
+        self.cut = wsgi_app.MainApp('temp.db', 86400, '5Min', 'foo', 'bar',
+                                    notifier=self.notifier,
+                                    max_streams=2).app
+
+    def _open(self):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/stream',
+                   'SERVER_NAME': 'localhost', 'SERVER_PORT': '443',
+                   'wsgi.url_scheme': 'https', 'wsgi.input': io.BytesIO(),
+                   'wsgi.errors': sys.stderr}
+        login = bottle.BaseResponse()
+        login.set_cookie('account', 'foo', secret=wsgi_app.PASSPHRASE)
+        environ['HTTP_COOKIE'] = login.headerlist[-1][1].split(';')[0]
+        res = []
+        body = self.cut(environ, lambda status, headers, exc_info=None:
+                        res.append((status, dict(headers))))
+        return res[0], body
+
+    def test_stream_for_sanity(self):
+        """
+        Test for sanity - only max_streams are served at the same time.
+        """
+        first = self._open()
+        second = self._open()
+        self.assertTrue(first[0][0].startswith('200'))
+        self.assertTrue(second[0][0].startswith('200'))
+        (status, headers), _ = self._open()
+        self.assertTrue(status.startswith('503'))
+        self.assertEqual(headers['Retry-After'],
+                         str(wsgi_app.STREAM_RETRY))
+
+        # a closed stream frees its slot.
+        first[1].close()
+        (status, _), body = self._open()
+        self.assertTrue(status.startswith('200'))
+        body.close()
+        second[1].close()
@@ -0,0 +1,127 @@
+"""
+Unittests for the stats module.
+"""
+
+import datetime
+import os
+import time
+import unittest
+
+import numpy as np
+
+from iot import sense
+from iot import storage
+from web import data_proc
+from web import stats
+
+
+class HistogramTest(unittest.TestCase):
+    """
+    Test the streaming percentile estimate.
+    """
+
+    def test_quantile_for_success(self):
+        """
+        Test for success.
+        """
+        hist = stats.Histogram(0, 1)
+        self.assertIsNone(hist.quantile(0.5))
+        hist.update([0.5, np.nan])
+        hist.quantile(0.5)
+
+    def test_quantile_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        values = np.random.default_rng(42).normal(20, 5, 100000)
+        hist = stats.Histogram(values.min(), values.max(), bins=1024)
+        for chunk in np.array_split(values, 10):
+            hist.update(chunk)
+        width = (values.max() - values.min()) / 1024
+        for item in (0.01, 0.5, 0.99):
+            self.assertAlmostEqual(hist.quantile(item),
+                                   np.quantile(values, item), delta=width)
+
+
+class GetStatsTest(unittest.TestCase):
+    """
+    Test the statistics.
+    """
+
+    def setUp(self):
+        # start on a day boundary - 3 days of samples every 30 seconds.
+        self.start = 1483228800
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        db_wrap.insert_many([
+            (datetime.datetime.fromtimestamp(self.start + i * 30),
+             {'temperature': float(i % 97), 'humidity': float(i % 13),
+              'state': 'ok'})
+            for i in range(1, 8640)])
+        db_wrap.close()
+        self.sensor = data_proc.SensorData('testus', 'temp.db', '1min')
+
+    def tearDown(self):
+        self.sensor.close()
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_get_stats_for_success(self):
+        """
+        Test for success.
+        """
+        stats.get_stats(self.sensor, self.start, self.start + 86400 * 3,
+                        percentiles=(50, 99))
+
+    def test_get_stats_for_failure(self):
+        """
+        Test for failure.
+        """
+        res = stats.get_stats(self.sensor, self.start - 100, self.start)
+        self.assertEqual(res['temperature']['count'], 0)
+        self.assertIsNone(res['temperature']['mean'])
+        self.assertEqual(res['temperature']['daily'], {})
+
+    def test_get_stats_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        # rollup path (window not aligned) & raw path agree with numpy.
+        values = np.array([i % 97 for i in range(1, 8640)], dtype=float)
+        for start, end in ((self.start + 1234, self.start + 200000),
+                           (self.start + 100, self.start + 3000)):
+            res = stats.get_stats(self.sensor, start, end,
+                                  percentiles=(50,))['temperature']
+            tmp = values[(start - self.start) // 30:
+                         (end - self.start) // 30]
+            self.assertEqual(res['count'], len(tmp))
+            self.assertAlmostEqual(res['mean'], tmp.mean())
+            self.assertAlmostEqual(res['stddev'], tmp.std())
+            self.assertEqual(res['min'], tmp.min())
+            self.assertEqual(res['max'], tmp.max())
+            self.assertAlmostEqual(res['percentiles']['50'],
+                                   np.median(tmp), delta=1)
+        self.assertNotIn('state', res)
+
+        # daily min/max.
+        res = stats.get_stats(self.sensor, self.start, self.start + 86400 * 3)
+        day = time.strftime('%Y-%m-%d', time.gmtime(self.start + 86400))
+        self.assertEqual(len(res['humidity']['daily']), 3)
+        self.assertEqual(res['humidity']['daily'][day], [0.0, 12.0])
+
+        # large values with a small spread - no cancellation.
+        db_wrap = sense.DbWrapper('pressure', 'temp.db')
+        db_wrap.insert_many([
+            (datetime.datetime.fromtimestamp(self.start + i * 30),
+             {'value': 1e8 + (i % 3) * 0.1}) for i in range(1, 8640)])
+        db_wrap.close()
+        values = np.array([1e8 + (i % 3) * 0.1 for i in range(1, 8640)])
+        sensor = data_proc.SensorData('pressure', 'temp.db', '1min')
+        try:
+            for start, end in ((self.start + 1234, self.start + 200000),
+                               (self.start + 100, self.start + 3000)):
+                res = stats.get_stats(sensor, start, end)['value']
+                tmp = values[(start - self.start) // 30:
+                             (end - self.start) // 30]
+                self.assertAlmostEqual(res['stddev'], tmp.std(), places=6)
+        finally:
+            sensor.close()
@@ -0,0 +1,318 @@
+"""
+Unittests for the routes of the WSGI app.
+"""
+
+import datetime
+import email.utils
+import io
+import json
+import os
+import sys
+import time
+import unittest
+
+import bottle
+
+from iot import instrument
+from iot import sense
+from iot import storage
+from web import compress
+from web import data_proc
+from web import wsgi_app
+
+END = datetime.datetime(2017, 1, 2)
+
+
+def call(app, path, query='', headers=None, login=True):
+    """
+    Call a WSGI app - returns status, headers & body.
+    """
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+               'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '443', 'wsgi.url_scheme': 'https',
+               'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr}
+    if login:
+        tmp = bottle.BaseResponse()
+        tmp.set_cookie('account', 'foo', secret=wsgi_app.PASSPHRASE)
+        environ['HTTP_COOKIE'] = tmp.headerlist[-1][1].split(';')[0]
+    for key, val in (headers or {}).items():
+        environ['HTTP_' + key.upper().replace('-', '_')] = val
+    res = []
+    body = app(environ, lambda status, headers, exc_info=None:
+               res.append((status, dict(headers))))
+    try:
+        body = b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return res[0][0], res[0][1], body
+
+
+class SeriesTest(unittest.TestCase):
+    """
+    Test the /api/series route.
+    """
+
+    def setUp(self):
+        # a sample every minute over two days.
+        self.end = time.mktime(END.timetuple())
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        db_wrap.insert_many([(END - datetime.timedelta(minutes=i),
+                              {'temperature': float(i < 1440),
+                               'humidity': 50.0})
+                             for i in range(2 * 1440)])
+        db_wrap.close()
+        self.cache = data_proc.QueryCache()
+        self.cut = wsgi_app.MainApp('temp.db', 86400, '5Min', 'foo', 'bar',
+                                    aggregate='avg', cache=self.cache).app
+
+    def tearDown(self):
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_series_for_failure(self):
+        """
+        Test for failure.
+        """
+        for query in ('start=nan', 'end=inf', 'start=foo'):
+            status, _, body = call(self.cut, '/api/series', query)
+            self.assertTrue(status.startswith('400'), query)
+            self.assertIn('error', json.loads(body))
+        status, _, _ = call(self.cut, '/api/series', login=False)
+        self.assertTrue(status.startswith('401'))
+        for query in ('points=0', 'points=-5', 'method=foo'):
+            status, _, _ = call(self.cut, '/api/series', query)
+            self.assertTrue(status.startswith('400'), query)
+
+    def test_series_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        window = f'start={self.end - 86400}&end={self.end}'
+        _, _, body = call(self.cut, '/api/series', window)
+        res = json.loads(body)
+        self.assertEqual(res['end'], self.end)
+        self.assertEqual(sorted(res['metrics']),
+                         ['humidity', 'tau', 'temperature'])
+        self.assertEqual(set(res['metrics']['temperature']['series'][0]
+                             ['v']), {1.0})
+
+        # same length, one day earlier - not the cached window.
+        sensor = data_proc.SensorData('testus', 'temp.db', '5Min')
+        self.cache.get_data(sensor, self.end - 86400, self.end, 'avg')
+        sensor.close()
+        query = f'start={self.end - 2 * 86400}&end={self.end - 86400}'
+        _, _, body = call(self.cut, '/api/series', query)
+        tmp = json.loads(body)['metrics']['temperature']
+        self.assertEqual(set(tmp['series'][0]['v']), {0.0})
+        self.assertEqual(tmp['start'], self.end - 2 * 86400)
+
+        # metric filter, point budget & method.
+        _, _, body = call(self.cut, '/api/series',
+                          window + '&metric=humidity&points=10')
+        res = json.loads(body)['metrics']
+        self.assertEqual(list(res), ['humidity'])
+        self.assertLessEqual(len(res['humidity']['series'][0]['v']), 10)
+        _, _, body = call(self.cut, '/api/series', window + '&metric=foo')
+        self.assertEqual(json.loads(body)['metrics'], {})
+        wsgi_app.MAX_POINTS = 20
+        try:
+            _, _, body = call(self.cut, '/api/series',
+                              window + '&points=1000&method=minmax')
+        finally:
+            wsgi_app.MAX_POINTS = 10000
+        for item in json.loads(body)['metrics'].values():
+            self.assertLessEqual(len(item['series'][0]['v']), 20)
+
+
+class StatsTest(unittest.TestCase):
+    """
+    Test the /api/stats route.
+    """
+
+    def setUp(self):
+        self.end = time.mktime(END.timetuple())
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        db_wrap.insert_many([(END - datetime.timedelta(minutes=i),
+                              {'temperature': float(i % 100)})
+                             for i in range(1000)])
+        db_wrap.close()
+        self.cut = wsgi_app.MainApp('temp.db', 86400, '5Min', 'foo',
+                                    'bar').app
+
+    def tearDown(self):
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_stats_for_failure(self):
+        """
+        Test for failure.
+        """
+        status, _, _ = call(self.cut, '/api/stats/testus', login=False)
+        self.assertTrue(status.startswith('401'))
+        for query in ('start=foo', 'end=nan', 'start=-inf',
+                      'percentiles=50,foo', 'percentiles=-1',
+                      'percentiles=101'):
+            status, _, body = call(self.cut, '/api/stats/testus', query)
+            self.assertTrue(status.startswith('400'), query)
+            self.assertIn('error', json.loads(body))
+        status, _, body = call(self.cut, '/api/stats/foo')
+        self.assertTrue(status.startswith('404'))
+        self.assertIn('foo', json.loads(body)['error'])
+
+    def test_stats_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        query = f'start={self.end - 86400}&end={self.end}&percentiles=0,50,' \
+                f'99.5,100'
+        status, _, body = call(self.cut, '/api/stats/testus', query)
+        self.assertTrue(status.startswith('200'))
+        res = json.loads(body)
+        self.assertEqual((res['start'], res['end']),
+                         (self.end - 86400, self.end))
+        res = res['stats']['temperature']
+        self.assertEqual(res['count'], 1000)
+        self.assertEqual((res['min'], res['max']), (0.0, 99.0))
+        self.assertEqual(list(res['percentiles']), ['0', '50', '99.5', '100'])
+        self.assertEqual(res['percentiles']['0'], 0.0)
+        self.assertAlmostEqual(res['percentiles']['50'], 49.5, delta=1)
+        self.assertEqual(res['percentiles']['100'], 99.0)
+
+        # no percentiles unless asked for.
+        _, _, body = call(self.cut, '/api/stats/testus')
+        self.assertNotIn('percentiles',
+                         json.loads(body)['stats']['temperature'])
+
+
+class NotModifiedTest(unittest.TestCase):
+    """
+    Test the ETag & Last-Modified handling.
+    """
+
+    def setUp(self):
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        db_wrap.insert_many([(END - datetime.timedelta(minutes=i),
+                              {'temperature': float(i)})
+                             for i in range(100)])
+        db_wrap.close()
+        self.cut = wsgi_app.MainApp('temp.db', 86400, '5Min', 'foo',
+                                    'bar').app
+        self.query = f'end={time.mktime(END.timetuple())}'
+
+    def tearDown(self):
+        os.remove('temp.db')
+        storage.REGISTRY.close()
+
+    def test_not_modified_for_success(self):
+        """
+        Test for success.
+        """
+        status, headers, _ = call(self.cut, '/api/series', self.query)
+        self.assertTrue(status.startswith('200'))
+        self.assertEqual(headers['Cache-Control'], 'private, no-cache')
+        self.assertIn('Last-Modified', headers)
+        status, _, body = call(self.cut, '/api/series', self.query,
+                               {'If-None-Match': headers['Etag']})
+        self.assertTrue(status.startswith('304'))
+        self.assertEqual(body, b'')
+
+        # the gzip tagged ETag of the compress middleware.
+        app = compress.CompressMiddleware(self.cut, min_size=0)
+        gzip = {'Accept-Encoding': 'gzip'}
+        _, headers, _ = call(app, '/api/series', self.query, gzip)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertTrue(headers['Etag'].endswith('-gzip"'))
+        status, _, _ = call(app, '/api/series', self.query,
+                            dict(gzip, **{'If-None-Match': headers['Etag']}))
+        self.assertTrue(status.startswith('304'))
+
+    def test_not_modified_for_failure(self):
+        """
+        Test for failure.
+        """
+        _, headers, _ = call(self.cut, '/api/series', self.query)
+        for check in ('"foo"', headers['Etag'][:-1] + '-gzip"'):
+            status, _, _ = call(self.cut, '/api/series', self.query,
+                                {'If-None-Match': check})
+            self.assertTrue(status.startswith('200'), check)
+        # other query - other tag.
+        _, tmp, _ = call(self.cut, '/api/series', self.query + '&points=5')
+        self.assertNotEqual(tmp['Etag'], headers['Etag'])
+        # If-None-Match wins over If-Modified-Since.
+        status, _, _ = call(self.cut, '/api/series', self.query,
+                            {'If-None-Match': '"foo"',
+                             'If-Modified-Since': headers['Last-Modified']})
+        self.assertTrue(status.startswith('200'))
+
+    def test_not_modified_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        _, headers, _ = call(self.cut, '/api/series', self.query)
+        since = headers['Last-Modified']
+        status, _, _ = call(self.cut, '/api/series', self.query,
+                            {'If-Modified-Since': since})
+        self.assertTrue(status.startswith('304'))
+        earlier = email.utils.formatdate(
+            email.utils.parsedate_to_datetime(since).timestamp() - 60,
+            usegmt=True)
+        status, _, _ = call(self.cut, '/api/series', self.query,
+                            {'If-Modified-Since': earlier})
+        self.assertTrue(status.startswith('200'))
+
+        # a new sample changes tag & date.
+        db_wrap = sense.DbWrapper('testus', 'temp.db')
+        db_wrap.insert(END + datetime.timedelta(minutes=1),
+                       {'temperature': 1.0})
+        db_wrap.close()
+        status, tmp, _ = call(self.cut, '/api/series', self.query,
+                              {'If-None-Match': headers['Etag']})
+        self.assertTrue(status.startswith('200'))
+        self.assertNotEqual(tmp['Etag'], headers['Etag'])
+        self.assertNotEqual(tmp['Last-Modified'], since)
+        status, _, _ = call(self.cut, '/api/series', self.query,
+                            {'If-Modified-Since': since})
+        self.assertTrue(status.startswith('200'))
+
+
+class MetricsTest(unittest.TestCase):
+    """
+    Test the /metrics route.
+    """
+
+    def setUp(self):
+        self.cut = wsgi_app.MainApp('temp.db', 86400, '5Min', 'foo',
+                                    'bar').app
+
+    def tearDown(self):
+        instrument.enable(False)
+        storage.REGISTRY.close()
+        if os.path.exists('temp.db'):
+            os.remove('temp.db')
+
+    def test_metrics_for_failure(self):
+        """
+        Test for failure.
+        """
+        status, _, _ = call(self.cut, '/metrics', login=False)
+        self.assertTrue(status.startswith('404'))
+
+    def test_metrics_for_sanity(self):
+        """
+        Test for sanity.
+        """
+        instrument.enable()
+        before = sum(wsgi_app.SERIES_TIME.counts)
+        call(self.cut, '/api/series')
+        self.assertEqual(sum(wsgi_app.SERIES_TIME.counts), before + 1)
+
+        # no login needed for scrapers.
+        status, headers, body = call(self.cut, '/metrics', login=False)
+        self.assertTrue(status.startswith('200'))
+        self.assertEqual(headers['Content-Type'],
+                         'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('# TYPE web_series_seconds histogram',
+                      body.decode())
+        self.assertIn(f'web_series_seconds_count {before + 1}',
+                      body.decode())
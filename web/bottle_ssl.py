@@ -2,11 +2,62 @@
 Enable SSL transport security for bottle.
 """
 
+from concurrent import futures
 from wsgiref import simple_server
 
+import functools
+import logging
 import ssl
+import threading
+import time
 import bottle
 
+# default number of connections served concurrently.
+POOL_SIZE = 16
+# forward secrecy & AEAD only (TLS 1.2 - the TLS 1.3 suites are fixed).
+CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20:!aNULL:!MD5:!DSS'
+
+
+class HandshakeStats:
+    """
+    Count & time the TLS handshakes - full and resumed ones.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.full = 0
+        self.resumed = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, duration, resumed=False, failed=False):
+        """
+        Record one handshake (duration in seconds).
+        """
+        with self.lock:
+            if failed:
+                self.failed += 1
+            elif resumed:
+                self.resumed += 1
+            else:
+                self.full += 1
+            self.total_time += duration
+            self.max_time = max(self.max_time, duration)
+
+    def stats(self):
+        """
+        Return a dict with the counters & handshake times (in ms).
+        """
+        with self.lock:
+            count = self.full + self.resumed + self.failed
+            avg = self.total_time / count if count else 0.0
+            return {'full': self.full,
+                    'resumed': self.resumed,
+                    'failed': self.failed,
+                    'avg_time': avg * 1000,
+                    'max_time': self.max_time * 1000}
+
 
 class FixedHandler(simple_server.WSGIRequestHandler):
     """
@@ -19,33 +70,200 @@ class FixedHandler(simple_server.WSGIRequestHandler):
         """
         return self.client_address[0]
 
+    def setup(self):
+        super().setup()
+        if isinstance(self.request, ssl.SSLSocket):
+            self.handshake()
+
+    def handshake(self):
+        """
+        Do the TLS handshake - timed if the server keeps HandshakeStats.
+        """
+        handshakes = getattr(self.server, 'handshakes', None)
+        begin = time.perf_counter()
+        try:
+            self.request.do_handshake()
+        except OSError:
+            if handshakes is not None:
+                handshakes.add(time.perf_counter() - begin, failed=True)
+            raise
+        duration = time.perf_counter() - begin
+        resumed = self.request.session_reused
+        if handshakes is not None:
+            handshakes.add(duration, resumed)
+        logging.debug('TLS handshake with %s took %.1fms (%s, resumed: %s).',
+                      self.client_address[0], duration * 1000,
+                      self.request.version(), resumed)
+
+
+class KeepAliveServerHandler(simple_server.ServerHandler):
+    """
+    HTTP/1.1 response handler - keeps the connection open if the response
+    length is known.
+    """
+
+    http_version = '1.1'
+
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        handler = self.request_handler
+        # without a length the end of the body is marked by closing.
+        if 'Content-Length' not in self.headers and \
+                not self.status.startswith(('204', '304')):
+            handler.close_connection = True
+        if handler.close_connection:
+            self.headers['Connection'] = 'close'
+
+
+class KeepAliveHandler(FixedHandler):
+    """
+    Handler serving several requests per (TLS) connection - idle connections
+    are closed after timeout seconds.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    timeout = 15
+    # headers & body are separate writes - do not wait for the ACK.
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        """
+        Read & answer one request.
+        """
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except OSError:
+            self.close_connection = True
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        # the app might not have read the whole body.
+        if self.headers.get('Content-Length', '0') != '0' or \
+                'Transfer-Encoding' in self.headers:
+            self.close_connection = True
+
+        handler = KeepAliveServerHandler(self.rfile, self.wfile,
+                                         self.get_stderr(),
+                                         self.get_environ(),
+                                         multithread=True)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+
+class ThreadPoolWSGIServer(simple_server.WSGIServer):
+    """
+    WSGI server handing each connection to a bounded pool of threads.
+
+    If all threads are busy no further connections are accepted - they wait
+    in the listen backlog.
+    """
+
+    request_queue_size = 64
+
+    def __init__(self, server_address, handler_cls, pool_size=POOL_SIZE,
+                 bind_and_activate=True):
+        super().__init__(server_address, handler_cls, bind_and_activate)
+        self.pool = futures.ThreadPoolExecutor(max_workers=pool_size,
+                                               thread_name_prefix='http')
+        self.slots = threading.Semaphore(pool_size)
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        self.pool.submit(self.process_request_thread, request,
+                         client_address)
+
+    def process_request_thread(self, request, client_address):
+        """
+        Serve one connection in a worker thread.
+        """
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
 
 class SecureServerAdapter(bottle.ServerAdapter):
     """
     Wraps SSL around the socket connection.
+
+    Connections are served by a pool of pool_size threads (option) with
+    HTTP/1.1 keep-alive. All connections share one SSL context so sessions
+    can be resumed (session cache & tickets, unless the session_tickets
+    option is False); ciphers and alpn protocols are options as well.
     """
     def __init__(self, key_file, cert_file,
                  host='0.0.0.0', port=443, **options):
         super().__init__(host, port, **options)
         self.key = key_file
         self.cert = cert_file
+        self.srv = None
+        self.context = None
+        self.handshakes = HandshakeStats()
+
+    def get_context(self):
+        """
+        Return the SSL context shared by all connections.
+        """
+        if self.context is not None:
+            return self.context
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.cert, self.key)
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+        context.set_ciphers(self.options.get('ciphers', CIPHERS))
+        if not self.options.get('session_tickets', True):
+            # TLS 1.3 resumes through tickets only.
+            context.options |= ssl.OP_NO_TICKET
+            context.num_tickets = 0
+        alpn = self.options.get('alpn', ('http/1.1',))
+        if alpn:
+            context.set_alpn_protocols(list(alpn))
+        self.context = context
+        return context
 
     def run(self, handler):
         """
         Run the WSGI server.
         """
-        handler_cls = self.options.get('handler_class', FixedHandler)
-        server_cls = self.options.get('server_class', simple_server.WSGIServer)
+        handler_cls = self.options.get('handler_class', KeepAliveHandler)
+        server_cls = self.options.get('server_class')
+        if server_cls is None:
+            server_cls = functools.partial(
+                ThreadPoolWSGIServer,
+                pool_size=self.options.get('pool_size', POOL_SIZE))
 
         srv = simple_server.make_server(self.host,
                                         self.port,
                                         handler,
                                         server_cls,
                                         handler_cls)
-        srv.socket = ssl.wrap_socket(srv.socket,
-                                     keyfile=self.key,
-                                     certfile=self.cert,
-                                     server_side=True)
+        # handshakes happen in the handler - not in the accept loop.
+        srv.socket = self.get_context().wrap_socket(
+            srv.socket, server_side=True, do_handshake_on_connect=False)
+        srv.handshakes = self.handshakes
+        self.srv = srv
         srv.serve_forever()
 
 
@@ -0,0 +1,191 @@
+"""
+WSGI middleware compressing responses (brotli if available, else gzip).
+"""
+
+import logging
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+TYPES = ('text/', 'application/json', 'application/javascript',
+         'image/svg+xml')
+# compressing would hold back the events.
+EXCLUDED = ('text/event-stream',)
+
+
+def _accepted(environ):
+    """
+    Return the preferred encoding the client accepts - None if none.
+    """
+    tmp = environ.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = {}
+    for item in tmp.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for item in ENCODINGS:
+        if accepted.get(item, accepted.get('*', 0.0)) > 0:
+            return item
+    return None
+
+
+def _tag(etag, encoding):
+    """
+    Give the compressed representation its own entity tag.
+    """
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return f'{etag}-{encoding}'
+
+
+class _Compressor:
+    """
+    Incremental gzip or brotli compressor.
+    """
+
+    def __init__(self, encoding, level):
+        if encoding == 'br':
+            self.obj = brotli.Compressor(quality=min(level, 11))
+            self.compress = self.obj.process
+            self.finish = self.obj.finish
+        else:
+            # wbits 31: zlib with gzip header & trailer.
+            self.obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self.compress = self.obj.compress
+            self.finish = self.obj.flush
+
+
+class CompressMiddleware:
+    """
+    Compress text & JSON responses for clients accepting it.
+
+    Responses with a known length (at least min_size bytes) are compressed
+    as a whole and keep a (new) Content-Length; streamed responses are
+    compressed chunk by chunk. The entity tag of compressed responses gets
+    the encoding as suffix - it is removed again from If-None-Match before
+    the app sees it.
+    """
+
+    def __init__(self, app, level=6, min_size=512):
+        self.app = app
+        self.level = level
+        self.min_size = min_size
+        self.lock = threading.Lock()
+
+        # stats.
+        self.responses = 0
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def stats(self):
+        """
+        Return a dict with the response counts and byte savings.
+        """
+        with self.lock:
+            saved = self.bytes_in - self.bytes_out
+            ratio = self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+            return {'responses': self.responses,
+                    'compressed': self.compressed,
+                    'bytes_in': self.bytes_in,
+                    'bytes_out': self.bytes_out,
+                    'saved': saved,
+                    'ratio': ratio}
+
+    def _count(self, size_in, size_out):
+        with self.lock:
+            self.compressed += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            self.responses += 1
+        encoding = _accepted(environ)
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        check = environ.get('HTTP_IF_NONE_MATCH', '')
+        tagged = f'-{encoding}' in check
+        if tagged:
+            environ['HTTP_IF_NONE_MATCH'] = \
+                check.replace(f'-{encoding}"', '"').replace(
+                    f'-{encoding}', '')
+
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None  # write() is not supported.
+
+        res = self.app(environ, capture)
+        status, headers, exc_info = captured
+        names = {key.lower(): val for key, val in headers}
+        length = names.get('content-length')
+        if not status.startswith('200') or 'content-encoding' in names or \
+                not names.get('content-type', '').startswith(TYPES) or \
+                names.get('content-type', '').startswith(EXCLUDED) or \
+                environ.get('REQUEST_METHOD') == 'HEAD' or \
+                (length is not None and int(length) < self.min_size):
+            if status.startswith('304') and tagged:
+                headers = [(key, _tag(val, encoding))
+                           if key.lower() == 'etag' else (key, val)
+                           for key, val in headers]
+            start_response(status, headers, exc_info)
+            return res
+
+        headers = [(key, _tag(val, encoding) if key.lower() == 'etag'
+                    else val) for key, val in headers
+                   if key.lower() != 'content-length']
+        headers.append(('Content-Encoding', encoding))
+        if 'vary' in names:
+            headers = [(key, f'{val}, Accept-Encoding')
+                       if key.lower() == 'vary' else (key, val)
+                       for key, val in headers]
+        else:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        compressor = _Compressor(encoding, self.level)
+        if length is not None:
+            try:
+                body = b''.join(res)
+            finally:
+                if hasattr(res, 'close'):
+                    res.close()
+            tmp = compressor.compress(body) + compressor.finish()
+            self._count(len(body), len(tmp))
+            logging.debug('Compressed %d to %d bytes (%s).', len(body),
+                          len(tmp), encoding)
+            headers.append(('Content-Length', str(len(tmp))))
+            start_response(status, headers, exc_info)
+            return [tmp]
+
+        start_response(status, headers, exc_info)
+        return self._stream(res, compressor)
+
+    def _stream(self, res, compressor):
+        size_in = size_out = 0
+        try:
+            for chunk in res:
+                size_in += len(chunk)
+                tmp = compressor.compress(chunk)
+                if tmp:
+                    size_out += len(tmp)
+                    yield tmp
+            tmp = compressor.finish()
+            size_out += len(tmp)
+            yield tmp
+        finally:
+            if hasattr(res, 'close'):
+                res.close()
+            self._count(size_in, size_out)
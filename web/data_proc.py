@@ -2,110 +2,659 @@
 Module taking care of the data processing.
 """
 
+import collections
+import functools
 import logging
-import sqlite3
+import threading
+import time
 
+from concurrent import futures
+
+import numpy as np
 import pandas as pd
 
+from iot import instrument
+from iot import storage
+
+# per bucket aggregates which can be computed by SQLite.
+AGGREGATES = ('avg', 'min', 'max', 'first', 'last')
+
+GET_DATA_TIME = instrument.histogram(
+    'data_get_data_seconds', 'Time to read (and resample) a sensor window.')
+RESAMPLE_TIME = instrument.histogram(
+    'data_resample_seconds', 'Time to resample the raw rows in pandas.')
+TAU_TIME = instrument.histogram(
+    'data_calc_tau_seconds', 'Time to compute the dew point columns.')
+
 
 class SensorFactory:
     """
     Factory for loading SensorData objects.
     """
 
-    def __init__(self, database, resample):
+    def __init__(self, database, resample, profile=None):
         self.database = database
         self.resample = resample
+        self.profile = profile
 
-    def get_sensors(self):
+    def get_sensor_names(self):
+        """
+        Return the names of all sensors - from the registry's cache.
+        """
+        with storage.REGISTRY.connection(self.database, self.profile) as conn:
+            sensor_names = list(storage.REGISTRY.schema(
+                conn, self.database).tables)
+        logging.debug('Found following sensor information: %r',
+                      sensor_names)
+        return sensor_names
+
+    def get_sensors(self, conn=None):
         """
         Return a list of objects that can be used to retrieve data per sensor.
+
+        All of them read through conn if given (e.g. one borrowed from
+        storage.REGISTRY); otherwise each opens its own - close them when
+        done.
         """
         res = {}
-        conn = sqlite3.connect(self.database)
-        tmp = conn.execute('SELECT name from sqlite_master WHERE type="table"')
-        sensor_names = tmp.fetchall()
-        logging.debug('Found following sensor information: %s',
-                      repr(sensor_names))
-        conn.close()
-
-        for item in sensor_names:
-            name = item[0]
-            res[name] = SensorData(name, self.database, resample=self.resample)
+        for name in self.get_sensor_names():
+            res[name] = SensorData(name, self.database,
+                                   resample=self.resample,
+                                   profile=self.profile, conn=conn)
         return res
 
 
 class SensorData:
     """
-    Wrapper for easy access to sensor data.
+    Wrapper for easy access to sensor data - reads through conn if given,
+    otherwise through a connection of its own (released by close).
     """
 
-    def __init__(self, table_name, database, resample):
+    def __init__(self, table_name, database, resample, profile=None,
+                 conn=None):
         self.name = table_name
-        self.conn = sqlite3.connect(database)
+        self.database = database
+        self._owns_conn = conn is None
+        self.conn = conn if conn is not None else \
+            storage.connect(database, profile)
         self.resample = resample
+        self.version = None
+
+    def close(self):
+        """
+        Close the connection - unless it was passed in.
+        """
+        if self._owns_conn:
+            self.conn.close()
+
+    def schema(self):
+        """
+        Return the (cached) layout of the database - see storage.Registry.
+        """
+        return storage.REGISTRY.schema(self.conn, self.database)
+
+    def latest(self):
+        """
+        Return the (raw) timestamp of the newest sample - None if empty.
+        """
+        tmp = self.conn.execute(f'SELECT MAX(timestamp) FROM {self.name}')
+        return tmp.fetchone()[0]
 
-    def get_data(self, start, end, resample=True, round_digits=2):
+    @instrument.timed(GET_DATA_TIME)
+    def get_data(self, start, end, resample=True, round_digits=2,
+                 aggregate=None):
         """
         Retrieve data over a time window bound by start and end.
+
+        If an aggregate (see AGGREGATES) is given the resampling is done by
+        SQLite - using the rollup tables where possible - and only one row
+        per non-empty bucket is returned.
         """
-        # the column names
-        tmp = f'pragma table_info({self.name})'
-        res = self.conn.execute(tmp)
-        columns = []
-        for item in res.fetchall()[1:]:
-            columns.append(item[1])  # name of the column
+        # the schema version defines the unit of the timestamps.
+        self.version, columns = self.schema().table_info(self.name)
+        scale = storage.TS_SCALE[self.version]
+
+        if resample and aggregate is not None:
+            return self._get_buckets(int(start), int(end), scale, columns,
+                                     aggregate, round_digits)
 
         # the values
+        dataframe = self._read(int(start) * scale, int(end) * scale, scale)
+        if resample:
+            with RESAMPLE_TIME.time():
+                dataframe = dataframe.resample(self.resample).bfill()
+        dataframe = dataframe.round(round_digits)
+        return dataframe
+
+    def get_tail(self, dataframe, latest, end, round_digits=2):
+        """
+        Extend a frame previously returned by get_data (resampled, without
+        aggregate) with the samples newer than latest - the raw timestamp of
+        the newest sample it was computed from.
+
+        Only the new rows are read & resampled.
+        """
+        self.version, _ = self.schema().table_info(self.name)
+        scale = storage.TS_SCALE[self.version]
+        tail = self._read(latest, int(end) * scale, scale)
+        if tail.empty:
+            return dataframe
+        with RESAMPLE_TIME.time():
+            tail = tail.resample(self.resample).bfill().round(round_digits)
+        if dataframe.empty:
+            return tail
+
+        # the last bucket already holds its first sample; empty buckets in
+        # between take the first new sample (as bfill would).
+        width = pd.to_timedelta(self.resample)
+        last = dataframe.index[-1]
+        tail = tail[tail.index > last]
+        if tail.empty:
+            return dataframe
+        tail = tail.reindex(pd.date_range(last + width, tail.index[-1],
+                                          freq=width),
+                            method='bfill')
+        return pd.concat((dataframe, tail))
+
+    def _read(self, low, high, scale):
+        """
+        Read the raw rows with low < timestamp <= high (in table units).
+        """
         tmp = f'SELECT * FROM {self.name} WHERE ' \
-              f'timestamp > {int(start)} AND timestamp <= {int(end)}'
+              f'timestamp > {low} AND timestamp <= {high}'
         dataframe = pd.read_sql_query(tmp, self.conn, index_col='timestamp')
         dataframe.index = pd.to_datetime(dataframe.index.values.astype(float),
-                                         unit='s',
+                                         unit='s' if scale == 1 else 'ms',
                                          utc=True)
         dataframe.sort_index(inplace=True)
-        if resample:
-            dataframe = dataframe.resample(self.resample).bfill()
-        dataframe = dataframe.round(round_digits)
         return dataframe
 
+    def _get_buckets(self, start, end, scale, columns, aggregate,
+                     round_digits):
+        """
+        Let SQLite group the rows into buckets of the resample width.
 
-def _calc_tau(row):
-    if 'humidity' in row.keys() and 'temperature' in row.keys():
-        hum = row['humidity']
-        temp = row['temperature']
-        return (hum / 100) ** (1 / 8.02) * (109.8 + temp) - 109.8
-    else:
-        return -1.0
+        avg, min & max only cover numeric columns; first and last return the
+        values of the first/last row in each bucket. For the part of the
+        window whose samples were pruned (see iot.retention) the buckets of
+        the coarser rollup kept instead are returned.
+        """
+        if aggregate not in AGGREGATES:
+            raise AttributeError(f'aggregate should be one of {AGGREGATES}.')
+        width = pd.to_timedelta(self.resample).total_seconds()
+        if width * scale < 1:
+            raise AttributeError('resample should be at least the timestamp '
+                                 'resolution.')
 
+        numeric = storage.rollup_columns(columns)
+        rollup = self._pick_rollup(width)
+        if aggregate in ('avg', 'min', 'max') or \
+                (aggregate == 'last' and len(numeric) == len(columns)):
+            pruned = self._pruned(start, scale, rollup or 0)
+            if pruned is not None:
+                coarse, boundary = pruned
+                step = int(width) if width % coarse == 0 else coarse
+                high = end if boundary is None else min(boundary, end)
+                tmp = f'SELECT (bucket / {step}) * {step} AS bucket, ' \
+                      f'count, last_ts{self._fields(numeric)} FROM ' \
+                      f'{storage.rollup_name(self.name, coarse)} ' \
+                      f'WHERE bucket >= {(start // coarse) * coarse} ' \
+                      f'AND bucket < {high}'
+                old = self._to_frame(
+                    self._fetch_rollup(tmp, numeric, aggregate), numeric, 1,
+                    round_digits)
+                if boundary is None or boundary > end:
+                    return old
+                # the raw rows start at the boundary.
+                tmp = self._query_buckets(boundary - 1, end, scale, columns,
+                                          numeric, width, rollup, aggregate,
+                                          round_digits)
+                return pd.concat((old, tmp))
+        return self._query_buckets(start, end, scale, columns, numeric,
+                                   width, rollup, aggregate, round_digits)
 
-def get_data(database, start, end, sample_rate):
+    def _query_buckets(self, start, end, scale, columns, numeric, width,
+                       rollup, aggregate, round_digits):
+        """
+        Buckets from the rollup table of the given width (if any) and the
+        raw rows.
+        """
+        if rollup is not None and start // rollup + 1 < end // rollup and \
+                (aggregate in ('avg', 'min', 'max') or
+                 (aggregate == 'last' and len(numeric) == len(columns))):
+            tmp = self.rollup_pieces(start, end, scale, int(width), rollup,
+                                     numeric)
+            return self._to_frame(
+                self._fetch_rollup(tmp, numeric, aggregate), numeric, 1,
+                round_digits)
+
+        width = int(width * scale)
+        if aggregate in ('first', 'last'):
+            # SQLite returns bare columns from the row matching min()/max().
+            func = 'MIN' if aggregate == 'first' else 'MAX'
+            names = [item[0] for item in columns]
+            select = [f'{func}(timestamp)'] + names
+        else:
+            names = numeric
+            select = [f'{aggregate.upper()}({item})' for item in names]
+
+        tmp = f'SELECT (timestamp / {width}) * {width} AS bucket, ' \
+              f'{", ".join(select)} FROM {self.name} WHERE ' \
+              f'timestamp > {start * scale} AND timestamp <= {end * scale} ' \
+              f'GROUP BY bucket ORDER BY bucket'
+        res = self.conn.execute(tmp).fetchall()
+        if aggregate in ('first', 'last'):
+            res = [item[:1] + item[2:] for item in res]
+        return self._to_frame(res, names, scale, round_digits)
+
+    def _pick_rollup(self, width):
+        """
+        Return the coarsest rollup width the requested width is a multiple
+        of - None if there is none.
+        """
+        res = None
+        for item in self.schema().rollup_widths(self.name):
+            if item <= width and width % item == 0:
+                res = item
+        return res
+
+    def _pruned(self, start, scale, rollup):
+        """
+        Return (width, boundary) if the window starts before the raw rows
+        and only a rollup coarser than the given one reaches back further -
+        i.e. the older samples were pruned. boundary (epoch seconds, on a
+        bucket of that width) is where the raw rows begin; None if all are
+        gone. Returns None otherwise.
+        """
+        tmp = self.conn.execute(f'SELECT MIN(timestamp) FROM {self.name}')
+        first = tmp.fetchone()[0]
+        if first is not None and first // scale <= start:
+            return None
+        for item in self.schema().rollup_widths(self.name):
+            if item <= rollup:
+                continue
+            tmp = self.conn.execute(f'SELECT MIN(bucket) FROM '
+                                    f'{storage.rollup_name(self.name, item)}')
+            low = tmp.fetchone()[0]
+            boundary = None if first is None else \
+                (first // scale // item) * item
+            if low is not None and (boundary is None or
+                                    low < boundary and
+                                    (start // item) * item < boundary):
+                return item, boundary
+        return None
+
+    @staticmethod
+    def _fields(names):
+        return ''.join(f', {item}_count, {item}_sum, {item}_m2, '
+                       f'{item}_min, {item}_max, {item}_last'
+                       for item in names)
+
+    def rollup_pieces(self, start, end, scale, width, rollup, names):
+        """
+        Build a query combining the full rollup buckets with the raw rows at
+        the head and tail of the window not covered by a full bucket.
+
+        Each row has bucket (grouped into buckets of width seconds), count,
+        last_ts and count, sum, m2, min, max & last per column in names.
+        """
+        low = (start // rollup + 1) * rollup
+        high = (end // rollup) * rollup
+        raw = ''.join(f', {item} IS NOT NULL, {item}, {item} * 0.0, '
+                      f'{item}, {item}, {item}' for item in names)
+        return \
+            f'SELECT (bucket / {width}) * {width} AS bucket, count, ' \
+            f'last_ts{self._fields(names)} FROM ' \
+            f'{storage.rollup_name(self.name, rollup)} ' \
+            f'WHERE bucket >= {low} AND bucket < {high} ' \
+            f'UNION ALL ' \
+            f'SELECT (timestamp / {width * scale}) * {width}, 1, ' \
+            f'timestamp{raw} FROM {self.name} WHERE ' \
+            f'(timestamp > {start * scale} AND timestamp < {low * scale}) ' \
+            f'OR (timestamp >= {high * scale} AND timestamp <= {end * scale})'
+
+    def _fetch_rollup(self, pieces, names, aggregate):
+        """
+        Aggregate rows shaped like the rollup pieces per bucket - returns
+        (bucket, values...) rows.
+        """
+        if aggregate == 'avg':
+            # TOTAL is a float (and 0.0 for no values - / 0 is NULL).
+            select = [f'TOTAL({item}_sum) / SUM({item}_count)'
+                      for item in names]
+        elif aggregate == 'last':
+            # bare columns come from the row with the max(last_ts).
+            select = ['MAX(last_ts)'] + [f'{item}_last' for item in names]
+        else:
+            select = [f'{aggregate.upper()}({item}_{aggregate})'
+                      for item in names]
+        res = self.conn.execute(f'SELECT bucket, {", ".join(select)} FROM '
+                                f'({pieces}) GROUP BY bucket '
+                                f'ORDER BY bucket').fetchall()
+        if aggregate == 'last':
+            res = [item[:1] + item[2:] for item in res]
+        return res
+
+    @staticmethod
+    def _to_frame(res, names, scale, round_digits):
+        """
+        Turn (bucket, values...) rows into a time indexed DataFrame.
+        """
+        dataframe = pd.DataFrame.from_records(res,
+                                              columns=['timestamp'] + names,
+                                              index='timestamp')
+        dataframe.index = pd.to_datetime(dataframe.index.values.astype(float),
+                                         unit='s' if scale == 1 else 'ms',
+                                         utc=True)
+        return dataframe.round(round_digits)
+
+
+_Entry = collections.namedtuple('_Entry',
+                                ['frame', 'latest', 'created', 'end'])
+
+
+class QueryCache:
     """
-    Retrieve data.
+    LRU cache (with a TTL) for the per sensor results of the dashboard.
+
+    Entries are keyed by sensor, window length, resample & aggregate and are
+    valid as long as no newer sample arrived in the sensor table. If one did
+    the cached frame is refreshed incrementally: only the new samples (or,
+    if SQLite does the bucketing, the buckets from the last cached one
+    onwards) are fetched and the buckets which left the window are dropped.
+    As the window moves the first bucket returned may still include samples
+    from just before the start of the window.
+
+    Only the live window is cached: a window ending before the cached one
+    is read directly, one which moved past it by more than its length
+    replaces the entry.
     """
-    factory = SensorFactory(database, sample_rate)
-    sensors = factory.get_sensors()
 
-    res = {}
+    def __init__(self, maxsize=128, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
 
-    for key, item in sensors.items():
-        tmp = item.get_data(start, end)
-        tmp['tau'] = tmp.apply(lambda row: _calc_tau(row), axis=1)
-        columns = list(sorted(tmp.columns.tolist()))
-        for column in columns:
-            series = tmp[column]
-            if column not in res:
-                res[column] = pd.DataFrame(series.tolist(),
-                                           columns=[key],
-                                           index=series.index)
+        # stats.
+        self.hits = 0
+        self.tails = 0
+        self.misses = 0
+
+    def _key_lock(self, key):
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                old, _ = self._entries.popitem(last=False)
+                self._locks.pop(old, None)
+
+    def clear(self):
+        """
+        Drop all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def get_data(self, sensor, start, end, aggregate=None):
+        """
+        Same as sensor.get_data(start, end, aggregate=aggregate) - but served
+        from memory where possible.
+        """
+        key = (sensor.database, sensor.name, int(end - start),
+               sensor.resample, aggregate)
+        with self._key_lock(key):
+            entry = self._get(key)
+            if entry is not None and end < entry.end:
+                self.misses += 1
+                return sensor.get_data(start, end, aggregate=aggregate)
+            latest = sensor.latest()
+            now = time.monotonic()
+            if entry is None or now - entry.created > self.ttl or \
+                    end - entry.end > end - start:
+                self.misses += 1
+                entry = _Entry(sensor.get_data(start, end,
+                                               aggregate=aggregate),
+                               latest, now, end)
+            elif entry.latest != latest and aggregate is not None and \
+                    len(entry.frame) > 0:
+                # complete buckets do not change - refetch the last one.
+                self.tails += 1
+                last = entry.frame.index[-1]
+                tail = sensor.get_data(last.timestamp() - 1, end,
+                                       aggregate=aggregate)
+                frame = pd.concat((entry.frame[entry.frame.index < last],
+                                   tail[tail.index >= last]))
+                entry = _Entry(frame, latest, entry.created, end)
+            elif entry.latest != latest and entry.latest is not None:
+                self.tails += 1
+                frame = sensor.get_tail(entry.frame, entry.latest, end)
+                entry = _Entry(frame, latest, entry.created, end)
+            elif entry.latest != latest:
+                self.misses += 1
+                entry = _Entry(sensor.get_data(start, end,
+                                               aggregate=aggregate),
+                               latest, now, end)
             else:
-                res[column] = pd.concat((res[column],
-                                         series.rename(key)),
-                                        axis=1,
-                                        join='outer')
+                self.hits += 1
+                entry = entry._replace(end=end)
+
+            # drop buckets which moved out of the window.
+            width = pd.to_timedelta(sensor.resample)
+            cutoff = pd.Timestamp(int(start), unit='s', tz='UTC').floor(width)
+            if len(entry.frame) and entry.frame.index[0] < cutoff:
+                entry = entry._replace(
+                    frame=entry.frame[entry.frame.index >= cutoff])
+            self._put(key, entry)
+        return entry.frame.copy()
+
+
+@instrument.timed(TAU_TIME)
+def _calc_tau(humidity, temperature):
+    """
+    Dew point (in C) - works on whole columns.
+    """
+    return (humidity / 100) ** (1 / 8.02) * (109.8 + temperature) - 109.8
+
+
+def _calc_abs_humidity(humidity, temperature):
+    """
+    Absolute humidity (in g/m3) - works on whole columns.
+    """
+    pressure = 6.112 * np.exp(17.67 * temperature / (temperature + 243.5))
+    return pressure * humidity * 2.1674 / (273.15 + temperature)
+
+
+def _calc_heat_index(humidity, temperature):
+    """
+    Heat index (in C) following the NWS approach - works on whole columns.
+    """
+    temp = temperature * 9 / 5 + 32
+    simple = 0.5 * (temp + 61.0 + (temp - 68.0) * 1.2 + humidity * 0.094)
+    full = -42.379 + 2.04901523 * temp + 10.14333127 * humidity \
+        - 0.22475541 * temp * humidity - 0.00683783 * temp ** 2 \
+        - 0.05481717 * humidity ** 2 + 0.00122874 * temp ** 2 * humidity \
+        + 0.00085282 * temp * humidity ** 2 \
+        - 0.00000199 * temp ** 2 * humidity ** 2
+    res = np.where((simple + temp) / 2 < 80, simple, full)
+    return (res - 32) * 5 / 9
+
+
+# derived metrics: name -> (required columns, function over those columns).
+METRICS = {}
+DEFAULT_METRICS = ('tau',)
+
+
+def register_metric(name, columns, func):
+    """
+    Declare a derived metric - func is called with the required columns as
+    float arrays (in the given order) and needs to return an array.
+    """
+    METRICS[name] = (tuple(columns), func)
+
+
+register_metric('tau', ('humidity', 'temperature'), _calc_tau)
+register_metric('abs_humidity', ('humidity', 'temperature'),
+                _calc_abs_humidity)
+register_metric('heat_index', ('humidity', 'temperature'), _calc_heat_index)
+
+
+def add_metrics(dataframe, metrics=DEFAULT_METRICS):
+    """
+    Add the derived metrics for which the dataframe has all columns.
+    """
+    for name in metrics:
+        columns, func = METRICS[name]
+        if all(item in dataframe for item in columns):
+            dataframe[name] = func(*[dataframe[item].to_numpy(dtype=float)
+                                     for item in columns])
+    return dataframe
+
+
+def get_columns(database, profile=None, metrics=DEFAULT_METRICS):
+    """
+    Return the names of the groups get_data would return (in the same
+    order) - without reading any data.
+    """
+    res = []
+    with storage.REGISTRY.connection(database, profile) as conn:
+        schema = storage.REGISTRY.schema(conn, database)
+    for name in schema.tables:
+        _, columns = schema.table_info(name)
+        names = [item[0] for item in columns]
+        names += [item for item in metrics
+                  if all(col in names for col in METRICS[item][0])]
+        for column in sorted(names):
+            if column not in res:
+                res.append(column)
+    return res
+
+
+def get_latest(database, profile=None):
+    """
+    Return the time (epoch seconds) of the newest sample per sensor - None
+    for sensors without samples.
+    """
+    res = {}
+    with storage.REGISTRY.connection(database, profile) as conn:
+        schema = storage.REGISTRY.schema(conn, database)
+        for name in schema.tables:
+            version, _ = schema.table_info(name)
+            tmp = conn.execute(f'SELECT MAX(timestamp) FROM {name}')
+            tmp = tmp.fetchone()[0]
+            res[name] = tmp / storage.TS_SCALE[version] \
+                if tmp is not None else None
+    return res
+
+
+class ReadPool:
+    """
+    Bounded pool of threads reading sensors concurrently.
+
+    Each worker borrows one read connection from storage.REGISTRY per task
+    - SQLite and most of the pandas work release the GIL, so the reads
+    overlap.
+    """
+
+    def __init__(self, workers=4, profile=None):
+        self.workers = workers
+        self.profile = profile
+        self._executor = futures.ThreadPoolExecutor(
+            workers, thread_name_prefix='read')
+
+    def map(self, func, database, items):
+        """
+        Return [func(conn, item) for item in items] - computed by the
+        workers, each passing its own connection.
+        """
+        def call(item):
+            with storage.REGISTRY.connection(database, self.profile) as conn:
+                return func(conn, item)
+        return list(self._executor.map(call, items))
+
+    def close(self):
+        """
+        Stop the workers.
+        """
+        self._executor.shutdown(wait=True)
+
+
+def _fetch(conn, name, database, start, end, sample_rate, profile,
+           aggregate, metrics, cache):
+    """
+    Read (and resample) one sensor & add the derived metrics.
+    """
+    sensor = SensorData(name, database, sample_rate, profile, conn=conn)
+    if cache is not None:
+        tmp = cache.get_data(sensor, start, end, aggregate=aggregate)
+    else:
+        tmp = sensor.get_data(start, end, aggregate=aggregate)
+    return add_metrics(tmp, metrics)
+
+
+def get_data(database, start, end, sample_rate, profile=None,
+             aggregate=None, metrics=DEFAULT_METRICS, cache=None,
+             pool=None):
+    """
+    Retrieve data - optionally through a QueryCache and with the sensors
+    read concurrently by a ReadPool.
+    """
+    names = SensorFactory(database, sample_rate,
+                          profile).get_sensor_names()
+    fetch = functools.partial(_fetch, database=database, start=start,
+                              end=end, sample_rate=sample_rate,
+                              profile=profile, aggregate=aggregate,
+                              metrics=metrics, cache=cache)
+    if pool is not None and len(names) > 1:
+        tmp = pool.map(fetch, database, names)
+    else:
+        with storage.REGISTRY.connection(database, profile) as conn:
+            tmp = [fetch(conn, name) for name in names]
+
+    # same order as the sensor tables - no matter which read finished first.
+    return combine(collections.OrderedDict(zip(names, tmp)))
 
-    for _, val in res.items():
-        val.fillna(method='ffill', inplace=True)
-        val.dropna(axis=0, inplace=True)
 
+def combine(frames):
+    """
+    Turn a dict of per sensor frames into a dict of per column frames (with
+    one column per sensor) aligned on one shared time index.
+    """
+    if not frames:
+        return {}
+
+    # one outer join over all sensors - columns become (sensor, column).
+    tmp = pd.concat(frames, axis=1, join='outer')
+
+    # positions per column - in order of first appearance, per sensor
+    # sorted by name.
+    groups = collections.OrderedDict()
+    offset = 0
+    for frame in frames.values():
+        for column in sorted(frame.columns.tolist()):
+            groups.setdefault(column, []).append(
+                offset + frame.columns.get_loc(column))
+        offset += len(frame.columns)
+
+    res = {}
+    for column, positions in groups.items():
+        val = tmp.iloc[:, positions]
+        val.columns = val.columns.get_level_values(0)
+        # only the timestamps of the sensors in this group.
+        val = val.dropna(how='all')
+        res[column] = val.ffill().dropna(axis=0)
     return res
@@ -0,0 +1,94 @@
+"""
+Downsampling of time series to a point budget for the charts.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def lttb(x_values, y_values, threshold):
+    """
+    Largest-Triangle-Three-Buckets - returns the indices of the points to
+    keep. First and last point are always kept.
+    """
+    length = len(x_values)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    x_values = np.asarray(x_values, dtype=float)
+    y_values = np.asarray(y_values, dtype=float)
+    edges = np.linspace(1, length - 1, threshold - 1).astype(int)
+
+    res = np.empty(threshold, dtype=int)
+    res[0] = 0
+    res[-1] = length - 1
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket (or the last point).
+        if i < threshold - 3:
+            avg_x = x_values[end:edges[i + 2]].mean()
+            avg_y = y_values[end:edges[i + 2]].mean()
+        else:
+            avg_x = x_values[-1]
+            avg_y = y_values[-1]
+        area = np.abs((x_values[prev] - avg_x) *
+                      (y_values[start:end] - y_values[prev]) -
+                      (x_values[prev] - x_values[start:end]) *
+                      (avg_y - y_values[prev]))
+        prev = start + int(np.argmax(area))
+        res[i + 1] = prev
+    return res
+
+
+def minmax(y_values, threshold):
+    """
+    Keep min & max per bucket (threshold / 2 buckets, e.g. one per pixel) -
+    returns the indices of the points to keep in order.
+    """
+    length = len(y_values)
+    if threshold >= length or threshold < 2:
+        return np.arange(length)
+
+    y_values = np.asarray(y_values, dtype=float)
+    edges = np.linspace(0, length, threshold // 2 + 1).astype(int)
+    res = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if start == end:
+            continue
+        tmp = y_values[start:end]
+        res.extend(sorted({start + int(np.argmin(tmp)),
+                           start + int(np.argmax(tmp))}))
+    return np.array(res, dtype=int)
+
+
+METHODS = {'lttb': lambda x, y, threshold: lttb(x, y, threshold),
+           'minmax': lambda x, y, threshold: minmax(y, threshold)}
+
+
+def to_columns(dataframe, threshold, method='lttb'):
+    """
+    Turn a frame (one column per series) into compact columnar arrays.
+
+    Each series is downsampled on its own; timestamps are returned as
+    offsets (in seconds) to a common start.
+    """
+    if dataframe.empty:
+        return {'start': None, 'series': []}
+    func = METHODS[method]
+    index = dataframe.index
+    if index.tz is None:
+        index = index.tz_localize('UTC')
+    epochs = np.asarray((index - pd.Timestamp(0, tz='UTC')) //
+                        pd.Timedelta(seconds=1))
+    start = int(epochs[0])
+    offsets = epochs - start
+
+    series = []
+    for column in dataframe.columns:
+        values = dataframe[column].to_numpy(dtype=float)
+        idx = func(offsets, values, threshold)
+        series.append({'label': str(column),
+                       't': offsets[idx].tolist(),
+                       'v': values[idx].tolist()})
+    return {'start': start, 'series': series}
@@ -0,0 +1,144 @@
+"""
+Streaming export of raw sensor data - constant memory for any range.
+"""
+
+import csv
+import datetime
+import io
+
+from iot import storage
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    ARROW_TYPES = {'INTEGER': pyarrow.int64(),
+                   'REAL': pyarrow.float64(),
+                   'TEXT': pyarrow.string()}
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('csv', 'parquet') if pyarrow is not None else ('csv',)
+CONTENT_TYPES = {'csv': 'text/csv',
+                 'parquet': 'application/vnd.apache.parquet'}
+
+
+def iter_rows(database, sensor, start=None, end=None, chunk_size=1000,
+              profile=None):
+    """
+    Yield the (column, type) tuples and then lists of up to chunk_size raw
+    rows with start < timestamp <= end (epoch seconds, both optional).
+
+    Timestamps are converted to epoch milliseconds.
+    """
+    conn = storage.connect(database, profile)
+    try:
+        schema = storage.REGISTRY.schema(conn, database)
+        if sensor not in schema.tables:
+            raise KeyError(f'Unknown sensor: {sensor}.')
+        version, columns = schema.table_info(sensor)
+        scale = storage.TS_SCALE[version]
+
+        where = []
+        if start is not None:
+            where.append(f'timestamp > {int(start) * scale}')
+        if end is not None:
+            where.append(f'timestamp <= {int(end) * scale}')
+        where = ' WHERE ' + ' AND '.join(where) if where else ''
+        names = ''.join(f', {item[0]}' for item in columns)
+        cur = conn.execute(f'SELECT timestamp * {1000 // scale}{names} '
+                           f'FROM {sensor}{where} ORDER BY timestamp')
+
+        yield [('timestamp', 'INTEGER')] + columns
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+        cur.close()
+    finally:
+        conn.close()
+
+
+def _iso(value):
+    tmp = datetime.datetime.fromtimestamp(value / 1000.0,
+                                          tz=datetime.timezone.utc)
+    return tmp.isoformat(timespec='milliseconds')
+
+
+def iter_csv(database, sensor, start=None, end=None, chunk_size=1000,
+             profile=None):
+    """
+    Yield the rows as CSV (encoded) - one chunk at a time.
+    """
+    rows = iter_rows(database, sensor, start, end, chunk_size, profile)
+    header = next(rows)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([item[0] for item in header])
+    yield buf.getvalue().encode()
+    for chunk in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows([(_iso(item[0]),) + item[1:] for item in chunk])
+        yield buf.getvalue().encode()
+
+
+class _Sink(io.RawIOBase):
+    """
+    Write-only file collecting what the parquet writer produced so far.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        """
+        Return & forget what was written since the last call.
+        """
+        res = b''.join(self.parts)
+        self.parts = []
+        return res
+
+
+def iter_parquet(database, sensor, start=None, end=None, chunk_size=10000,
+                 profile=None):
+    """
+    Yield the rows as parquet file - one row group per chunk.
+    """
+    if pyarrow is None:
+        raise NotImplementedError('pyarrow is not available.')
+    rows = iter_rows(database, sensor, start, end, chunk_size, profile)
+    header = next(rows)
+    schema = pyarrow.schema(
+        [('timestamp', pyarrow.timestamp('ms', tz='UTC'))] +
+        [(item[0], ARROW_TYPES.get(item[1], pyarrow.string()))
+         for item in header[1:]])
+
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for chunk in rows:
+        columns = list(zip(*chunk))
+        arrays = [pyarrow.array(columns[0], pyarrow.int64())]
+        arrays += [pyarrow.array(item, schema.field(i).type)
+                   for i, item in enumerate(columns[1:], 1)]
+        arrays[0] = arrays[0].cast(schema.field(0).type)
+        writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+EXPORTERS = {'csv': iter_csv, 'parquet': iter_parquet}
@@ -0,0 +1,141 @@
+"""
+Live feed of new samples - one shared tail query for all open dashboards.
+"""
+
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from iot import storage
+
+
+class ChangeNotifier(threading.Thread):
+    """
+    Poll PRAGMA data_version every interval seconds; if another connection
+    committed, read the samples newer than the last ones seen (one query per
+    sensor table) and publish them as one event.
+
+    Events are kept in a ring buffer of size backlog. Each is serialized to
+    JSON once and handed to every waiting reader.
+    """
+
+    def __init__(self, database, interval=2.0, profile=None, backlog=100):
+        super().__init__()
+        self.daemon = True
+        self.database = database
+        self.interval = interval
+        self.profile = profile
+        self.events = collections.deque(maxlen=backlog)
+        self.seq = 0
+        self.latest = {}
+        self.stop = False
+        self._version = None
+        self._cond = threading.Condition()
+
+    def poll(self, conn):
+        """
+        Publish the new samples if the database changed - returns the number
+        of samples published.
+        """
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self._version:
+            return 0
+        first = self._version is None
+        self._version = version
+
+        samples = []
+        schema = storage.REGISTRY.schema(conn, self.database)
+        for name in schema.tables:
+            version, columns = schema.table_info(name)
+            scale = storage.TS_SCALE[version]
+            if first:
+                # only what is inserted from now on.
+                tmp = conn.execute(f'SELECT MAX(timestamp) FROM {name}')
+                self.latest[name] = tmp.fetchone()[0] or 0
+                continue
+            names = [item[0] for item in columns]
+            select = ''.join(f', {item}' for item in names)
+            rows = conn.execute(f'SELECT timestamp{select} FROM {name} '
+                                f'WHERE timestamp > '
+                                f'{self.latest.get(name, 0)} '
+                                f'ORDER BY timestamp')
+            for row in rows.fetchall():
+                samples.append({'sensor': name,
+                                't': row[0] * 1000 // scale,
+                                'values': dict(zip(names, row[1:]))})
+                self.latest[name] = row[0]
+        if samples:
+            self.publish(json.dumps({'samples': samples}))
+        return len(samples)
+
+    def publish(self, payload):
+        """
+        Add an event and wake up all readers.
+        """
+        with self._cond:
+            self.seq += 1
+            self.events.append((self.seq, payload))
+            self._cond.notify_all()
+
+    def wait(self, after, timeout=None):
+        """
+        Return the (id, payload) events newer than the id after - waits up to
+        timeout seconds if there are none yet.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > after or self.stop,
+                                timeout)
+            return [item for item in self.events if item[0] > after]
+
+    def run(self):
+        conn = storage.connect(self.database, self.profile)
+        try:
+            while not self.stop:
+                try:
+                    self.poll(conn)
+                except sqlite3.Error as err:
+                    logging.warning('Polling for new samples failed: %s.',
+                                    err)
+                with self._cond:
+                    self._cond.wait_for(lambda: self.stop, self.interval)
+        finally:
+            conn.close()
+
+    def close(self):
+        """
+        Stop polling - open streams end.
+        """
+        with self._cond:
+            self.stop = True
+            self._cond.notify_all()
+        if self.is_alive():
+            self.join()
+
+
+def iter_events(notifier, last_id=0, keepalive=15, duration=None):
+    """
+    Yield the events of the notifier newer than last_id formatted as
+    server-sent events.
+
+    A comment is sent every keepalive seconds without events; the stream
+    ends after duration seconds (if given) - browsers reconnect and send
+    the last event id.
+    """
+    # ids of an earlier run of the server.
+    last_id = min(last_id, notifier.seq)
+    deadline = None if duration is None else time.monotonic() + duration
+    yield f'retry: {int(notifier.interval * 1000)}\n\n'
+    while not notifier.stop:
+        timeout = keepalive
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                break
+        events = notifier.wait(last_id, timeout)
+        if not events:
+            yield ': keep-alive\n\n'
+        for last_id, payload in events:
+            yield f'id: {last_id}\nevent: samples\ndata: {payload}\n\n'
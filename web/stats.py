@@ -0,0 +1,175 @@
+"""
+Statistics over arbitrary time ranges - without loading them into memory.
+"""
+
+import datetime
+import math
+
+import numpy as np
+
+from iot import storage
+
+# bucket width (in seconds) of the daily min/max.
+DAY = 86400
+
+
+class Histogram:
+    """
+    Streaming percentile estimate - values are counted into a fixed number
+    of bins between a known min and max, so memory stays constant and the
+    error is at most one bin width.
+    """
+
+    def __init__(self, low, high, bins=4096):
+        self.low = low
+        self.high = high
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values):
+        """
+        Add a chunk of values (NaN are ignored).
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        # np.histogram needs a non-empty range.
+        high = self.high if self.high > self.low else self.low + 1
+        tmp, _ = np.histogram(values, bins=len(self.counts),
+                              range=(self.low, high))
+        self.counts += tmp
+
+    def quantile(self, value):
+        """
+        Return the estimated quantile (0 <= value <= 1).
+        """
+        total = self.counts.sum()
+        if total == 0:
+            return None
+        cumulative = np.cumsum(self.counts)
+        rank = value * total
+        idx = int(np.searchsorted(cumulative, rank))
+        idx = min(idx, len(self.counts) - 1)
+        before = cumulative[idx - 1] if idx > 0 else 0
+        # interpolate linearly within the bin.
+        frac = (rank - before) / self.counts[idx] if self.counts[idx] else 0
+        width = (self.high - self.low) / len(self.counts)
+        return float(min(max(self.low + (idx + frac) * width, self.low),
+                         self.high))
+
+
+def _to_day(value):
+    tmp = datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+    return tmp.strftime('%Y-%m-%d')
+
+
+def _summary(count, mean, m2, low, high):
+    if not count:
+        return {'count': 0, 'mean': None, 'min': None, 'max': None,
+                'stddev': None}
+    return {'count': count, 'mean': mean, 'min': low, 'max': high,
+            'stddev': math.sqrt(max(m2 / count, 0.0))}
+
+
+def _merge(values):
+    """
+    Merge (count, sum, m2) of the days as by Chan et al. - returns count,
+    mean & m2 (sum of squared deviations from the mean).
+    """
+    count, mean, m2 = 0, 0.0, 0.0
+    for num, total, tmp in values:
+        if not num:
+            continue
+        delta = total / num - mean
+        mean += delta * num / (count + num)
+        m2 += tmp + delta * delta * count * num / (count + num)
+        count += num
+    return count, mean, m2
+
+
+def get_stats(sensor, start, end, percentiles=(), chunk_size=10000):
+    """
+    Return count, mean, min, max, stddev and daily min/max per numeric column
+    of a SensorData object for start < timestamp <= end (epoch seconds).
+
+    Per day sums are taken from the rollup tables where possible - only the
+    raw rows not covered by a full rollup bucket are read. Percentiles (e.g.
+    50, 99) need one streaming pass over the raw rows.
+    """
+    start = int(start)
+    end = int(end)
+    schema = sensor.schema()
+    version, columns = schema.table_info(sensor.name)
+    scale = storage.TS_SCALE[version]
+    names = storage.rollup_columns(columns)
+    if not names:
+        return {}
+
+    # coarsest rollup with at least one full bucket in the window.
+    rollup = None
+    for item in schema.rollup_widths(sensor.name):
+        if start // item + 1 < end // item:
+            rollup = item
+    if rollup is not None:
+        pieces = sensor.rollup_pieces(start, end, scale, DAY, rollup, names)
+    else:
+        tmp = ''.join(f', {item} IS NOT NULL AS {item}_count, '
+                      f'{item} AS {item}_sum, {item} * 0.0 AS {item}_m2, '
+                      f'{item} AS {item}_min, {item} AS {item}_max'
+                      for item in names)
+        pieces = f'SELECT (timestamp / {DAY * scale}) * {DAY} AS bucket' \
+                 f'{tmp} FROM {sensor.name} WHERE ' \
+                 f'timestamp > {start * scale} AND ' \
+                 f'timestamp <= {end * scale}'
+    # m2 of a day: that of its pieces plus their spread around the day's
+    # mean - no sums of squares, which cancel out for large values.
+    devs = ''.join(f', {item}_count, {item}_sum, {item}_m2, {item}_min, '
+                   f'{item}_max, {item}_sum * 1.0 / {item}_count - '
+                   f'TOTAL({item}_sum) OVER day / SUM({item}_count) OVER day '
+                   f'AS _d_{item}' for item in names)
+    select = ''.join(f', SUM({item}_count), TOTAL({item}_sum), '
+                     f'TOTAL({item}_m2) + TOTAL({item}_count * _d_{item} * '
+                     f'_d_{item}), MIN({item}_min), MAX({item}_max)'
+                     for item in names)
+    tmp = f'SELECT bucket{select} FROM (SELECT bucket{devs} FROM ' \
+          f'({pieces}) WINDOW day AS (PARTITION BY bucket)) ' \
+          f'GROUP BY bucket ORDER BY bucket'
+    days = sensor.conn.execute(tmp).fetchall()
+
+    res = {}
+    for i, item in enumerate(names):
+        # count, sum, m2, min & max - NULL values are not counted.
+        values = [row[1 + i * 5:6 + i * 5] for row in days]
+        lows = [row[3] for row in values if row[3] is not None]
+        highs = [row[4] for row in values if row[4] is not None]
+        res[item] = _summary(*_merge(row[:3] for row in values),
+                             min(lows, default=None),
+                             max(highs, default=None))
+        res[item]['daily'] = {_to_day(row[0]): list(value[3:])
+                              for row, value in zip(days, values)}
+
+    if percentiles:
+        _add_percentiles(sensor, start * scale, end * scale, names, res,
+                         percentiles, chunk_size)
+    return res
+
+
+def _add_percentiles(sensor, low, high, names, res, percentiles,
+                     chunk_size):
+    hists = {item: Histogram(res[item]['min'], res[item]['max'])
+             for item in names if res[item]['count']}
+    if hists:
+        cur = sensor.conn.execute(f'SELECT {", ".join(hists)} '
+                                  f'FROM {sensor.name} WHERE '
+                                  f'timestamp > {low} AND timestamp <= {high}')
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            tmp = np.array(rows, dtype=float)
+            for i, hist in enumerate(hists.values()):
+                hist.update(tmp[:, i])
+        cur.close()
+    for item in names:
+        hist = hists.get(item)
+        res[item]['percentiles'] = {
+            f'{value:g}': hist.quantile(value / 100.0) if hist else None
+            for value in percentiles}
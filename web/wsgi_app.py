@@ -3,24 +3,60 @@ WSGI app.
 """
 
 import datetime
+import email.utils
+import hashlib
+import math
 import os
+import threading
 import time
 
 import bottle
 
+from iot import instrument
+from iot import storage
 from web import data_proc
+from web import downsample
+from web import export
+from web import live
+from web import stats
 
 PASSPHRASE = os.urandom(2048)
 
+# upper bound for the points per series the api returns.
+MAX_POINTS = 10000
+# seconds browsers may use static files without asking again.
+STATIC_MAX_AGE = 3600
+# seconds after which live feeds end (and the browser reconnects).
+STREAM_DURATION = 300
+# live feeds open at the same time - each holds a thread of the server pool.
+MAX_STREAMS = 4
+# seconds browsers are asked to wait if all live feeds are taken.
+STREAM_RETRY = 60
+
+RENDER_TIME = instrument.histogram(
+    'web_index_render_seconds', 'Time to build & render the dashboard.')
+SERIES_TIME = instrument.histogram(
+    'web_series_seconds', 'Time to query & downsample the series api.')
+
 
 class MainApp:
     """
     The main WSGI web app.
     """
 
-    def __init__(self, database, timeslice, sample_rate, user, passwd):
+    def __init__(self, database, timeslice, sample_rate, user, passwd,
+                 profile=None, aggregate=None, cache=None, notifier=None,
+                 pool=None, max_streams=MAX_STREAMS):
         self.app = bottle.Bottle()
         self.database = database
+        self.profile = profile
+        self.aggregate = aggregate
+        self.cache = cache
+        self.notifier = notifier
+        self.pool = pool
+        self.max_streams = max_streams
+        self.streams = 0
+        self._lock = threading.Lock()
         self.timeslice = timeslice
         self.sample_rate = sample_rate
         self.user = user
@@ -33,16 +69,48 @@ class MainApp:
         Setup routes.
         """
         self.app.route('/', method="GET", callback=self._index_page)
+        self.app.route('/api/series', method="GET", callback=self._series)
         self.app.route('/login', callback=self._login)
         self.app.route('/login', callback=self._do_login, method='POST')
         self.app.route('/static/<filename:path>', callback=self._static)
-        # TODO: add download
-        # TODO: add statistics.
+        self.app.route('/download/<sensor>', method="GET",
+                       callback=self._download)
+        self.app.route('/api/stats/<sensor>', method="GET",
+                       callback=self._stats)
+        self.app.route('/stream', method="GET", callback=self._stream)
+        self.app.route('/metrics', method="GET", callback=self._metrics)
 
     def _check_login(self, user, pwd):
         # FIXME: poor approach.
         return user == self.user and pwd == self.passwd
 
+    def _not_modified(self):
+        """
+        Set ETag & Last-Modified from the newest sample of each sensor -
+        returns True if the client's copy is still up to date.
+        """
+        latest = data_proc.get_latest(self.database, self.profile)
+        tmp = ','.join(f'{key}={val}' for key, val in sorted(latest.items()))
+        tmp += bottle.request.path + '?' + bottle.request.query_string
+        etag = f'"{hashlib.sha1(tmp.encode()).hexdigest()[:20]}"'
+        bottle.response.set_header('ETag', etag)
+        bottle.response.set_header('Cache-Control', 'private, no-cache')
+        newest = max((item for item in latest.values() if item is not None),
+                     default=None)
+        if newest is not None:
+            bottle.response.set_header(
+                'Last-Modified', email.utils.formatdate(newest, usegmt=True))
+
+        check = bottle.request.get_header('If-None-Match')
+        if check is not None:
+            tags = [item.strip() for item in check.split(',')]
+            return etag in tags or '*' in tags
+        since = bottle.request.get_header('If-Modified-Since')
+        if since is not None and newest is not None:
+            since = bottle.parse_date(since.split(';')[0].strip())
+            return since is not None and since >= int(newest)
+        return False
+
     @bottle.view('login.tmpl')
     def _login(self):
         return None
@@ -56,49 +124,209 @@ class MainApp:
         else:
             return "<p>Login failed.</p>"
 
+    @instrument.timed(RENDER_TIME)
     @bottle.view('index.tmpl')
     def _index_page(self):
         username = bottle.request.get_cookie("account", secret=PASSPHRASE)
         if username:
-            # FIXME: add more colors here :-)
-            colors = ['#95b143', '#444', '#95b143', '#444']
+            if self._not_modified():
+                bottle.response.status = 304
+                return ''
 
-            utcnow = datetime.datetime.utcnow()
-            end = time.mktime(utcnow.timetuple())
-            start = end - self.timeslice
-
-            data = data_proc.get_data(self.database,
-                                      start,
-                                      end,
-                                      self.sample_rate)
-
-            titles = []
-            datasets = {}
-            for key, val in data.items():
-                titles.append(key)
-                temp = val
-                data1 = {'labels': [str(x) for x in
-                                    temp.index.strftime('%H:%M:%S').tolist()],
-                         'datasets': []}
-                i = 0
-                for column in list(temp):
-                    series = {'label': str(column),
-                              'data': temp[column].tolist(),
-                              'fill': 'false',
-                              'borderColor': colors[i]}
-                    data1['datasets'].append(series)
-                    i += 1
-                datasets[key] = data1
+            # the charts fetch their data from the JSON api.
+            titles = data_proc.get_columns(self.database, self.profile)
 
             return {'titles': titles,
-                    'datasets': datasets,
-                    'time': str(datetime.datetime.fromtimestamp(end))}
+                    'time': bottle.response.get_header('Last-Modified', '-'),
+                    'timeslice': self.timeslice,
+                    'live': self.notifier is not None}
         return bottle.redirect("/login")
 
+    @instrument.timed(SERIES_TIME)
+    def _series(self):
+        """
+        Columnar time series - downsampled to a point budget.
+
+        Query parameters: metric (all if not given), start & end (epoch
+        seconds), points (per series) and method (lttb or minmax).
+        """
+        username = bottle.request.get_cookie("account", secret=PASSPHRASE)
+        if not username:
+            bottle.response.status = 401
+            return {'error': 'Login required.'}
+
+        query = bottle.request.query
+        try:
+            utcnow = datetime.datetime.utcnow()
+            end = float(query.get('end', time.mktime(utcnow.timetuple())))
+            start = float(query.get('start', end - self.timeslice))
+            points = min(int(query.get('points', 1000)), MAX_POINTS)
+        except ValueError:
+            bottle.response.status = 400
+            return {'error': 'start, end and points should be numbers.'}
+        if not math.isfinite(start) or not math.isfinite(end):
+            bottle.response.status = 400
+            return {'error': 'start and end should be finite.'}
+        if points < 1:
+            bottle.response.status = 400
+            return {'error': 'points should be at least 1.'}
+        method = query.get('method', 'lttb')
+        if method not in downsample.METHODS:
+            bottle.response.status = 400
+            return {'error': f'method should be one of '
+                             f'{list(downsample.METHODS)}.'}
+        # the result only changes with new samples.
+        if self._not_modified():
+            bottle.response.status = 304
+            return ''
+
+        data = data_proc.get_data(self.database,
+                                  start,
+                                  end,
+                                  self.sample_rate,
+                                  self.profile,
+                                  self.aggregate,
+                                  # the cache only follows the live window.
+                                  cache=None if 'start' in query or
+                                  'end' in query else self.cache,
+                                  pool=self.pool)
+        metric = query.get('metric')
+        if metric is not None:
+            data = {metric: data[metric]} if metric in data else {}
+
+        return {'end': end,
+                'metrics': {key: downsample.to_columns(val, points, method)
+                            for key, val in data.items()}}
+
+    def _download(self, sensor):
+        """
+        Stream the raw data of a sensor as CSV (or parquet).
+
+        Query parameters: start & end (epoch seconds) and format.
+        """
+        username = bottle.request.get_cookie("account", secret=PASSPHRASE)
+        if not username:
+            return bottle.redirect("/login")
+
+        query = bottle.request.query
+        fmt = query.get('format', 'csv')
+        if fmt not in export.FORMATS:
+            return bottle.HTTPError(400, f'format should be one of '
+                                         f'{list(export.FORMATS)}.')
+        try:
+            start = float(query['start']) if 'start' in query else None
+            end = float(query['end']) if 'end' in query else None
+        except ValueError:
+            return bottle.HTTPError(400, 'start and end should be numbers.')
+        if sensor not in data_proc.SensorFactory(
+                self.database, self.sample_rate,
+                self.profile).get_sensor_names():
+            return bottle.HTTPError(404, f'Unknown sensor: {sensor}.')
+
+        bottle.response.content_type = export.CONTENT_TYPES[fmt]
+        bottle.response.set_header('Content-Disposition',
+                                   f'attachment; filename="{sensor}.{fmt}"')
+        return export.EXPORTERS[fmt](self.database, sensor, start, end,
+                                     profile=self.profile)
+
+    def _stats(self, sensor):
+        """
+        Summary statistics of a sensor - computed by SQLite.
+
+        Query parameters: start & end (epoch seconds) and percentiles (comma
+        separated, e.g. 50,90,99).
+        """
+        username = bottle.request.get_cookie("account", secret=PASSPHRASE)
+        if not username:
+            bottle.response.status = 401
+            return {'error': 'Login required.'}
+
+        query = bottle.request.query
+        try:
+            utcnow = datetime.datetime.utcnow()
+            end = float(query.get('end', time.mktime(utcnow.timetuple())))
+            start = float(query.get('start', end - self.timeslice))
+            percentiles = [float(item) for item in
+                           query.get('percentiles', '').split(',') if item]
+        except ValueError:
+            bottle.response.status = 400
+            return {'error': 'start, end and percentiles should be numbers.'}
+        if not math.isfinite(start) or not math.isfinite(end):
+            bottle.response.status = 400
+            return {'error': 'start and end should be finite.'}
+        if any(item < 0 or item > 100 for item in percentiles):
+            bottle.response.status = 400
+            return {'error': 'percentiles should be between 0 and 100.'}
+        sensors = data_proc.SensorFactory(self.database, self.sample_rate,
+                                          self.profile).get_sensor_names()
+        if sensor not in sensors:
+            bottle.response.status = 404
+            return {'error': f'Unknown sensor: {sensor}.'}
+
+        with storage.REGISTRY.connection(self.database, self.profile) as conn:
+            tmp = data_proc.SensorData(sensor, self.database,
+                                       self.sample_rate, conn=conn)
+            res = stats.get_stats(tmp, start, end, percentiles)
+        return {'start': start, 'end': end, 'stats': res}
+
+    def _stream(self):
+        """
+        Server-sent events with the samples inserted from now on.
+
+        Each open stream holds a server thread, so at most max_streams are
+        served at the same time - further clients get a 503 and should try
+        again later.
+        """
+        username = bottle.request.get_cookie("account", secret=PASSPHRASE)
+        if not username:
+            return bottle.HTTPError(401, 'Login required.')
+        if self.notifier is None:
+            return bottle.HTTPError(404, 'Live feed not enabled.')
+        try:
+            last_id = int(bottle.request.get_header('Last-Event-ID', 0))
+        except ValueError:
+            last_id = 0
+
+        with self._lock:
+            busy = self.streams >= self.max_streams
+            if not busy:
+                self.streams += 1
+        if busy:
+            return bottle.HTTPError(503, 'Too many live feeds.',
+                                    headers={'Retry-After':
+                                             str(STREAM_RETRY)})
+        bottle.response.content_type = 'text/event-stream'
+        bottle.response.set_header('Cache-Control', 'no-cache')
+        return self._events(last_id)
+
+    def _events(self, last_id):
+        """
+        The events of a stream - frees its slot when it ends or is closed.
+        """
+        try:
+            # reconnect now & then.
+            yield from live.iter_events(self.notifier, last_id,
+                                        duration=STREAM_DURATION)
+        finally:
+            with self._lock:
+                self.streams -= 1
+
+    def _metrics(self):
+        """
+        Instrumentation in the Prometheus text format - only if collecting
+        is enabled. No login needed so scrapers can reach it.
+        """
+        if not instrument.ENABLED:
+            return bottle.HTTPError(404, 'Metrics not enabled.')
+        bottle.response.content_type = 'text/plain; version=0.0.4; ' \
+                                       'charset=utf-8'
+        return instrument.render()
+
     def _static(self, filename):
         username = bottle.request.get_cookie("account", secret=PASSPHRASE)
-        if username:
-            return bottle.static_file(filename, root='views/static/')
-        elif filename == 'style.css':
-            return bottle.static_file(filename, root='views/static/')
+        if username or filename == 'style.css':
+            res = bottle.static_file(filename, root='views/static/')
+            res.set_header('Cache-Control', f'private, max-age='
+                                            f'{STATIC_MAX_AGE}')
+            return res
         return bottle.redirect("/login")